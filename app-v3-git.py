@@ -1,28 +1,214 @@
-from flask import Flask, request, jsonify, render_template_string
+import time
+# Startup clock, read before the other imports so the startup report covers the whole module load
+STARTUP_STARTED = time.perf_counter()
+from flask import Flask, request, jsonify, render_template_string, Response, stream_with_context
 import os
+import sys
+import importlib
 from dotenv import load_dotenv
-from langchain_openai.embeddings import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import StrOutputParser
-from langchain.prompts import ChatPromptTemplate
-from langchain_community.document_loaders import TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
-import pandas as pd
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-import io
-from googleapiclient.http import MediaIoBaseDownload
 import json
+import threading
+import argparse
+import logging
+import random
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import csv
+import re
+from dataclasses import dataclass, field, fields
+from collections import OrderedDict
+import itertools
+import hashlib
+import copy
+import shutil
+import sqlite3
+import secrets
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+import unicodedata
+import difflib
 
 app = Flask(__name__)
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger("rag_jobs")
+
+# Model responses are only logged when RAG_LOG_RESPONSES=1, or for a sampled fraction of calls
+LOG_RESPONSES = os.getenv('RAG_LOG_RESPONSES', '0') == '1'
+LOG_RESPONSE_SAMPLE_RATE = float(os.getenv('RAG_LOG_RESPONSE_SAMPLE_RATE', 0))
+
+# Startup report: time to each startup phase, and the cost of each lazily imported module in first-use order
+startup_timings = {}
+lazy_import_timings = OrderedDict()
+_lazy_import_lock = threading.RLock()
+
+# Function to record the time from process start to a startup phase (only its first occurrence counts)
+def mark_startup(phase):
+    elapsed = time.perf_counter() - STARTUP_STARTED
+    if f"{phase}_ms" not in startup_timings:
+        startup_timings[f"{phase}_ms"] = round(elapsed * 1000, 1)
+
+# Function to import a module on first use, recording its import cost in the startup report
+def timed_import(name):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    with _lazy_import_lock:
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        if name not in lazy_import_timings:
+            lazy_import_timings[name] = {"import_ms": round((time.perf_counter() - start) * 1000, 1),
+                                         "at_ms": round((start - STARTUP_STARTED) * 1000, 1)}
+    return module
+
+# Function to import an optional dependency on first use, or None when it is not installed
+def optional_import(name):
+    try:
+        return timed_import(name)
+    except ImportError:
+        return None
+
+# Stand-in for a heavy module, imported on the first attribute access
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('__'):
+            raise AttributeError(attribute)
+        if self._module is None:
+            self._module = timed_import(self._name)
+        return getattr(self._module, attribute)
+
+# Stand-in for an expensive object (model client, prompt template), built on first use. Attributes
+# given up front (e.g. the model name used in cache keys) are answered without building it.
+class LazyObject:
+    def __init__(self, factory, **attributes):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+        self.__dict__.update(attributes)
+
+    def _resolve(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('__'):
+            raise AttributeError(attribute)
+        return getattr(self._resolve(), attribute)
+
+# Heavy dependencies, only imported by the code paths that need them
+sparse = LazyModule('scipy.sparse')
+sklearn_text = LazyModule('sklearn.feature_extraction.text')
+sklearn_pairwise = LazyModule('sklearn.metrics.pairwise')
+sklearn_preprocessing = LazyModule('sklearn.preprocessing')
+langchain_openai = LazyModule('langchain_openai')
+langchain_messages = LazyModule('langchain_core.messages')
+langchain_parsers = LazyModule('langchain_core.output_parsers')
+langchain_prompts = LazyModule('langchain.prompts')
+google_credentials = LazyModule('google.oauth2.credentials')
+google_auth_requests = LazyModule('google.auth.transport.requests')
+google_auth_flow = LazyModule('google_auth_oauthlib.flow')
+drive_discovery = LazyModule('googleapiclient.discovery')
+drive_http = LazyModule('googleapiclient.http')
+
+# Prometheus metrics live in their own registry, exposed on /metrics. prometheus_client is only imported,
+# and each metric only registered, on first use.
+prometheus = LazyModule('prometheus_client')
+metrics_registry = LazyObject(lambda: prometheus.CollectorRegistry())
+lazy_metrics = []
+
+# Function to declare a metric, created in the metrics registry on first use
+def lazy_metric(kind, name, documentation, labels=(), **options):
+    metric = LazyObject(lambda: getattr(prometheus, kind)(name, documentation, labels,
+                                                          registry=metrics_registry._resolve(), **options))
+    lazy_metrics.append(metric)
+    return metric
+
+STAGE_SECONDS = lazy_metric('Histogram', 'rag_stage_duration_seconds', 'Duration of pipeline stages.',
+                            ['stage', 'cache'],
+                            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+STAGE_ERRORS = lazy_metric('Counter', 'rag_stage_errors_total', 'Pipeline stages that raised an exception.',
+                           ['stage'])
+LLM_TOKENS = lazy_metric('Counter', 'rag_llm_tokens_total', 'Tokens sent to and generated by the model.',
+                         ['stage', 'kind'])
+LLM_CACHE_REQUESTS = lazy_metric('Counter', 'rag_llm_cache_requests_total', 'LLM response cache lookups by result.',
+                                 ['stage', 'result'])
+CONTEXT_TOKENS_SAVED = lazy_metric('Counter', 'rag_context_tokens_saved_total',
+                                   'Prompt tokens saved by context packing.', ['corpus'])
+INDEX_VERSION = lazy_metric('Gauge', 'rag_index_version',
+                            'Version of the served corpus index, incremented on each hot swap.')
+INDEX_BUILD_TIMESTAMP = lazy_metric('Gauge', 'rag_index_build_timestamp_seconds',
+                                    'Build time of each served corpus index.', ['corpus'])
+INDEX_RELOADS = lazy_metric('Counter', 'rag_index_reloads_total', 'Corpus index reloads by result.', ['result'])
+DRIVE_SYNCS = lazy_metric('Counter', 'rag_drive_syncs_total', 'Google Drive corpus syncs by result.', ['result'])
+DRIVE_BYTES = lazy_metric('Counter', 'rag_drive_downloaded_bytes_total', 'Bytes downloaded from Google Drive.')
+SEMANTIC_CACHE_REQUESTS = lazy_metric('Counter', 'rag_semantic_cache_requests_total',
+                                      'Semantic answer cache lookups (retrieval, answer) and invalidations, by result.',
+                                      ['kind', 'result'])
+SEMANTIC_CACHE_ENTRIES = lazy_metric('Gauge', 'rag_semantic_cache_entries',
+                                     'Entries in the semantic answer cache.')
+LLM_GATEWAY_EVENTS = lazy_metric('Counter', 'rag_llm_gateway_events_total',
+                                 'LLM gateway calls, retries, hedges and rejections.', ['event'])
+LLM_IN_FLIGHT = lazy_metric('Gauge', 'rag_llm_in_flight', 'Model calls in flight.')
+LLM_QUEUED = lazy_metric('Gauge', 'rag_llm_queued', 'Model calls waiting for the limiter.')
+SECTOR_FILTERS = lazy_metric('Counter', 'rag_sector_filters_total',
+                             'fiches-metiers retrievals by sector filter source.', ['source'])
+STARTUP_SECONDS = lazy_metric('Gauge', 'rag_startup_seconds', 'Seconds from process start to each startup phase.',
+                              ['phase'])
+
+mark_startup("imports")
+
+# Function to estimate the number of prompt tokens of a text (about four characters per token)
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+# Timing span around one pipeline stage; callers can add attributes (cache result, token counts)
+@contextmanager
+def span(stage, **attributes):
+    attributes.setdefault("cache", "none")
+    attributes["stage"] = stage
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        attributes["error"] = True
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage, attributes["cache"]).observe(duration)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps({"span": stage, "duration_ms": round(duration * 1000, 3), **attributes}, default=str))
+
+# Function to log a model response, only behind the debug switch or the sampling rate
+def log_model_response(stage, model_response):
+    if LOG_RESPONSES or (LOG_RESPONSE_SAMPLE_RATE and random.random() < LOG_RESPONSE_SAMPLE_RATE):
+        logger.info("%s response: %s", stage, getattr(model_response, 'content', model_response))
+
+# Function to count prompt and completion tokens, from the provider usage when it is reported
+def record_token_usage(attributes, formatted_prompt, model_response=None, completion_text=None):
+    usage = getattr(model_response, 'response_metadata', {}).get('token_usage') or {}
+    usage_metadata = getattr(model_response, 'usage_metadata', None) or {}
+    prompt_tokens = usage.get('prompt_tokens') or usage_metadata.get('input_tokens') or estimate_tokens(formatted_prompt)
+    if completion_text is None:
+        completion_text = getattr(model_response, 'content', '') or ''
+    completion_tokens = usage.get('completion_tokens') or usage_metadata.get('output_tokens') or estimate_tokens(completion_text)
+    attributes["prompt_tokens"] = prompt_tokens
+    attributes["completion_tokens"] = completion_tokens
+    LLM_TOKENS.labels(attributes["stage"], "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(attributes["stage"], "completion").inc(completion_tokens)
+
 # Explicitly set the correct API key
 OPENAI_API_KEY = "sk-None-BxxxxxxxxxxxxxxxxX"
 if not OPENAI_API_KEY:
@@ -33,69 +219,2786 @@ if not OPENAI_API_KEY:
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 GOOGLE_DRIVE_FILE_ID = 'UJkS8QxxxxxxxxxxxxxxxxxxxxxFo'
 
+# Google credentials are cached in a token file; Drive downloads are streamed in chunks of this size
+DRIVE_TOKEN_PATH = os.getenv('RAG_DRIVE_TOKEN_PATH', 'token.json')
+DRIVE_CHUNK_SIZE = int(os.getenv('RAG_DRIVE_CHUNK_SIZE', 4 * 1024 * 1024))
+DRIVE_SYNC_INTERVAL = float(os.getenv('RAG_DRIVE_SYNC_INTERVAL', 300))
+# Drive file IDs of the corpora; a corpus without one is only read from its local file
+DRIVE_FILE_IDS = {
+    "fiches_metiers": os.getenv('RAG_DRIVE_FICHES_METIERS_ID'),
+    "jobs_json": os.getenv('RAG_DRIVE_JOBS_JSON_ID'),
+}
+
+# Function to load the cached Google credentials, refreshing them or running the consent flow only when needed
+def load_google_credentials(token_path=DRIVE_TOKEN_PATH):
+    creds = None
+    if os.path.exists(token_path):
+        creds = google_credentials.Credentials.from_authorized_user_file(token_path, SCOPES)
+    if creds and creds.valid:
+        return creds
+    if creds and creds.expired and creds.refresh_token:
+        creds.refresh(google_auth_requests.Request())
+    else:
+        flow = google_auth_flow.InstalledAppFlow.from_client_secrets_file(
+            'credentials.json', SCOPES)
+        creds = flow.run_local_server(port=0)
+    with open(token_path, 'w', encoding='utf-8') as token:
+        token.write(creds.to_json())
+    return creds
+
+_drive_service = None
+_drive_service_lock = threading.Lock()
+
 # Function to authenticate and create a Google Drive API service
 def authenticate_google_drive():
-    """Authenticate and create a service client for Google Drive."""
-    flow = InstalledAppFlow.from_client_secrets_file(
-        'credentials.json', SCOPES)
-    creds = flow.run_local_server(port=0)
-    service = build('drive', 'v3', credentials=creds)
-    return service
-
-# Function to download file from Google Drive
-def download_file_from_drive(file_id):
-    service = authenticate_google_drive()
-    request = service.files().get_media(fileId=file_id)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-    fh.seek(0)
-    file_content = fh.read().decode('utf-8')
-    return file_content
-
-# Create an instance of the ChatOpenAI model
-model = ChatOpenAI(openai_api_key=OPENAI_API_KEY, model="gpt-4o-mini")
+    """Authenticate and create a service client for Google Drive, once per process."""
+    global _drive_service
+    if _drive_service is None:
+        with _drive_service_lock:
+            if _drive_service is None:
+                _drive_service = drive_discovery.build('drive', 'v3', credentials=load_google_credentials(), cache_discovery=False)
+    return _drive_service
+
+# File wrapper that hashes the bytes written through it
+class DigestWriter:
+    def __init__(self, file, digest):
+        self.file = file
+        self.digest = digest
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+# Mirrors one Drive file into a local snapshot file. A sync first fetches the file's metadata and skips
+# the download when its md5Checksum (or, for files without one, modifiedTime) matches the last synced
+# version. Otherwise the content is streamed chunk by chunk into a temporary file, checked against
+# md5Checksum and moved over the snapshot, so readers only ever see a complete file
+class DriveSync:
+    def __init__(self, file_id, snapshot_path, service=None, chunk_size=DRIVE_CHUNK_SIZE):
+        self.file_id = file_id
+        self.snapshot_path = snapshot_path
+        # Drive service to use instead of the authenticated one, e.g. a local fake
+        self.service = service
+        self.chunk_size = chunk_size
+        self.state_path = snapshot_path + '.drive.json'
+
+    def load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def is_current(self, metadata, state):
+        if state.get("id") != self.file_id or not os.path.exists(self.snapshot_path):
+            return False
+        if metadata.get("md5Checksum"):
+            return metadata["md5Checksum"] == state.get("md5Checksum")
+        return metadata.get("modifiedTime") == state.get("modifiedTime")
+
+    def download(self, service):
+        part_path = self.snapshot_path + '.part'
+        os.makedirs(os.path.dirname(part_path) or '.', exist_ok=True)
+        with open(part_path, 'wb') as file:
+            writer = DigestWriter(file, hashlib.md5())
+            downloader = drive_http.MediaIoBaseDownload(writer, service.files().get_media(fileId=self.file_id), chunksize=self.chunk_size)
+            done = False
+            while not done:
+                _, done = downloader.next_chunk(num_retries=3)
+        return part_path, writer
+
+    # Function to bring the snapshot up to date; returns True when a new version was downloaded
+    def sync(self):
+        service = self.service or authenticate_google_drive()
+        with span("drive_sync", file_id=self.file_id) as attributes:
+            metadata = service.files().get(fileId=self.file_id, fields="id,name,modifiedTime,md5Checksum,size").execute()
+            state = self.load_state()
+            if self.is_current(metadata, state):
+                attributes["changed"] = False
+                DRIVE_SYNCS.labels(result="unchanged").inc()
+                return False
+            part_path, writer = self.download(service)
+            if metadata.get("md5Checksum") and writer.digest.hexdigest() != metadata["md5Checksum"]:
+                os.remove(part_path)
+                raise ValueError(f"Checksum mismatch for Drive file '{self.file_id}'.")
+            os.replace(part_path, self.snapshot_path)
+            attributes.update(changed=True, bytes=writer.size)
+        DRIVE_SYNCS.labels(result="downloaded").inc()
+        DRIVE_BYTES.inc(writer.size)
+        with open(self.state_path, 'w', encoding='utf-8') as file:
+            json.dump({"id": self.file_id, "modifiedTime": metadata.get("modifiedTime"),
+                       "md5Checksum": metadata.get("md5Checksum"), "size": writer.size}, file)
+        logger.info("Synced Drive file '%s' to %s (%d bytes)", self.file_id, self.snapshot_path, writer.size)
+        return True
+
+# Settings for the LLM gateway in front of the chat model: HTTP connection pool, deadlines, retries,
+# hedging, limiter and circuit breaker. RAG_LLM_BASE_URL points the client at another OpenAI-compatible server.
+LLM_BASE_URL = os.getenv('RAG_LLM_BASE_URL') or None
+LLM_TIMEOUT = float(os.getenv('RAG_LLM_TIMEOUT', 30))
+LLM_CONNECT_TIMEOUT = float(os.getenv('RAG_LLM_CONNECT_TIMEOUT', 5))
+LLM_DEADLINE = float(os.getenv('RAG_LLM_DEADLINE', 60))
+LLM_SHORT_DEADLINE = float(os.getenv('RAG_LLM_SHORT_DEADLINE', 20))
+LLM_MAX_RETRIES = int(os.getenv('RAG_LLM_MAX_RETRIES', 2))
+LLM_BACKOFF = float(os.getenv('RAG_LLM_BACKOFF', 0.5))
+LLM_BACKOFF_MAX = float(os.getenv('RAG_LLM_BACKOFF_MAX', 8))
+LLM_HEDGE_DELAY = float(os.getenv('RAG_LLM_HEDGE_DELAY', 0))
+LLM_MAX_CONCURRENCY = int(os.getenv('RAG_LLM_MAX_CONCURRENCY', 16))
+LLM_RATE = float(os.getenv('RAG_LLM_RATE', 0))
+LLM_BURST = int(os.getenv('RAG_LLM_BURST', 0)) or LLM_MAX_CONCURRENCY
+LLM_MAX_QUEUE = int(os.getenv('RAG_LLM_MAX_QUEUE', 64))
+LLM_BREAKER_FAILURES = int(os.getenv('RAG_LLM_BREAKER_FAILURES', 5))
+LLM_BREAKER_RESET = float(os.getenv('RAG_LLM_BREAKER_RESET', 30))
+
+# Upstream errors worth retrying: timeouts, rate limits and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Raised by the LLM gateway when a call cannot be made or completed; the endpoints report it as an error
+class LLMGatewayError(Exception):
+    pass
+
+# Raised when a call misses its deadline, retries and queueing included
+class LLMDeadlineExceeded(LLMGatewayError):
+    pass
+
+# Raised when the limiter queue is full
+class LLMOverloaded(LLMGatewayError):
+    pass
+
+# Raised while the circuit breaker is open
+class CircuitOpenError(LLMGatewayError):
+    pass
+
+# Function to tell whether a failed model call is worth retrying (and counts against the circuit breaker)
+def is_retryable_llm_error(error):
+    if isinstance(error, (LLMDeadlineExceeded, TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    openai = sys.modules.get('openai')
+    return openai is not None and isinstance(error, openai.APIConnectionError)
+
+# Function to read the Retry-After header of a rate-limited response, in seconds
+def retry_after_seconds(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+# Limits the model calls in flight (semaphore) and their start rate (token bucket). Callers beyond
+# either limit wait in a bounded queue until a slot frees up or their deadline passes.
+class LLMLimiter:
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, rate=LLM_RATE, burst=LLM_BURST, max_queue=LLM_MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.condition = threading.Condition()
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    # Takes a slot, waiting in the queue unless block is False; returns False when a non-blocking call finds none
+    def acquire(self, deadline=None, block=True):
+        with self.condition:
+            queued = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.in_flight < self.max_concurrency and (not self.rate or self.tokens >= 1):
+                        if self.rate:
+                            self.tokens -= 1
+                        self.in_flight += 1
+                        LLM_IN_FLIGHT.set(self.in_flight)
+                        return True
+                    if not block:
+                        return False
+                    if not queued:
+                        if self.waiting >= self.max_queue:
+                            LLM_GATEWAY_EVENTS.labels("overloaded").inc()
+                            raise LLMOverloaded(f"{self.waiting} model calls are already queued.")
+                        self.waiting += 1
+                        queued = True
+                        LLM_QUEUED.set(self.waiting)
+                    timeout = None if deadline is None else deadline - now
+                    if timeout is not None and timeout <= 0:
+                        LLM_GATEWAY_EVENTS.labels("deadline_exceeded").inc()
+                        raise LLMDeadlineExceeded("Deadline exceeded while queued for a model call.")
+                    if self.in_flight < self.max_concurrency:
+                        # Only the rate limit is holding this caller back: wake up when the next token is due
+                        token_wait = (1 - self.tokens) / self.rate
+                        timeout = token_wait if timeout is None else min(timeout, token_wait)
+                    self.condition.wait(timeout)
+            finally:
+                if queued:
+                    self.waiting -= 1
+                    LLM_QUEUED.set(self.waiting)
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            LLM_IN_FLIGHT.set(self.in_flight)
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return {"in_flight": self.in_flight, "queued": self.waiting, "max_concurrency": self.max_concurrency,
+                    "rate": self.rate}
+
+# Circuit breaker: after failure_threshold consecutive upstream failures the circuit opens and calls fail
+# fast. After reset_timeout seconds one trial call goes through (half-open); its outcome closes or reopens it.
+class CircuitBreaker:
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    LLM_GATEWAY_EVENTS.labels("circuit_open").inc()
+                    raise CircuitOpenError("The model upstream is failing; calls are suspended for "
+                                           f"{self.reset_timeout - (time.monotonic() - self.opened_at):.0f} s.")
+                self.state = "half_open"
+                self.trial_in_flight = False
+            if self.state == "half_open":
+                if self.trial_in_flight:
+                    LLM_GATEWAY_EVENTS.labels("circuit_open").inc()
+                    raise CircuitOpenError("The model upstream is failing; a trial call is in flight.")
+                self.trial_in_flight = True
+
+    # Records the outcome of a call: True for success, False for an upstream failure, None when inconclusive
+    def record(self, outcome):
+        with self.lock:
+            self.trial_in_flight = False
+            if outcome is True:
+                if self.state != "closed":
+                    logger.info("Circuit breaker closed after a successful trial call")
+                self.state = "closed"
+                self.failures = 0
+            elif outcome is False:
+                self.failures += 1
+                if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                    logger.warning("Circuit breaker opened after %d consecutive model call failures", self.failures)
+                    self.state = "open"
+                    self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            return {"state": self.state, "consecutive_failures": self.failures}
+
+# Gateway in front of a chat model, used by the chains like the model itself. Each call has a deadline
+# covering queueing and retries. Retryable failures are retried with full-jitter exponential backoff
+# (or the server's Retry-After). With hedge_delay, a second identical request is sent when the first has
+# not answered after that many seconds, and the first answer wins. Streams are only retried before their
+# first chunk; after that they are bounded by the HTTP read timeout of the client.
+class LLMGateway:
+    def __init__(self, client, limiter, breaker, executor, deadline=LLM_DEADLINE, max_retries=LLM_MAX_RETRIES,
+                 backoff=LLM_BACKOFF, backoff_max=LLM_BACKOFF_MAX, hedge_delay=0):
+        self.client = client
+        self.limiter = limiter
+        self.breaker = breaker
+        self.executor = executor
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge_delay = hedge_delay
+        self.counts = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0, "deadline_exceeded": 0}
+        self.counts_lock = threading.Lock()
+
+    # A view of this gateway with other call options, sharing its client, limiter, breaker and counters
+    def with_options(self, **options):
+        view = copy.copy(self)
+        view.__dict__.update(options)
+        return view
+
+    @property
+    def model_name(self):
+        return getattr(self.client, 'model_name', None) or type(self.client).__name__
+
+    def _count(self, event):
+        with self.counts_lock:
+            self.counts[event] += 1
+        LLM_GATEWAY_EVENTS.labels(event).inc()
+
+    def _backoff_delay(self, attempt, error):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+        retry_after = retry_after_seconds(error)
+        return min(self.backoff_max, max(delay, retry_after)) if retry_after is not None else delay
+
+    # Function run on the executor for one request; it owns the limiter slot and the breaker outcome
+    def _run(self, prompt, kwargs):
+        outcome = None
+        try:
+            response = self.client.invoke(prompt, **kwargs)
+            outcome = True
+            return response
+        except Exception as e:
+            outcome = False if is_retryable_llm_error(e) else None
+            raise
+        finally:
+            self.breaker.record(outcome)
+            self.limiter.release()
+
+    def _submit(self, prompt, kwargs, deadline=None, block=True):
+        if not self.limiter.acquire(deadline, block=block):
+            return None
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self.limiter.release()
+            raise
+        return self.executor.submit(self._run, prompt, kwargs)
+
+    # One attempt, hedged if configured; waits for the first successful answer until the deadline
+    def _attempt(self, prompt, kwargs, deadline):
+        futures = [self._submit(prompt, kwargs, deadline)]
+        hedged = not self.hedge_delay
+        while True:
+            remaining = deadline - time.monotonic()
+            # Only wait on requests still running: a failed one would make FIRST_COMPLETED return at once
+            pending = [future for future in futures if not future.done()]
+            wait(pending, timeout=max(0, remaining if hedged else min(remaining, self.hedge_delay)),
+                 return_when=FIRST_COMPLETED)
+            for future in futures:
+                if future.done() and future.exception() is None:
+                    if future is not futures[0]:
+                        self._count("hedge_wins")
+                    return future.result()
+            if all(future.done() for future in futures):
+                raise futures[0].exception()
+            if time.monotonic() >= deadline:
+                self._count("deadline_exceeded")
+                raise LLMDeadlineExceeded(f"No model answer within {self.deadline:g} s.")
+            if not hedged:
+                hedged = True
+                try:
+                    hedge = self._submit(prompt, kwargs, block=False)
+                except CircuitOpenError:
+                    hedge = None
+                if hedge is not None:
+                    self._count("hedges")
+                    futures.append(hedge)
+
+    def invoke(self, prompt, **kwargs):
+        self._count("calls")
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._attempt(prompt, kwargs, deadline)
+            except Exception as e:
+                delay = self._backoff_delay(attempt, e)
+                if attempt == self.max_retries or not is_retryable_llm_error(e) or time.monotonic() + delay >= deadline:
+                    self._count("failures")
+                    raise
+            self._count("retries")
+            time.sleep(delay)
+
+    def stream(self, prompt, **kwargs):
+        self._count("calls")
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(deadline)
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self.limiter.release()
+                raise
+            started = False
+            outcome = None
+            try:
+                for chunk in self.client.stream(prompt, **kwargs):
+                    started = True
+                    yield chunk
+                outcome = True
+                return
+            except Exception as e:
+                outcome = False if is_retryable_llm_error(e) else None
+                delay = self._backoff_delay(attempt, e)
+                if (started or attempt == self.max_retries or outcome is None
+                        or time.monotonic() + delay >= deadline):
+                    self._count("failures")
+                    raise
+            finally:
+                self.breaker.record(outcome)
+                self.limiter.release()
+            self._count("retries")
+            time.sleep(delay)
+
+    def stats(self):
+        with self.counts_lock:
+            counts = dict(self.counts)
+        return {**counts, "limiter": self.limiter.stats(), "circuit_breaker": self.breaker.stats()}
+
+# Function to create the ChatOpenAI client, on a pooled HTTP client with explicit timeouts.
+# The SDK's own retries are disabled, the gateway retries instead.
+def create_chat_model(model_name="gpt-4o-mini"):
+    httpx = timed_import('httpx')
+    timeout = httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+    http_client = httpx.Client(timeout=timeout, limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY,
+                                                                    max_keepalive_connections=LLM_MAX_CONCURRENCY))
+    return langchain_openai.ChatOpenAI(openai_api_key=OPENAI_API_KEY, model=model_name, openai_api_base=LLM_BASE_URL,
+                                       http_client=http_client, request_timeout=timeout, max_retries=0)
+
+# The ChatOpenAI model behind the gateway, created on the first model call; processes that only retrieve never
+# import langchain_openai. Answer generation uses the gateway directly; the short augmentation and translation
+# calls use a view with a shorter deadline and, when RAG_LLM_HEDGE_DELAY is set, hedged requests.
+llm_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+model = LLMGateway(LazyObject(create_chat_model, model_name="gpt-4o-mini"), LLMLimiter(), CircuitBreaker(), llm_executor)
+short_call_model = model.with_options(deadline=LLM_SHORT_DEADLINE, hedge_delay=LLM_HEDGE_DELAY)
 
 # Initialize the output parser
-parser = StrOutputParser()
+parser = LazyObject(lambda: langchain_parsers.StrOutputParser())
+
+# Settings for the LLM response cache (in-memory LRU in front of an on-disk SQLite tier)
+LLM_CACHE_ENABLED = os.getenv('RAG_LLM_CACHE', '1') != '0'
+LLM_CACHE_PATH = os.path.expanduser(os.getenv('RAG_LLM_CACHE_PATH', '~/coding/rag-cache/llm-cache.sqlite3'))
+LLM_CACHE_TTL = float(os.getenv('RAG_LLM_CACHE_TTL', 7 * 24 * 3600))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv('RAG_LLM_CACHE_MEMORY_ENTRIES', 256))
+LLM_CACHE_DISK_ENTRIES = int(os.getenv('RAG_LLM_CACHE_DISK_ENTRIES', 10000))
+
+# Content-addressed cache of model responses, keyed on the model name and the formatted prompt
+class LLMResponseCache:
+    def __init__(self, path, ttl=LLM_CACHE_TTL, max_memory_entries=LLM_CACHE_MEMORY_ENTRIES,
+                 max_disk_entries=LLM_CACHE_DISK_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self.connection = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                self.connection = sqlite3.connect(path, check_same_thread=False)
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, model TEXT, value TEXT, created_at REAL, accessed_at REAL)")
+                self.connection.commit()
+            except (OSError, sqlite3.Error) as e:
+                logger.warning("LLM cache disk tier disabled: %s", e)
+                self.connection = None
+
+    @staticmethod
+    def key(model, formatted_prompt):
+        model_name = getattr(model, 'model_name', None) or type(model).__name__
+        return hashlib.sha256(f"{model_name}\x00{formatted_prompt}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        return self.lookup(key)[0]
+
+    def lookup(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at <= self.ttl:
+                    self.memory.move_to_end(key)
+                    self.counts["memory_hits"] += 1
+                    return value, "memory_hit"
+                del self.memory[key]
+            if self.connection is not None:
+                row = self.connection.execute(
+                    "SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    self.connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    self.connection.commit()
+                    self._remember(key, row[0], row[1])
+                    self.counts["disk_hits"] += 1
+                    return row[0], "disk_hit"
+            self.counts["misses"] += 1
+            return None, "miss"
+
+    def set(self, key, value, model_name=None):
+        now = time.time()
+        with self.lock:
+            self._remember(key, value, now)
+            self.counts["writes"] += 1
+            if self.connection is None:
+                return
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, value, now, now))
+            # Drop expired rows, then the least recently used ones above the size limit
+            expired = self.connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)).rowcount
+            overflow = self.connection.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,)).rowcount
+            self.counts["evictions"] += max(expired, 0) + max(overflow, 0)
+            self.connection.commit()
+
+    def _remember(self, key, value, created_at):
+        self.memory[key] = (value, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM responses")
+                self.connection.commit()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats["memory_entries"] = len(self.memory)
+            if self.connection is not None:
+                stats["disk_entries"] = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+llm_cache = LLMResponseCache(LLM_CACHE_PATH) if LLM_CACHE_ENABLED else None
+
+# Function to invoke the model through the response cache; a hit is returned as an AIMessage.
+# The cache result and token counts are added to the attributes of the caller's span.
+def cached_model_invoke(model, formatted_prompt, cache=None, attributes=None):
+    attributes = attributes if attributes is not None else {"stage": "model"}
+    key = None
+    if cache is not None:
+        key = cache.key(model, formatted_prompt)
+        cached, attributes["cache"] = cache.lookup(key)
+        LLM_CACHE_REQUESTS.labels(attributes["stage"], attributes["cache"]).inc()
+        if cached is not None:
+            return langchain_messages.AIMessage(content=cached)
+    model_response = model.invoke(formatted_prompt)
+    record_token_usage(attributes, formatted_prompt, model_response)
+    if cache is not None and isinstance(getattr(model_response, 'content', None), str):
+        cache.set(key, model_response.content, getattr(model, 'model_name', None))
+    return model_response
+
+# Function to stream the model output through the response cache, yielding text pieces as they arrive
+def cached_model_stream(model, formatted_prompt, cache=None, attributes=None):
+    attributes = attributes if attributes is not None else {"stage": "model"}
+    key = None
+    if cache is not None:
+        key = cache.key(model, formatted_prompt)
+        cached, attributes["cache"] = cache.lookup(key)
+        LLM_CACHE_REQUESTS.labels(attributes["stage"], attributes["cache"]).inc()
+        if cached is not None:
+            yield cached
+            return
+    pieces = []
+    for chunk in model.stream(formatted_prompt):
+        content = getattr(chunk, 'content', chunk)
+        if content:
+            pieces.append(content)
+            yield content
+    record_token_usage(attributes, formatted_prompt, completion_text="".join(pieces))
+    # Only a fully consumed stream is cached; an abandoned one leaves no partial entry
+    if cache is not None:
+        cache.set(key, "".join(pieces), getattr(model, 'model_name', None))
+
+# Columns of a fiches-metiers.json row, in file order (the file has no header line)
+FICHE_FIELDS = [
+    "number", "slug", "title_en", "sector_fr", "sector_en", "description",
+    "responsibilities", "knowledge", "tools", "soft_skills", "study_fields", "schools",
+    "salary_junior", "salary_medior", "salary_senior",
+    "roles_junior", "roles_medior", "roles_senior",
+    "trend_1", "trend_2", "trend_3", "trend_4",
+]
+
+# Labels used when a record is rendered for the prompt, matching the names listed in combined_template
+FICHE_LABELS = {
+    "title_fr": "Nom du métier",
+    "number": "Number",
+    "slug": "Slug",
+    "title_en": "Balise de titre",
+    "sector_fr": "Secteur du métier",
+    "sector_en": "Primary sector",
+    "description": "Description globale",
+    "responsibilities": "Responsabilités",
+    "knowledge": "Domaine de connaissances",
+    "tools": "Outils",
+    "soft_skills": "Compétences humaines",
+    "study_fields": "Domaine d'étude à privilégier",
+    "schools": "Universités / écoles spécialisées",
+    "salary_junior": "Salaire Statut Junior",
+    "salary_medior": "Salaire Statut Medior",
+    "salary_senior": "Salaire Statut Senior",
+    "roles_junior": "Statut Junior",
+    "roles_medior": "Statut Medior",
+    "roles_senior": "Statut Senior",
+    "trend_1": "Tendance #01",
+    "trend_2": "Tendance #02",
+    "trend_3": "Tendance #03",
+    "trend_4": "Tendance #04",
+}
+
+# Field groups used when one record is split into several retrievable units
+FICHE_FIELD_GROUPS = {
+    "profil": ["number", "slug", "title_en", "sector_fr", "sector_en", "description"],
+    "missions": ["responsibilities", "knowledge", "tools", "soft_skills"],
+    "carriere": ["study_fields", "schools", "salary_junior", "salary_medior", "salary_senior",
+                 "roles_junior", "roles_medior", "roles_senior"],
+    "tendances": ["trend_1", "trend_2", "trend_3", "trend_4"],
+}
+
+# List-valued fields: items are separated by a comma followed by a capitalised word,
+# so commas inside a sentence ("le recrutement, la formation") are kept
+FICHE_LIST_FIELDS = {
+    "responsibilities": r",\s*(?=[A-ZÀ-Ý])",
+    "knowledge": r",\s*(?=[A-ZÀ-Ý])",
+    "tools": r",\s*",
+    "soft_skills": r",\s*(?=[A-ZÀ-Ý])",
+    "study_fields": r",\s*(?=[A-ZÀ-Ý])",
+    "schools": r";\s*",
+    "roles_junior": r",\s*",
+    "roles_medior": r",\s*",
+    "roles_senior": r",\s*",
+}
+
+CHUNK_GRANULARITY = os.getenv('RAG_CHUNK_GRANULARITY', 'record')
+
+# One occupation from fiches-metiers.json
+@dataclass
+class OccupationRecord:
+    number: str
+    slug: str
+    title_en: str = ""
+    sector_fr: str = ""
+    sector_en: str = ""
+    description: str = ""
+    responsibilities: list = field(default_factory=list)
+    knowledge: list = field(default_factory=list)
+    tools: list = field(default_factory=list)
+    soft_skills: list = field(default_factory=list)
+    study_fields: list = field(default_factory=list)
+    schools: list = field(default_factory=list)
+    salary_junior: str = ""
+    salary_medior: str = ""
+    salary_senior: str = ""
+    roles_junior: list = field(default_factory=list)
+    roles_medior: list = field(default_factory=list)
+    roles_senior: list = field(default_factory=list)
+    trend_1: str = ""
+    trend_2: str = ""
+    trend_3: str = ""
+    trend_4: str = ""
+
+    @property
+    def record_id(self):
+        return f"fm:{self.number or self.slug}"
+
+    @property
+    def title_fr(self):
+        return self.slug.replace('-', ' ')
+
+    def render(self, field_names=None):
+        lines = [f"{FICHE_LABELS['title_fr']}: {self.title_fr}"]
+        for name in field_names or FICHE_FIELDS:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                value = ", ".join(value)
+            if value:
+                lines.append(f"{FICHE_LABELS[name]}: {value}")
+        return "\n".join(lines)
+
+# One occupation from the ESCO export in jobs.json
+@dataclass
+class EscoOccupation:
+    uid: str
+    description: str = ""
 
-# Function to read JSON and split into chunks
-def load_chunks_from_json(file_path, chunk_size=1000, chunk_overlap=200):
+    @property
+    def record_id(self):
+        return f"esco:{self.uid}"
+
+    def render(self):
+        return f"{self.uid}: {self.description}" if self.description else self.uid
+
+# Function to split a list-valued cell into clean items
+def _split_list(value, pattern):
+    items = [item.strip().rstrip('.').strip() for item in re.split(pattern, value)]
+    return [item for item in items if item]
+
+# Function to turn one fiches-metiers.json row into an OccupationRecord, or None for a blank row
+def occupation_record_from_row(row):
+    if len(row) < 2 or not any(cell.strip() for cell in row):
+        return None
+    row = row + [""] * (len(FICHE_FIELDS) - len(row))
+    values = {}
+    for name, cell in zip(FICHE_FIELDS, row):
+        cell = cell.strip()
+        values[name] = _split_list(cell, FICHE_LIST_FIELDS[name]) if name in FICHE_LIST_FIELDS else cell
+    return OccupationRecord(**values)
+
+# Function to turn one jobs.json row into an EscoOccupation, or None when it has no ESCO UID
+def esco_record_from_row(row):
+    uid = (row.get('ESCO UID') or "").strip()
+    if not uid:
+        return None
+    return EscoOccupation(uid, (row.get('description_en') or "").strip())
+
+# Functions to read the raw rows of each corpus file
+def occupation_rows(file):
+    return csv.reader(file)
+
+def esco_rows(file):
+    return csv.DictReader(file, delimiter='\t', quoting=csv.QUOTE_NONE)
+
+# Functions to stream the records of each corpus file, one row at a time
+def iter_occupation_records(file_path):
+    with open(file_path, 'r', encoding='utf-8', newline='') as file:
+        for row in occupation_rows(file):
+            record = occupation_record_from_row(row)
+            if record is not None:
+                yield record
+
+def iter_esco_records(file_path):
+    with open(file_path, 'r', encoding='utf-8', newline='') as file:
+        for row in esco_rows(file):
+            record = esco_record_from_row(row)
+            if record is not None:
+                yield record
+
+# Function to parse fiches-metiers.json into one OccupationRecord per row
+def load_occupation_records(file_path):
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = file.read()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-        chunks = text_splitter.split_text(data)
-        return chunks
+        return list(iter_occupation_records(file_path))
     except Exception as e:
-        print(f"Error reading or processing the JSON file: {e}")
+        logger.error("Error reading or processing the JSON file: %s", e)
         return []
-    
-# Function to read JSON and split into chunks for jobs.json
-def load_chunks_from_jobs_json(file_path, chunk_size=1000, chunk_overlap=200):
+
+# Function to parse the tab-separated ESCO table in jobs.json into EscoOccupation records
+def load_esco_records(file_path):
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = file.read()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-        chunks = text_splitter.split_text(data)
-        return chunks
+        return list(iter_esco_records(file_path))
     except Exception as e:
-        print(f"Error reading or processing the JSON file: {e}")
+        logger.error("Error reading or processing the JSON file: %s", e)
         return []
 
+# Function to turn occupation records into (unit id, text) pairs, one per record or per field group
+def iter_occupation_units(records, granularity=CHUNK_GRANULARITY):
+    for record in records:
+        if isinstance(record, OccupationRecord) and granularity == 'fields':
+            for group, field_names in FICHE_FIELD_GROUPS.items():
+                text = record.render(field_names)
+                if text.count("\n"):
+                    yield f"{record.record_id}#{group}", text
+        else:
+            yield record.record_id, record.render()
+
+def occupation_units(records, granularity=CHUNK_GRANULARITY):
+    return list(iter_occupation_units(records, granularity))
+
+# Functions to load the retrievable units of each corpus, mapped from the corpus snapshot when there is one
+def load_chunks_from_json(file_path, granularity=CHUNK_GRANULARITY):
+    snapshot = load_corpus_snapshot("fiches_metiers", file_path, granularity) if CORPUS_SNAPSHOT else None
+    if snapshot is not None:
+        return snapshot.units()
+    return occupation_units(load_occupation_records(file_path), granularity)
+
+def load_chunks_from_jobs_json(file_path, granularity=CHUNK_GRANULARITY):
+    snapshot = load_corpus_snapshot("jobs_json", file_path, granularity) if CORPUS_SNAPSHOT else None
+    if snapshot is not None:
+        return snapshot.units()
+    return occupation_units(load_esco_records(file_path), granularity)
+
+# Functions to stream the units of each corpus without holding the file's records in memory
+def stream_chunks_from_json(file_path, granularity=CHUNK_GRANULARITY):
+    return iter_occupation_units(iter_occupation_records(file_path), granularity)
+
+def stream_chunks_from_jobs_json(file_path, granularity=CHUNK_GRANULARITY):
+    return iter_occupation_units(iter_esco_records(file_path), granularity)
+
 # Function to process the question and find the relevant chunks
 def find_relevant_chunks(question, chunks, top_n=15):
-    vectorizer = TfidfVectorizer()
+    vectorizer = sklearn_text.TfidfVectorizer()
     chunk_vectors = vectorizer.fit_transform(chunks)
     query_vector = vectorizer.transform([question])
-    similarities = cosine_similarity(query_vector, chunk_vectors).flatten()
+    similarities = sklearn_pairwise.cosine_similarity(query_vector, chunk_vectors).flatten()
     top_indices = np.argsort(similarities)[-top_n:][::-1]
     concatenated_chunks = " ".join([chunks[i] for i in top_indices])
     return concatenated_chunks, top_indices, similarities
 
 
+# Paths to the two corpora and to the directory holding the persisted TF-IDF index
+FICHES_METIERS_PATH = os.path.expanduser(os.getenv('FICHES_METIERS_PATH', '~/coding/fiches-metiers.json'))
+JOBS_JSON_PATH = os.path.expanduser(os.getenv('JOBS_JSON_PATH', '~/coding/jobs.json'))
+INDEX_DIR = os.path.expanduser(os.getenv('RAG_INDEX_DIR', '~/coding/rag-index'))
+
+# Function to select the indices of the top_n scores, best first, without sorting every score
+def top_k_indices(scores, top_n):
+    top_n = min(top_n, len(scores))
+    if top_n <= 0:
+        return np.array([], dtype=int)
+    candidates = np.argpartition(-scores, top_n - 1)[:top_n]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+# Function to fuse the per-column rankings of a sparse (chunks x queries) score matrix with reciprocal
+# rank fusion; each query ranks only the chunks it matches, read from its column of the CSC matrix
+def rrf_over_columns(scores, pool=50, k=60):
+    scores = scores.tocsc()
+    contributions = 1.0 / (k + np.arange(1, pool + 1))
+    fused = np.zeros(scores.shape[0])
+    for column in range(scores.shape[1]):
+        start, end = scores.indptr[column], scores.indptr[column + 1]
+        rows, values = scores.indices[start:end], scores.data[start:end]
+        # Chunks a query does not match at all get no share of that query's fused score
+        matched = values > 0
+        rows, values = rows[matched], values[matched]
+        ranked = rows[top_k_indices(values, pool)]
+        fused[ranked] += contributions[:len(ranked)]
+    return fused
+
+# Function to split an augmentation output into individual reformulated questions
+def split_reformulations(text, max_queries=50, min_words=3):
+    queries = []
+    for line in (text or "").splitlines():
+        line = re.sub(r"^\s*(?:[-*•]|\d+[.)]|\(\d+\))\s*", "", line).strip()
+        # Section headings such as "Réponses reformulées :" are not queries
+        if len(line.split()) >= min_words and not line.endswith(':') and line not in queries:
+            queries.append(line)
+    return queries[:max_queries] or [text]
+
+# Scores of the documents a query actually visited; every other document scores 0
+class SparseScores(dict):
+    def __missing__(self, key):
+        return 0.0
+
+# Function to get the occupation record a unit belongs to ("fm:28#missions" -> "fm:28")
+def record_key(chunk_id):
+    return chunk_id.split('#', 1)[0]
+
+# Function to join the texts of neighbouring units, dropping lines an earlier unit already contains
+def merge_unit_texts(texts):
+    seen = set()
+    lines = []
+    for text in texts:
+        for line in text.split("\n"):
+            if line not in seen:
+                seen.add(line)
+                lines.append(line)
+    return "\n".join(lines)
+
+# Function to fingerprint a source file so a saved index can detect that it is stale
+def source_fingerprint(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+# Read-only sequence of strings stored as one UTF-8 buffer plus an offsets array, both memory-mapped,
+# so every process serving the index shares the same pages. With sortable=True a sorted key table is
+# written as well, and lookup() finds the position of a string by binary search instead of a dict
+class MappedStrings:
+    def __init__(self, buffer, offsets, keys=None, positions=None):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.keys = keys
+        self.positions = positions
+
+    @staticmethod
+    def write(prefix, strings, sortable=False):
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        with open(prefix + '.bin', 'wb') as file:
+            file.write(b"".join(encoded))
+        np.save(prefix + '.offsets.npy', offsets)
+        if sortable:
+            keys = np.array(encoded, dtype=f"S{max([len(item) for item in encoded] + [1])}")
+            order = np.argsort(keys, kind='stable')
+            np.save(prefix + '.keys.npy', keys[order])
+            np.save(prefix + '.positions.npy', order.astype(np.int64))
+
+    @classmethod
+    def load(cls, prefix):
+        offsets = np.load(prefix + '.offsets.npy', mmap_mode='r')
+        # np.memmap cannot map an empty file
+        buffer = np.memmap(prefix + '.bin', dtype=np.uint8, mode='r') if offsets[-1] else np.zeros(0, dtype=np.uint8)
+        keys = positions = None
+        if os.path.exists(prefix + '.keys.npy'):
+            keys = np.load(prefix + '.keys.npy', mmap_mode='r')
+            positions = np.load(prefix + '.positions.npy', mmap_mode='r')
+        return cls(buffer, offsets, keys, positions)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return bytes(self.buffer[self.offsets[index]:self.offsets[index + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def lookup(self, value):
+        key = value.encode('utf-8')
+        position = int(np.searchsorted(self.keys, key))
+        if position < len(self.keys) and self.keys[position] == key:
+            return int(self.positions[position])
+        return None
+
+# Query-side stand-in for a fitted TfidfVectorizer whose vocabulary is a memory-mapped term table
+# (term i is column i): transform() gives the same vectors without a per-process vocabulary dict
+class MappedTfidfVectorizer:
+    def __init__(self, terms, idf):
+        self.terms = terms
+        self.idf_ = idf
+        self.analyzer = sklearn_text.TfidfVectorizer().build_analyzer()
+        self._vocabulary = None
+
+    def build_analyzer(self):
+        return self.analyzer
+
+    # Only built when a dict is really needed (BM25 build, incremental update)
+    @property
+    def vocabulary_(self):
+        if self._vocabulary is None:
+            self._vocabulary = {term: column for column, term in enumerate(self.terms)}
+        return self._vocabulary
+
+    def transform(self, texts):
+        rows, columns = [], []
+        for row, text in enumerate(texts):
+            for term in self.analyzer(text):
+                column = self.terms.lookup(term)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+        counts = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(texts), len(self.idf_)))
+        counts.sum_duplicates()
+        return sklearn_preprocessing.normalize(counts @ sparse.diags(np.asarray(self.idf_)))
+
+# Columns of the hashing vectorizer used by streamed indexes
+HASHING_FEATURES = int(os.getenv('RAG_HASHING_FEATURES', 2 ** 20))
+
+# Term lookup of a hashing vectorizer: every term has a column, computed from its hash
+class HashedVocabulary:
+    def __init__(self, hashing):
+        self.hashing = hashing
+
+    def __contains__(self, term):
+        return True
+
+    def __getitem__(self, term):
+        return int(self.hashing.transform([term]).indices[0])
+
+# Stand-in for a fitted TfidfVectorizer over hashed columns: term counts from a stateless HashingVectorizer,
+# weighted by the idf accumulated while the index was streamed, then L2-normalised like TfidfVectorizer
+class HashedTfidfVectorizer:
+    def __init__(self, idf, n_features=HASHING_FEATURES):
+        self.idf_ = idf
+        self.n_features = n_features
+        self.hashing = sklearn_text.HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+
+    def build_analyzer(self):
+        return self.hashing.build_analyzer()
+
+    @property
+    def vocabulary_(self):
+        return HashedVocabulary(self.hashing)
+
+    def counts(self, texts):
+        return self.hashing.transform(texts).tocsr()
+
+    def transform(self, texts):
+        counts = self.counts(texts)
+        counts.data *= np.asarray(self.idf_)[counts.indices]
+        return sklearn_preprocessing.normalize(counts)
+
+# With RAG_CORPUS_SNAPSHOT=1 (the default) corpora are read from compact binary snapshots in RAG_INDEX_DIR/snapshots
+CORPUS_SNAPSHOT = os.getenv('RAG_CORPUS_SNAPSHOT', '1') != '0'
+SNAPSHOT_DIR = os.path.join(INDEX_DIR, 'snapshots')
+# Low-cardinality text fields stored as integer codes; list-valued fields (skills, tools, schools...) always are
+SNAPSHOT_INTERNED_FIELDS = {"sector_fr", "sector_en"}
+
+# (unit id, text) pairs whose IDs and texts are memory-mapped strings, sliced on demand
+class MappedUnits:
+    def __init__(self, ids, texts):
+        self.ids = ids
+        self.texts = texts
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        return self.ids[index], self.texts[index]
+
+    def __iter__(self):
+        return zip(self.ids, self.texts)
+
+# Compact binary snapshot of a parsed corpus, mapped read-only. The text fields of all records live in
+# one UTF-8 buffer addressed by offsets (field j of record i is string i * len(text_fields) + j). Sectors
+# and the items of list-valued fields are integer codes into one table of distinct values, list fields
+# with an indptr array as in a CSR matrix. The units of one chunk granularity are stored rendered.
+class CorpusSnapshot:
+    def __init__(self, record_type, meta, text, values, columns, pointers, units):
+        self.record_type = record_type
+        self.meta = meta
+        self.text = text
+        self.values = values
+        self.columns = columns
+        self.pointers = pointers
+        self.text_fields = meta["text_fields"]
+        self.interned_fields = meta["interned_fields"]
+        self.list_fields = meta["list_fields"]
+        self.unit_list = units
+
+    @staticmethod
+    def write(directory, records, record_type, granularity=CHUNK_GRANULARITY, fingerprint=None):
+        temporary = f"{directory}.tmp-{os.getpid()}"
+        os.makedirs(temporary, exist_ok=True)
+        text_fields, interned_fields, list_fields = [], [], []
+        for record_field in fields(record_type):
+            if record_field.default_factory is list:
+                list_fields.append(record_field.name)
+            elif record_field.name in SNAPSHOT_INTERNED_FIELDS:
+                interned_fields.append(record_field.name)
+            else:
+                text_fields.append(record_field.name)
+        texts, values = [], {}
+        columns = {name: [] for name in interned_fields + list_fields}
+        pointers = {name: [0] for name in list_fields}
+        for record in records:
+            texts.extend(getattr(record, name) for name in text_fields)
+            for name in interned_fields:
+                columns[name].append(values.setdefault(getattr(record, name), len(values)))
+            for name in list_fields:
+                items = getattr(record, name)
+                columns[name].extend(values.setdefault(item, len(values)) for item in items)
+                pointers[name].append(pointers[name][-1] + len(items))
+        MappedStrings.write(os.path.join(temporary, 'text'), texts)
+        # Codes are the insertion order of the values table
+        MappedStrings.write(os.path.join(temporary, 'values'), list(values))
+        for name, codes in columns.items():
+            np.save(os.path.join(temporary, f"{name}.codes.npy"), np.asarray(codes, dtype=np.int32))
+        for name, indptr in pointers.items():
+            np.save(os.path.join(temporary, f"{name}.indptr.npy"), np.asarray(indptr, dtype=np.int64))
+        units = occupation_units(records, granularity)
+        MappedStrings.write(os.path.join(temporary, 'unit_ids'), [unit_id for unit_id, _ in units], sortable=True)
+        MappedStrings.write(os.path.join(temporary, 'unit_texts'), [text for _, text in units])
+        with open(os.path.join(temporary, 'meta.json'), 'w', encoding='utf-8') as file:
+            json.dump({"record_type": record_type.__name__, "num_records": len(records), "num_units": len(units),
+                       "granularity": granularity, "fingerprint": fingerprint, "text_fields": text_fields,
+                       "interned_fields": interned_fields, "list_fields": list_fields, "num_values": len(values)}, file)
+        try:
+            os.rename(temporary, directory)
+        except OSError:
+            # Another process published the same snapshot first
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory, record_type):
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            return None
+        try:
+            with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            if meta["record_type"] != record_type.__name__:
+                return None
+            columns = {name: np.load(os.path.join(directory, f"{name}.codes.npy"), mmap_mode='r')
+                       for name in meta["interned_fields"] + meta["list_fields"]}
+            pointers = {name: np.load(os.path.join(directory, f"{name}.indptr.npy"), mmap_mode='r')
+                        for name in meta["list_fields"]}
+            units = MappedUnits(MappedStrings.load(os.path.join(directory, 'unit_ids')),
+                                MappedStrings.load(os.path.join(directory, 'unit_texts')))
+            snapshot = cls(record_type, meta, MappedStrings.load(os.path.join(directory, 'text')),
+                           MappedStrings.load(os.path.join(directory, 'values')), columns, pointers, units)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not map corpus snapshot '%s': %s", directory, e)
+            return None
+        return snapshot
+
+    def __len__(self):
+        return self.meta["num_records"]
+
+    # Records are decoded from the map one at a time, so iterating never holds the whole corpus as objects
+    def __getitem__(self, index):
+        index = int(index)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start = index * len(self.text_fields)
+        values = {name: self.text[start + offset] for offset, name in enumerate(self.text_fields)}
+        for name in self.interned_fields:
+            values[name] = self.values[self.columns[name][index]]
+        for name in self.list_fields:
+            codes = self.columns[name][self.pointers[name][index]:self.pointers[name][index + 1]]
+            values[name] = [self.values[code] for code in codes]
+        return self.record_type(**values)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def units(self):
+        return self.unit_list
+
+# Parsed record type and parser of each corpus, for building its snapshot
+SNAPSHOT_SOURCES = {
+    "fiches_metiers": (OccupationRecord, load_occupation_records),
+    "jobs_json": (EscoOccupation, load_esco_records),
+}
+
+# Function to map the snapshot of a corpus file, converting the file first if the snapshot is missing
+# or stale. The conversion runs once, under a file lock, so workers booting together do not all parse it
+def load_corpus_snapshot(kind, file_path, granularity=CHUNK_GRANULARITY, snapshot_dir=SNAPSHOT_DIR):
+    record_type, load_records = SNAPSHOT_SOURCES[kind]
+    fingerprint = source_fingerprint(file_path)
+    if fingerprint is None:
+        return None
+    fingerprint["granularity"] = granularity
+    version = hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    directory = os.path.join(snapshot_dir, f"{kind}-{version}")
+    snapshot = CorpusSnapshot.load(directory, record_type)
+    if snapshot is not None:
+        return snapshot
+    os.makedirs(snapshot_dir, exist_ok=True)
+    with open(os.path.join(snapshot_dir, f"{kind}.lock"), 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        snapshot = CorpusSnapshot.load(directory, record_type)
+        if snapshot is None:
+            with span("snapshot", corpus=kind):
+                CorpusSnapshot.write(directory, load_records(file_path), record_type, granularity, fingerprint)
+            # Older versions stay readable by processes that still map them until they exit
+            for entry in os.listdir(snapshot_dir):
+                if entry.startswith(f"{kind}-") and entry != os.path.basename(directory) and '.tmp-' not in entry:
+                    shutil.rmtree(os.path.join(snapshot_dir, entry), ignore_errors=True)
+            snapshot = CorpusSnapshot.load(directory, record_type)
+    return snapshot
+
+# Function to get the records of a corpus, decoded from its snapshot when snapshots are enabled.
+# Streamed indexes never read the snapshot, so none is written for them
+def corpus_records(kind, file_path):
+    snapshot = load_corpus_snapshot(kind, file_path) if CORPUS_SNAPSHOT and not STREAMING_INDEX else None
+    return snapshot if snapshot is not None else SNAPSHOT_SOURCES[kind][1](file_path)
+
+# TF-IDF retriever fitted once per corpus; requests only transform and score the query
+class TfidfRetriever:
+    def __init__(self, name, chunk_ids, chunks, vectorizer=None, chunk_vectors=None, fingerprint=None, built_at=None,
+                 directory=None):
+        self.name = name
+        self.chunk_ids = chunk_ids
+        self.chunks = chunks
+        self.vectorizer = vectorizer
+        self.chunk_vectors = chunk_vectors
+        self.fingerprint = fingerprint
+        self.built_at = built_at or time.time()
+        # Directory of a memory-mapped (shared or streamed) index
+        self.directory = directory
+        # Indexes derived from this retriever's units (BM25, dense, sector facets), built on first use
+        self.derived = {}
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @classmethod
+    def build(cls, name, units, fingerprint=None):
+        if not units:
+            return cls(name, [], [], fingerprint=fingerprint)
+        if isinstance(units, MappedUnits):
+            chunk_ids, chunks = units.ids, units.texts
+        else:
+            chunk_ids = [unit_id for unit_id, _ in units]
+            chunks = [text for _, text in units]
+        with span("vectorize", corpus=name, chunks=len(chunks)):
+            vectorizer = sklearn_text.TfidfVectorizer()
+            chunk_vectors = vectorizer.fit_transform(chunks).tocsr()
+        return cls(name, chunk_ids, chunks, vectorizer, chunk_vectors, fingerprint)
+
+    # Returns a new retriever over the given units, vectorizing only the units that are new or whose
+    # text changed. Document frequencies are adjusted by the removed and added units, then the kept
+    # rows are rescaled to the new idf and renormalised, which matches a full refit (up to column order)
+    def update(self, units, fingerprint=None):
+        if self.vectorizer is None or not units:
+            retriever = TfidfRetriever.build(self.name, units, fingerprint)
+            return retriever, {"added": len(units), "changed": 0, "removed": len(self.chunks), "unchanged": 0}
+        old_rows = {(chunk_id, text): row for row, (chunk_id, text) in enumerate(zip(self.chunk_ids, self.chunks))}
+        kept_positions, kept_rows, fresh_positions = [], [], []
+        for position, unit in enumerate(units):
+            if unit in old_rows:
+                kept_positions.append(position)
+                kept_rows.append(old_rows[unit])
+            else:
+                fresh_positions.append(position)
+        old_ids, new_ids = set(self.chunk_ids), {unit_id for unit_id, _ in units}
+        report = {
+            "added": sum(1 for p in fresh_positions if units[p][0] not in old_ids),
+            "changed": sum(1 for p in fresh_positions if units[p][0] in old_ids),
+            "removed": len(old_ids - new_ids),
+            "unchanged": len(kept_positions),
+        }
+
+        with span("vectorize", corpus=self.name, chunks=len(fresh_positions), incremental=True):
+            fresh_texts = [units[p][1] for p in fresh_positions]
+            old_vectors = self.chunk_vectors
+            # Hashed columns are fixed, so a streamed index only needs the counts of the fresh units
+            if isinstance(self.vectorizer, HashedTfidfVectorizer):
+                num_terms = len(self.vectorizer.idf_)
+                fresh_counts = self.vectorizer.counts(fresh_texts)
+            else:
+                vocabulary = dict(self.vectorizer.vocabulary_)
+                analyzer = self.vectorizer.build_analyzer()
+                for term in sorted({term for text in fresh_texts for term in analyzer(text)} - vocabulary.keys()):
+                    vocabulary[term] = len(vocabulary)
+                num_terms = len(vocabulary)
+                fresh_counts = sklearn_text.CountVectorizer(vocabulary=vocabulary).transform(fresh_texts).tocsr()
+
+            removed_rows = np.setdiff1d(np.arange(len(self.chunks)), kept_rows)
+            document_frequency = np.zeros(num_terms)
+            document_frequency[:old_vectors.shape[1]] = (np.bincount(old_vectors.indices, minlength=old_vectors.shape[1])
+                                                         - np.bincount(old_vectors[removed_rows].indices, minlength=old_vectors.shape[1]))
+            document_frequency += np.bincount(fresh_counts.indices, minlength=num_terms)
+            # Smoothed idf, as computed by TfidfVectorizer
+            idf = np.log((1 + len(units)) / (1 + document_frequency)) + 1
+
+            kept_vectors = old_vectors[kept_rows].tocsr()
+            kept_vectors.resize((len(kept_rows), num_terms))
+            rescale = np.ones(num_terms)
+            rescale[:old_vectors.shape[1]] = idf[:old_vectors.shape[1]] / self.vectorizer.idf_
+            kept_vectors = sklearn_preprocessing.normalize(kept_vectors @ sparse.diags(rescale))
+            fresh_vectors = sklearn_preprocessing.normalize(fresh_counts @ sparse.diags(idf))
+            stacked = sparse.vstack([kept_vectors, fresh_vectors]).tocsr()
+            chunk_vectors = stacked[np.argsort(np.array(kept_positions + fresh_positions, dtype=int))]
+
+            if isinstance(self.vectorizer, HashedTfidfVectorizer):
+                vectorizer = HashedTfidfVectorizer(idf, num_terms)
+            else:
+                vectorizer = sklearn_text.TfidfVectorizer(vocabulary=vocabulary)
+                vectorizer.idf_ = idf
+        retriever = TfidfRetriever(self.name, [unit_id for unit_id, _ in units], [text for _, text in units],
+                                   vectorizer, chunk_vectors.tocsr(), fingerprint)
+        return retriever, report
+
+    def save(self, index_dir):
+        # A streamed index lives in its own directory, rebuilt from the source file when it changes
+        if self.vectorizer is None or isinstance(self.vectorizer, HashedTfidfVectorizer):
+            return
+        os.makedirs(index_dir, exist_ok=True)
+        prefix = os.path.join(index_dir, self.name)
+        # The meta file is removed first and written last, so a half-written index is never picked up
+        if os.path.exists(prefix + '.meta.json'):
+            os.remove(prefix + '.meta.json')
+        vocabulary = {term: int(column) for term, column in self.vectorizer.vocabulary_.items()}
+        with open(prefix + '.vocabulary.json', 'w', encoding='utf-8') as file:
+            json.dump(vocabulary, file, ensure_ascii=False)
+        with open(prefix + '.chunks.json', 'w', encoding='utf-8') as file:
+            json.dump({"ids": list(self.chunk_ids), "texts": list(self.chunks)}, file, ensure_ascii=False)
+        np.save(prefix + '.idf.npy', self.vectorizer.idf_)
+        sparse.save_npz(prefix + '.matrix.npz', self.chunk_vectors)
+        with open(prefix + '.meta.json', 'w', encoding='utf-8') as file:
+            json.dump({"fingerprint": self.fingerprint, "num_chunks": len(self.chunks), "built_at": self.built_at}, file)
+
+    # With units mapped from a snapshot of the same source version, the unit IDs and texts are sliced
+    # from the snapshot instead of being read from chunks.json
+    @classmethod
+    def load(cls, index_dir, name, fingerprint=None, units=None):
+        prefix = os.path.join(index_dir, name)
+        if not os.path.exists(prefix + '.meta.json'):
+            return None
+        try:
+            with open(prefix + '.meta.json', 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            if fingerprint is not None and meta.get("fingerprint") != fingerprint:
+                return None
+            with open(prefix + '.vocabulary.json', 'r', encoding='utf-8') as file:
+                vocabulary = json.load(file)
+            if isinstance(units, MappedUnits) and fingerprint is not None and len(units) == meta.get("num_chunks"):
+                stored_chunks = {"ids": units.ids, "texts": units.texts}
+            else:
+                with open(prefix + '.chunks.json', 'r', encoding='utf-8') as file:
+                    stored_chunks = json.load(file)
+            vectorizer = sklearn_text.TfidfVectorizer(vocabulary=vocabulary)
+            vectorizer.idf_ = np.load(prefix + '.idf.npy')
+            chunk_vectors = sparse.load_npz(prefix + '.matrix.npz').tocsr()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Could not load saved index '%s': %s", name, e)
+            return None
+        return cls(name, stored_chunks["ids"], stored_chunks["texts"], vectorizer, chunk_vectors, meta.get("fingerprint"),
+                   meta.get("built_at"))
+
+    def search_many(self, queries, top_n=15, aggregation="max", rows=None):
+        if self.vectorizer is None or not queries:
+            return "", np.array([], dtype=int), np.array([])
+        with span("score", corpus=self.name, mode="multi", queries=len(queries)):
+            # One sparse product scores every query variant against every chunk (or every row of a facet filter) at once
+            query_vectors = self.vectorizer.transform(queries)
+            chunk_vectors = self.chunk_vectors if rows is None else self.chunk_vectors[rows]
+            scores = (chunk_vectors @ query_vectors.T).tocsc()
+            if aggregation == "max":
+                similarities = scores.max(axis=1).toarray().ravel()
+            elif aggregation == "sum":
+                similarities = np.asarray(scores.sum(axis=1)).ravel()
+            elif aggregation == "rrf":
+                similarities = rrf_over_columns(scores, pool=max(top_n * 4, 50))
+            else:
+                raise ValueError(f"Unknown multi-query aggregation '{aggregation}'.")
+            top_indices = top_k_indices(similarities, top_n)
+            if rows is not None:
+                # Back to corpus positions; rows outside the filter score 0
+                top_indices = rows[top_indices]
+                full_similarities = np.zeros(len(self.chunks))
+                full_similarities[rows] = similarities
+                similarities = full_similarities
+        concatenated_chunks = "\n\n".join([self.chunks[i] for i in top_indices])
+        return concatenated_chunks, top_indices, similarities
+
+    # Writes the index as raw arrays for memory mapping: CSR data/indices/indptr, idf, and the terms,
+    # unit IDs and texts as UTF-8 buffers with offsets. The files go to a temporary directory that is
+    # renamed into place, so a reader only ever maps a complete index
+    def save_shared(self, directory):
+        temporary = f"{directory}.tmp-{os.getpid()}"
+        os.makedirs(temporary, exist_ok=True)
+        matrix = self.chunk_vectors.tocsr()
+        index_dtype = np.int32 if matrix.nnz < 2 ** 31 else np.int64
+        np.save(os.path.join(temporary, 'data.npy'), matrix.data.astype(np.float32))
+        np.save(os.path.join(temporary, 'indices.npy'), matrix.indices.astype(index_dtype))
+        np.save(os.path.join(temporary, 'indptr.npy'), matrix.indptr.astype(index_dtype))
+        np.save(os.path.join(temporary, 'idf.npy'), np.asarray(self.vectorizer.idf_, dtype=np.float64))
+        terms = [None] * len(self.vectorizer.vocabulary_)
+        for term, column in self.vectorizer.vocabulary_.items():
+            terms[column] = term
+        MappedStrings.write(os.path.join(temporary, 'terms'), terms, sortable=True)
+        MappedStrings.write(os.path.join(temporary, 'ids'), list(self.chunk_ids), sortable=True)
+        MappedStrings.write(os.path.join(temporary, 'texts'), list(self.chunks))
+        with open(os.path.join(temporary, 'meta.json'), 'w', encoding='utf-8') as file:
+            json.dump({"name": self.name, "fingerprint": self.fingerprint, "built_at": self.built_at,
+                       "shape": list(matrix.shape)}, file)
+        try:
+            os.rename(temporary, directory)
+        except OSError:
+            # Another process published the same index first
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    @classmethod
+    def load_shared(cls, directory):
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            return None
+        try:
+            with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            arrays = [np.load(os.path.join(directory, f"{part}.npy"), mmap_mode='r') for part in ('data', 'indices', 'indptr')]
+            chunk_vectors = sparse.csr_matrix(tuple(arrays), shape=tuple(meta["shape"]), copy=False)
+            idf = np.load(os.path.join(directory, 'idf.npy'), mmap_mode='r')
+            # A streamed index has hashed columns and no term table
+            if meta.get("vectorizer") == "hashing":
+                vectorizer = HashedTfidfVectorizer(idf, meta["n_features"])
+            else:
+                vectorizer = MappedTfidfVectorizer(MappedStrings.load(os.path.join(directory, 'terms')), idf)
+            chunk_ids = MappedStrings.load(os.path.join(directory, 'ids'))
+            chunks = MappedStrings.load(os.path.join(directory, 'texts'))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not map shared index '%s': %s", directory, e)
+            return None
+        return cls(meta["name"], chunk_ids, chunks, vectorizer, chunk_vectors, meta.get("fingerprint"), meta.get("built_at"),
+                   directory)
+
+    # Scores several questions with one sparse matrix product; returns one search() result per question
+    def search_batch(self, questions, top_n=15):
+        if self.vectorizer is None or not questions:
+            return [("", np.array([], dtype=int), SparseScores()) for _ in questions]
+        with span("score", corpus=self.name, mode="batch", queries=len(questions)):
+            scores = (self.chunk_vectors @ self.vectorizer.transform(questions).T).tocsc()
+            results = []
+            for column in range(len(questions)):
+                start, end = scores.indptr[column], scores.indptr[column + 1]
+                rows, values = scores.indices[start:end], scores.data[start:end]
+                top_indices = rows[top_k_indices(values, top_n)]
+                similarities = SparseScores(zip(rows.tolist(), values.tolist()))
+                results.append(("\n\n".join([self.chunks[i] for i in top_indices]), top_indices, similarities))
+        return results
+
+    def index_of(self, chunk_id):
+        # A mapped index looks IDs up in its sorted key table instead of building a dict
+        if isinstance(self.chunk_ids, MappedStrings):
+            return self.chunk_ids.lookup(chunk_id)
+        if not hasattr(self, '_index_by_id'):
+            self._index_by_id = {chunk_id: index for index, chunk_id in enumerate(self.chunk_ids)}
+        return self._index_by_id.get(chunk_id)
+
+    def context_for(self, chunk_ids):
+        # Units of the same occupation record are merged into one block, without repeating shared lines
+        blocks = OrderedDict()
+        for chunk_id in chunk_ids:
+            index = self.index_of(chunk_id)
+            if index is not None:
+                blocks.setdefault(record_key(chunk_id), []).append(self.chunks[index])
+        return "\n\n".join([merge_unit_texts(texts) for texts in blocks.values()])
+
+    # With rows (a facet filter), only those rows are scored and every other chunk scores 0
+    def search(self, question, top_n=15, rows=None):
+        if self.vectorizer is None:
+            return "", np.array([], dtype=int), np.array([])
+        with span("score", corpus=self.name):
+            query_vector = self.vectorizer.transform([question])
+            # Rows are L2-normalised by TfidfVectorizer, so the dot product is the cosine similarity
+            if rows is None:
+                similarities = (self.chunk_vectors @ query_vector.T).toarray().ravel()
+                top_indices = top_k_indices(similarities, top_n)
+            else:
+                scores = (self.chunk_vectors[rows] @ query_vector.T).tocoo()
+                top_indices = rows[scores.row[top_k_indices(scores.data, top_n)]]
+                similarities = np.zeros(len(self.chunks))
+                similarities[rows[scores.row]] = scores.data
+        concatenated_chunks = "\n\n".join([self.chunks[i] for i in top_indices])
+        return concatenated_chunks, top_indices, similarities
+
+# Function to load a retriever from the saved index, or build and save it if missing or stale
+def load_retriever(name, file_path, load_chunks, index_dir=INDEX_DIR, granularity=CHUNK_GRANULARITY):
+    fingerprint = source_fingerprint(file_path)
+    if fingerprint is not None:
+        fingerprint["granularity"] = granularity
+    units = None
+    if CORPUS_SNAPSHOT:
+        # Mapping the snapshot is cheap; the saved index then takes its unit texts from it
+        with span("load_corpus", corpus=name, snapshot=True):
+            units = load_chunks(file_path, granularity)
+    with span("load_index", corpus=name):
+        retriever = TfidfRetriever.load(index_dir, name, fingerprint, units)
+    if retriever is not None:
+        return retriever
+    if units is None:
+        with span("load_corpus", corpus=name):
+            units = load_chunks(file_path, granularity)
+    retriever = TfidfRetriever.build(name, units, fingerprint)
+    try:
+        retriever.save(index_dir)
+    except OSError as e:
+        logger.warning("Could not save index '%s': %s", name, e)
+    return retriever
+
+# With RAG_SHARED_INDEX=1 (multi-worker serving) every process maps the same on-disk index read-only
+SHARED_INDEX = os.getenv('RAG_SHARED_INDEX', '0') == '1'
+SHARED_INDEX_DIR = os.path.join(INDEX_DIR, 'shared')
+
+# Function to map a corpus's shared index, writing it first if it is missing or stale. The write
+# happens once, under a file lock, so workers booting together do not all vectorize the corpus
+def load_shared_retriever(name, file_path, load_chunks, index_dir=SHARED_INDEX_DIR, granularity=CHUNK_GRANULARITY):
+    fingerprint = source_fingerprint(file_path)
+    if fingerprint is not None:
+        fingerprint["granularity"] = granularity
+    version = hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    directory = os.path.join(index_dir, f"{name}-{version}")
+    with span("load_index", corpus=name, shared=True):
+        retriever = TfidfRetriever.load_shared(directory)
+    if retriever is not None:
+        return retriever
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, f"{name}.lock"), 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        retriever = TfidfRetriever.load_shared(directory)
+        if retriever is None:
+            built = load_retriever(name, file_path, load_chunks, granularity=granularity)
+            if built.vectorizer is None:
+                return built
+            built.save_shared(directory)
+            # Older versions stay readable by processes that still map them until they exit
+            for entry in os.listdir(index_dir):
+                if entry.startswith(f"{name}-") and entry != os.path.basename(directory) and '.tmp-' not in entry:
+                    shutil.rmtree(os.path.join(index_dir, entry), ignore_errors=True)
+            retriever = TfidfRetriever.load_shared(directory)
+    return retriever
+
+# With RAG_STREAMING_INDEX=1 corpora are streamed into hashed on-disk indexes, for corpora larger than memory
+STREAMING_INDEX = os.getenv('RAG_STREAMING_INDEX', '0') == '1'
+STREAMING_INDEX_DIR = os.path.join(INDEX_DIR, 'streamed')
+STREAMING_BATCH_SIZE = int(os.getenv('RAG_STREAMING_BATCH_SIZE', 2048))
+# Version of the streamed index files; indexes written with another version are rebuilt
+STREAMING_INDEX_LAYOUT = 2
+
+# Builds an index in the shared (memory-mapped) layout from a stream of units, one batch at a time.
+# Each batch's hashed term counts are appended to raw CSR files and its unit IDs and texts to UTF-8
+# buffers, while document frequencies accumulate in one array of n_features counts. finish() turns the
+# counts into L2-normalised TF-IDF rows with a second pass over the mapped files, a batch of rows at a
+# time, so memory is bounded by the batch size and n_features rather than by the corpus. The same pass
+# writes the BM25 postings (see BM25Index): since each column holds one entry per document containing
+# the term, the document frequencies give the column offsets, and every batch is scattered into them.
+class StreamingIndexWriter:
+    def __init__(self, directory, n_features=HASHING_FEATURES, batch_size=STREAMING_BATCH_SIZE):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.vectorizer = HashedTfidfVectorizer(None, n_features)
+        self.document_frequency = np.zeros(n_features, dtype=np.int64)
+        self.num_units = 0
+        self.nnz = 0
+        self.total_length = 0.0
+        os.makedirs(directory, exist_ok=True)
+        self.files = {part: open(os.path.join(directory, part), 'wb') for part in
+                      ('counts.data', 'counts.indices', 'counts.rows', 'ids.bin', 'ids.lengths', 'texts.bin', 'texts.lengths')}
+
+    def append(self, units):
+        if not units:
+            return
+        counts = self.vectorizer.counts([text for _, text in units])
+        counts.sum_duplicates()
+        self.files['counts.data'].write(counts.data.astype(np.float32).tobytes())
+        self.files['counts.indices'].write(counts.indices.astype(np.int32).tobytes())
+        self.files['counts.rows'].write(np.diff(counts.indptr).astype(np.int64).tobytes())
+        self.document_frequency += np.bincount(counts.indices, minlength=len(self.document_frequency))
+        for part, strings in (('ids', [unit_id for unit_id, _ in units]), ('texts', [text for _, text in units])):
+            encoded = [string.encode('utf-8') for string in strings]
+            self.files[f'{part}.bin'].write(b"".join(encoded))
+            self.files[f'{part}.lengths'].write(np.array([len(item) for item in encoded], dtype=np.int64).tobytes())
+        self.num_units += len(units)
+        self.nnz += counts.nnz
+        self.total_length += float(counts.data.sum())
+
+    # Function to write the running sum of a raw int64 lengths file as an .npy offsets array starting at 0
+    def _write_offsets(self, part, target):
+        lengths = self._raw(part, np.int64)
+        offsets = np.lib.format.open_memmap(os.path.join(self.directory, target), mode='w+', dtype=np.int64,
+                                            shape=(self.num_units + 1,))
+        offsets[0] = total = 0
+        for start in range(0, self.num_units, self.batch_size):
+            running = np.cumsum(lengths[start:start + self.batch_size]) + total
+            offsets[start + 1:start + 1 + len(running)] = running
+            total = int(running[-1])
+        offsets.flush()
+        return offsets
+
+    def _raw(self, part, dtype):
+        path = os.path.join(self.directory, part)
+        # np.memmap cannot map an empty file
+        return np.memmap(path, dtype=dtype, mode='r') if os.path.getsize(path) else np.zeros(0, dtype=dtype)
+
+    def finish(self, name, fingerprint=None, k1=1.5, b=0.75):
+        for file in self.files.values():
+            file.close()
+        # Smoothed idf, as computed by TfidfVectorizer
+        idf = np.log((1 + self.num_units) / (1 + self.document_frequency)) + 1
+        np.save(os.path.join(self.directory, 'idf.npy'), idf)
+        bm25_idf = np.log1p((self.num_units - self.document_frequency + 0.5) / (self.document_frequency + 0.5))
+        average_length = self.total_length / self.num_units if self.num_units else 1.0
+        indptr = self._write_offsets('counts.rows', 'indptr.npy')
+        self._write_offsets('ids.lengths', 'ids.offsets.npy')
+        self._write_offsets('texts.lengths', 'texts.offsets.npy')
+        counts, columns = self._raw('counts.data', np.float32), self._raw('counts.indices', np.int32)
+        data = np.lib.format.open_memmap(os.path.join(self.directory, 'data.npy'), mode='w+', dtype=np.float32, shape=(self.nnz,))
+        indices = np.lib.format.open_memmap(os.path.join(self.directory, 'indices.npy'), mode='w+', dtype=np.int32, shape=(self.nnz,))
+        postings_indptr = np.concatenate([[0], np.cumsum(self.document_frequency)])
+        np.save(os.path.join(self.directory, 'bm25.indptr.npy'), postings_indptr)
+        postings_data = np.lib.format.open_memmap(os.path.join(self.directory, 'bm25.data.npy'), mode='w+',
+                                                  dtype=np.float32, shape=(self.nnz,))
+        postings_rows = np.lib.format.open_memmap(os.path.join(self.directory, 'bm25.indices.npy'), mode='w+',
+                                                  dtype=np.int32, shape=(self.nnz,))
+        # Next free slot of each column in the postings
+        cursor = postings_indptr[:-1].copy()
+        del postings_indptr
+        for start in range(0, self.num_units, self.batch_size):
+            end = min(start + self.batch_size, self.num_units)
+            low, high = int(indptr[start]), int(indptr[end])
+            rows = np.repeat(np.arange(end - start), np.diff(indptr[start:end + 1]))
+            tf, batch_columns = counts[low:high], columns[low:high]
+            weights = tf * idf[batch_columns]
+            norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=end - start))
+            data[low:high] = weights / np.maximum(norms[rows], 1e-12)
+            indices[low:high] = batch_columns
+
+            doc_lengths = np.bincount(rows, weights=tf, minlength=end - start)
+            bm25_weights = (bm25_idf[batch_columns] * tf * (k1 + 1)
+                            / (tf + k1 * (1 - b + b * doc_lengths[rows] / average_length)))
+            # A stable sort by column keeps the rows of each column in order; an entry's slot is the
+            # column cursor plus its rank among the batch's entries of that column
+            order = np.argsort(batch_columns, kind='stable')
+            sorted_columns = batch_columns[order]
+            ranks = np.arange(len(order)) - np.searchsorted(sorted_columns, sorted_columns, side='left')
+            slots = cursor[sorted_columns] + ranks
+            postings_rows[slots] = (rows[order] + start).astype(np.int32)
+            postings_data[slots] = bm25_weights[order]
+            cursor += np.bincount(batch_columns, minlength=len(cursor))
+        for array in (data, indices, postings_data, postings_rows):
+            array.flush()
+        del counts, columns, data, indices, indptr, postings_data, postings_rows
+        # Sorted key table for index_of(); it holds the unit IDs only, not the texts
+        ids = MappedStrings.load(os.path.join(self.directory, 'ids'))
+        keys = np.array([unit_id.encode('utf-8') for unit_id in ids], dtype=f"S{max([len(unit_id.encode('utf-8')) for unit_id in ids] + [1])}")
+        order = np.argsort(keys, kind='stable')
+        np.save(os.path.join(self.directory, 'ids.keys.npy'), keys[order])
+        np.save(os.path.join(self.directory, 'ids.positions.npy'), order.astype(np.int64))
+        for part in ('counts.data', 'counts.indices', 'counts.rows', 'ids.lengths', 'texts.lengths'):
+            os.remove(os.path.join(self.directory, part))
+        with open(os.path.join(self.directory, 'meta.json'), 'w', encoding='utf-8') as file:
+            json.dump({"name": name, "fingerprint": fingerprint, "built_at": time.time(), "shape": [self.num_units, len(idf)],
+                       "vectorizer": "hashing", "n_features": len(idf)}, file)
+
+# Function to stream units into a new hashed index in directory, in batches of batch_size
+def build_streaming_index(name, units, directory, fingerprint=None, batch_size=STREAMING_BATCH_SIZE, n_features=HASHING_FEATURES):
+    temporary = f"{directory}.tmp-{os.getpid()}"
+    writer = StreamingIndexWriter(temporary, n_features, batch_size)
+    try:
+        with span("vectorize", corpus=name, mode="streaming"):
+            units = iter(units)
+            while True:
+                batch = list(itertools.islice(units, batch_size))
+                if not batch:
+                    break
+                writer.append(batch)
+            writer.finish(name, fingerprint)
+    except Exception:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+    try:
+        os.rename(temporary, directory)
+    except OSError:
+        # Another process published the same index first
+        shutil.rmtree(temporary, ignore_errors=True)
+
+# Function to map a corpus's streamed index, streaming the source file into it first if it is missing or stale.
+# stream_chunks yields the units of the file lazily; the build runs once, under a file lock
+def load_streaming_retriever(name, file_path, stream_chunks, index_dir=STREAMING_INDEX_DIR, granularity=CHUNK_GRANULARITY):
+    fingerprint = source_fingerprint(file_path)
+    if fingerprint is None:
+        return TfidfRetriever(name, [], [])
+    fingerprint.update({"granularity": granularity, "n_features": HASHING_FEATURES, "layout": STREAMING_INDEX_LAYOUT})
+    version = hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    directory = os.path.join(index_dir, f"{name}-{version}")
+    with span("load_index", corpus=name, streaming=True):
+        retriever = TfidfRetriever.load_shared(directory)
+    if retriever is not None:
+        return retriever
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, f"{name}.lock"), 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        retriever = TfidfRetriever.load_shared(directory)
+        if retriever is None:
+            try:
+                build_streaming_index(name, stream_chunks(file_path, granularity), directory, fingerprint)
+            except Exception as e:
+                logger.error("Error reading or processing the JSON file: %s", e)
+                return TfidfRetriever(name, [], [], fingerprint=fingerprint)
+            for entry in os.listdir(index_dir):
+                if entry.startswith(f"{name}-") and entry != os.path.basename(directory) and '.tmp-' not in entry:
+                    shutil.rmtree(os.path.join(index_dir, entry), ignore_errors=True)
+            retriever = TfidfRetriever.load_shared(directory)
+    return retriever
+
+# Unit streams of each corpus, for streamed indexes
+STREAMING_SOURCES = {
+    "fiches_metiers": stream_chunks_from_json,
+    "jobs_json": stream_chunks_from_jobs_json,
+}
+
+_retrievers = None
+_retrievers_lock = threading.Lock()
+
+# Function to get both corpus retrievers, loading them only once per process
+def get_retrievers():
+    global _retrievers
+    if _retrievers is None:
+        with _retrievers_lock:
+            if _retrievers is None:
+                if STREAMING_INDEX:
+                    _retrievers = {
+                        "fiches_metiers": load_streaming_retriever("fiches_metiers", FICHES_METIERS_PATH, STREAMING_SOURCES["fiches_metiers"]),
+                        "jobs_json": load_streaming_retriever("jobs_json", JOBS_JSON_PATH, STREAMING_SOURCES["jobs_json"]),
+                    }
+                else:
+                    load = load_shared_retriever if SHARED_INDEX else load_retriever
+                    _retrievers = {
+                        "fiches_metiers": load("fiches_metiers", FICHES_METIERS_PATH, load_chunks_from_json),
+                        "jobs_json": load("jobs_json", JOBS_JSON_PATH, load_chunks_from_jobs_json),
+                    }
+                for name, retriever in _retrievers.items():
+                    INDEX_BUILD_TIMESTAMP.labels(corpus=name).set(retriever.built_at)
+    return _retrievers
+
+# Token budget for each of the two contexts sent to combined_template
+CONTEXT_TOKEN_BUDGET = int(os.getenv('RAG_CONTEXT_TOKEN_BUDGET', 2000))
+
+# Assembles a context from retrieved candidates under a token budget: units of the same record
+# are merged, near-duplicates are dropped and blocks are picked by maximal marginal relevance
+class ContextPacker:
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, duplicate_threshold=0.92, mmr_lambda=0.7):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.mmr_lambda = mmr_lambda
+
+    def pack(self, retriever, top_indices, similarities, token_budget=None):
+        with span("pack_context", corpus=retriever.name):
+            return self._pack(retriever, top_indices, similarities, token_budget)
+
+    def _pack(self, retriever, top_indices, similarities, token_budget=None):
+        token_budget = token_budget or self.token_budget
+        top_indices = [int(i) for i in top_indices]
+        naive_tokens = estimate_tokens(" ".join([retriever.chunks[i] for i in top_indices]))
+        report = {"candidates": len(top_indices), "blocks": 0, "duplicates_dropped": 0, "selected": 0,
+                  "token_budget": token_budget, "naive_tokens": naive_tokens, "packed_tokens": 0, "tokens_saved": naive_tokens}
+        candidates = [i for i in top_indices if similarities[i] > 0]
+        if not candidates:
+            return "", [], report
+
+        # Merge neighbouring units of the same occupation record into one block
+        groups = OrderedDict()
+        for i in candidates:
+            groups.setdefault(record_key(retriever.chunk_ids[i]), []).append(i)
+        members = [sorted(group) for group in groups.values()]
+        group_of = [g for g, group in enumerate(members) for _ in group]
+        flat = [i for group in members for i in group]
+        membership = sparse.csr_matrix((np.ones(len(flat)), (group_of, np.arange(len(flat)))), shape=(len(members), len(flat)))
+        vectors = sklearn_preprocessing.normalize(membership @ retriever.chunk_vectors[flat])
+        pairwise = (vectors @ vectors.T).toarray()
+        relevance = np.array([max(similarities[i] for i in group) for group in members])
+        # BM25 and fused scores are not bounded by 1, so relevance is rescaled before MMR
+        relevance = relevance / relevance.max()
+        block_ids = [[retriever.chunk_ids[i] for i in group] for group in members]
+        texts = [retriever.context_for(ids) for ids in block_ids]
+        tokens = [estimate_tokens(text) for text in texts]
+        report["blocks"] = len(members)
+
+        # Drop near-duplicate blocks, keeping the more relevant one of each pair
+        kept = []
+        for g in np.argsort(-relevance):
+            if any(pairwise[g, k] >= self.duplicate_threshold for k in kept):
+                report["duplicates_dropped"] += 1
+                continue
+            kept.append(int(g))
+
+        # Greedy MMR selection up to the token budget; the most relevant block is always kept
+        selected = [kept.pop(0)]
+        used = tokens[selected[0]]
+        while kept:
+            best, best_score = None, -np.inf
+            for g in kept:
+                if used + tokens[g] > token_budget:
+                    continue
+                redundancy = max(pairwise[g, k] for k in selected)
+                score = self.mmr_lambda * relevance[g] - (1 - self.mmr_lambda) * redundancy
+                if score > best_score:
+                    best, best_score = g, score
+            if best is None:
+                break
+            selected.append(best)
+            kept.remove(best)
+            used += tokens[best]
+
+        context = "\n\n".join([texts[g] for g in selected])
+        selected_ids = [chunk_id for g in selected for chunk_id in block_ids[g]]
+        report["selected"] = len(selected)
+        report["packed_tokens"] = estimate_tokens(context)
+        report["tokens_saved"] = max(naive_tokens - report["packed_tokens"], 0)
+        CONTEXT_TOKENS_SAVED.labels(retriever.name).inc(report["tokens_saved"])
+        return context, selected_ids, report
+
+# Initialize the context packer
+context_packer = ContextPacker()
+
+# Embedding backend for dense retrieval: "openai" or the offline "hashing" embedder
+EMBEDDER = os.getenv('RAG_EMBEDDER', 'openai')
+EMBEDDING_BATCH_SIZE = int(os.getenv('RAG_EMBEDDING_BATCH_SIZE', 64))
+DENSE_USE_ANN = os.getenv('RAG_DENSE_ANN', '0') == '1'
+# With RAG_DENSE_INDEX=1 the vector stores are built or loaded at startup, not only by build-index --dense
+DENSE_AT_STARTUP = os.getenv('RAG_DENSE_INDEX', '0') == '1'
+
+# Embedder backed by the OpenAI embeddings API
+class OpenAIEmbedder:
+    def __init__(self, model_name="text-embedding-3-small"):
+        self.name = model_name
+        self.client = langchain_openai.OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY, model=model_name)
+
+    def embed_documents(self, texts):
+        return np.asarray(self.client.embed_documents(list(texts)), dtype=np.float32)
+
+    def embed_query(self, text):
+        return np.asarray(self.client.embed_query(text), dtype=np.float32)
+
+# Deterministic local embedder (hashed, accent-folded character n-grams), for tests and offline builds
+class HashingEmbedder:
+    def __init__(self, dimensions=512):
+        self.name = f"hashing-{dimensions}"
+        self.vectorizer = sklearn_text.HashingVectorizer(analyzer='char_wb', ngram_range=(3, 5), n_features=dimensions,
+                                            strip_accents='unicode', lowercase=True, norm='l2')
+
+    def embed_documents(self, texts):
+        return self.vectorizer.transform(list(texts)).toarray().astype(np.float32)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+# Function to create the configured embedder
+def create_embedder(kind=EMBEDDER):
+    if kind == 'hashing':
+        return HashingEmbedder()
+    if kind == 'openai':
+        return OpenAIEmbedder()
+    raise ValueError(f"Unknown embedder '{kind}'.")
+
+# Float32 embedding matrix in a memory-mapped file, with a JSON sidecar holding the unit IDs
+class VectorStore:
+    def __init__(self, prefix, chunk_ids, vectors, meta, ann_index=None):
+        self.prefix = prefix
+        self.chunk_ids = chunk_ids
+        self.vectors = vectors
+        self.meta = meta
+        self.ann_index = ann_index
+
+    # Embeds the units in batches into a new file that replaces the old one only once complete,
+    # so a store still serving requests keeps reading its own (unlinked) file. Vectors of units whose
+    # text is unchanged can be copied from a previous store with reuse={unit index: previous row}
+    @classmethod
+    def build(cls, prefix, units, embedder, fingerprint=None, batch_size=EMBEDDING_BATCH_SIZE, use_ann=DENSE_USE_ANN,
+              previous=None, reuse=None):
+        chunk_ids = [unit_id for unit_id, _ in units]
+        texts = [text for _, text in units]
+        reuse = reuse or {}
+        pending = [i for i in range(len(texts)) if i not in reuse]
+        vectors = None
+        if reuse:
+            vectors = np.memmap(prefix + '.vectors.f32.tmp', dtype=np.float32, mode='w+',
+                                shape=(len(texts), previous.vectors.shape[1]))
+            for position, row in reuse.items():
+                vectors[position] = previous.vectors[row]
+        with span("embed", store=os.path.basename(prefix), chunks=len(pending)):
+            for start in range(0, len(pending), batch_size):
+                positions = pending[start:start + batch_size]
+                batch = np.asarray(embedder.embed_documents([texts[i] for i in positions]), dtype=np.float32)
+                if vectors is None:
+                    vectors = np.memmap(prefix + '.vectors.f32.tmp', dtype=np.float32, mode='w+',
+                                        shape=(len(texts), batch.shape[1]))
+                norms = np.linalg.norm(batch, axis=1, keepdims=True)
+                vectors[positions] = batch / np.maximum(norms, 1e-12)
+            vectors.flush()
+        meta = {"embedder": embedder.name, "dimensions": int(vectors.shape[1]), "fingerprint": fingerprint}
+        os.replace(prefix + '.vectors.f32.tmp', prefix + '.vectors.f32')
+        hnswlib = optional_import('hnswlib') if use_ann else None
+        if hnswlib is not None:
+            ann_index = hnswlib.Index(space='ip', dim=vectors.shape[1])
+            ann_index.init_index(max_elements=len(texts), ef_construction=200, M=16)
+            ann_index.add_items(vectors, np.arange(len(texts)))
+            ann_index.save_index(prefix + '.hnsw.tmp')
+            os.replace(prefix + '.hnsw.tmp', prefix + '.hnsw')
+            meta["ann"] = "hnsw"
+        # The sidecar is written last, so a store without one is never loaded
+        with open(prefix + '.ids.json.tmp', 'w', encoding='utf-8') as file:
+            json.dump({"ids": chunk_ids, **meta}, file, ensure_ascii=False)
+        os.replace(prefix + '.ids.json.tmp', prefix + '.ids.json')
+        return cls.load(prefix)
+
+    @classmethod
+    def load(cls, prefix):
+        if not os.path.exists(prefix + '.ids.json'):
+            return None
+        try:
+            with open(prefix + '.ids.json', 'r', encoding='utf-8') as file:
+                sidecar = json.load(file)
+            chunk_ids = sidecar.pop("ids")
+            vectors = np.memmap(prefix + '.vectors.f32', dtype=np.float32, mode='r',
+                                shape=(len(chunk_ids), sidecar["dimensions"]))
+            ann_index = None
+            hnswlib = optional_import('hnswlib') if sidecar.get("ann") == "hnsw" else None
+            if hnswlib is not None:
+                ann_index = hnswlib.Index(space='ip', dim=sidecar["dimensions"])
+                ann_index.load_index(prefix + '.hnsw', max_elements=len(chunk_ids))
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            logger.warning("Could not load vector store '%s': %s", prefix, e)
+            return None
+        return cls(prefix, chunk_ids, vectors, sidecar, ann_index)
+
+    def search(self, query_vector, top_k=15, rows=None):
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector = query_vector / max(float(np.linalg.norm(query_vector)), 1e-12)
+        if rows is not None:
+            # A facet filter is scanned exactly, with or without an ANN index
+            similarities = np.zeros(len(self.chunk_ids), dtype=np.float32)
+            similarities[rows] = self.vectors[rows] @ query_vector
+            return rows[top_k_indices(similarities[rows], top_k)], similarities
+        if self.ann_index is not None:
+            top_k = min(top_k, len(self.chunk_ids))
+            labels, distances = self.ann_index.knn_query(query_vector, k=top_k)
+            similarities = np.zeros(len(self.chunk_ids), dtype=np.float32)
+            similarities[labels[0]] = 1.0 - distances[0]
+            return labels[0].astype(int), similarities
+        similarities = np.asarray(self.vectors @ query_vector)
+        top_k = min(top_k, len(similarities))
+        top_indices = np.argpartition(-similarities, top_k - 1)[:top_k]
+        top_indices = top_indices[np.argsort(-similarities[top_indices])]
+        return top_indices, similarities
+
+# Dense counterpart of TfidfRetriever, sharing its units so chunk indices line up
+class DenseRetriever:
+    def __init__(self, name, store, embedder, chunks):
+        self.name = name
+        self.store = store
+        self.embedder = embedder
+        self.chunks = chunks
+
+    def search(self, question, top_n=15, rows=None):
+        if not self.chunks:
+            return "", np.array([], dtype=int), np.array([])
+        with span("score", corpus=self.name, mode="dense"):
+            top_indices, similarities = self.store.search(self.embedder.embed_query(question), top_n, rows)
+        concatenated_chunks = "\n\n".join([self.chunks[i] for i in top_indices])
+        return concatenated_chunks, top_indices, similarities
+
+# Function to load a corpus vector store, or embed the corpus in batches if it is missing or stale;
+# with a previous DenseRetriever, only units whose text changed are embedded again. With build=False
+# a missing or stale store returns None instead.
+def load_dense_retriever(retriever, embedder, index_dir=INDEX_DIR, previous=None, build=True):
+    if not retriever.chunks:
+        return DenseRetriever(retriever.name, None, embedder, [])
+    os.makedirs(index_dir, exist_ok=True)
+    prefix = os.path.join(index_dir, f"{retriever.name}.{embedder.name.replace('/', '_')}")
+    store = VectorStore.load(prefix)
+    if store is None or store.chunk_ids != retriever.chunk_ids or store.meta.get("fingerprint") != retriever.fingerprint:
+        if not build:
+            return None
+        reuse = None
+        if previous is not None and previous.store is not None and previous.embedder.name == embedder.name:
+            previous_rows = {unit: row for row, unit in enumerate(zip(previous.store.chunk_ids, previous.chunks))}
+            reuse = {position: previous_rows[unit] for position, unit in enumerate(zip(retriever.chunk_ids, retriever.chunks))
+                     if unit in previous_rows}
+        store = VectorStore.build(prefix, list(zip(retriever.chunk_ids, retriever.chunks)), embedder, retriever.fingerprint,
+                                  previous=previous.store if reuse else None, reuse=reuse)
+    return DenseRetriever(retriever.name, store, embedder, retriever.chunks)
+
+_derived_locks = {"bm25": threading.Lock(), "dense": threading.Lock(), "facets": threading.Lock()}
+
+# Function to get an index derived from a retriever, building it once and keeping it on that retriever,
+# so a request always pairs a TF-IDF index with the BM25 and dense indexes of the same corpus version
+def derived_index(retriever, kind, load):
+    if kind not in retriever.derived:
+        with _derived_locks[kind]:
+            if kind not in retriever.derived:
+                retriever.derived[kind] = load(retriever)
+    return retriever.derived[kind]
+
+_embedder = None
+
+# Function to get the dense retrievers of both corpora, embedding them only once per corpus version.
+# Requests pass build=False, so a corpus is never embedded on the request path: a corpus version whose
+# vector store was not built (at startup, by build-index --dense or on a hot swap) maps to None.
+def get_dense_retrievers(retrievers=None, build=True):
+    global _embedder
+    retrievers = retrievers or get_retrievers()
+    with _derived_locks["dense"]:
+        if _embedder is None:
+            _embedder = create_embedder()
+    dense_retrievers = {}
+    for name, retriever in retrievers.items():
+        if build or "dense" in retriever.derived:
+            dense_retrievers[name] = derived_index(retriever, "dense",
+                                                   lambda retriever: load_dense_retriever(retriever, _embedder))
+            continue
+        # A store written since (e.g. by build-index in another process) is picked up without embedding
+        with _derived_locks["dense"]:
+            if "dense" not in retriever.derived:
+                dense_retriever = load_dense_retriever(retriever, _embedder, build=False)
+                if dense_retriever is not None:
+                    retriever.derived["dense"] = dense_retriever
+        dense_retrievers[name] = retriever.derived.get("dense")
+    return dense_retrievers
+
+# BM25 over an inverted index: a CSC matrix whose column slices are the postings of each term,
+# holding precomputed BM25 weights. A query only visits the postings of its own terms. A streamed
+# index has its postings written by StreamingIndexWriter and mapped from its directory.
+class BM25Index:
+    def __init__(self, name, chunks, postings, vectorizer, fingerprint=None):
+        self.name = name
+        self.chunks = chunks
+        self.postings = postings
+        self.vocabulary = vectorizer.vocabulary_
+        self.analyzer = vectorizer.build_analyzer()
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, retriever, k1=1.5, b=0.75):
+        with span("vectorize", corpus=retriever.name, mode="bm25"):
+            if isinstance(retriever.vectorizer, HashedTfidfVectorizer):
+                counts = retriever.vectorizer.counts(retriever.chunks)
+            else:
+                counts = sklearn_text.CountVectorizer(vocabulary=retriever.vectorizer.vocabulary_).transform(retriever.chunks).tocsr()
+            counts = counts.astype(np.float32)
+            num_docs = counts.shape[0]
+            doc_lengths = np.asarray(counts.sum(axis=1)).ravel()
+            average_length = doc_lengths.mean() or 1.0
+            document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+            idf = np.log1p((num_docs - document_frequency + 0.5) / (document_frequency + 0.5))
+            rows = np.repeat(np.arange(num_docs), np.diff(counts.indptr))
+            tf = counts.data
+            counts.data = (idf[counts.indices] * tf * (k1 + 1)
+                           / (tf + k1 * (1 - b + b * doc_lengths[rows] / average_length))).astype(np.float32)
+            postings = counts.tocsc()
+        return cls(retriever.name, retriever.chunks, postings, retriever.vectorizer, retriever.fingerprint)
+
+    def save(self, index_dir):
+        prefix = os.path.join(index_dir, self.name)
+        sparse.save_npz(prefix + '.bm25.npz', self.postings)
+        with open(prefix + '.bm25.json', 'w', encoding='utf-8') as file:
+            json.dump({"fingerprint": self.fingerprint}, file)
+
+    @classmethod
+    def load(cls, index_dir, retriever):
+        prefix = os.path.join(index_dir, retriever.name)
+        if not os.path.exists(prefix + '.bm25.json'):
+            return None
+        try:
+            with open(prefix + '.bm25.json', 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            if meta.get("fingerprint") != retriever.fingerprint:
+                return None
+            postings = sparse.load_npz(prefix + '.bm25.npz').tocsc()
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load BM25 index '%s': %s", retriever.name, e)
+            return None
+        return cls(retriever.name, retriever.chunks, postings, retriever.vectorizer, retriever.fingerprint)
+
+    @classmethod
+    def load_streamed(cls, retriever):
+        try:
+            data, indices = (np.load(os.path.join(retriever.directory, f"bm25.{part}.npy"), mmap_mode='r')
+                             for part in ('data', 'indices'))
+            indptr = np.load(os.path.join(retriever.directory, 'bm25.indptr.npy'))
+            postings = sparse.csc_matrix((data, indices, indptr), shape=retriever.chunk_vectors.shape, copy=False)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not map BM25 postings of '%s': %s", retriever.name, e)
+            return None
+        return cls(retriever.name, retriever.chunks, postings, retriever.vectorizer, retriever.fingerprint)
+
+    def scores(self, question, rows=None):
+        term_ids = sorted({self.vocabulary[term] for term in self.analyzer(question) if term in self.vocabulary})
+        if not term_ids:
+            return np.array([], dtype=int), np.array([], dtype=np.float32)
+        indptr = self.postings.indptr
+        docs = np.concatenate([self.postings.indices[indptr[t]:indptr[t + 1]] for t in term_ids])
+        weights = np.concatenate([self.postings.data[indptr[t]:indptr[t + 1]] for t in term_ids])
+        if rows is not None:
+            # Postings outside a facet filter are dropped before they are accumulated
+            kept = np.isin(docs, rows)
+            docs, weights = docs[kept], weights[kept]
+        visited, inverse = np.unique(docs, return_inverse=True)
+        return visited, np.bincount(inverse, weights=weights)
+
+    def search(self, question, top_n=15, rows=None):
+        with span("score", corpus=self.name, mode="bm25"):
+            visited, visited_scores = self.scores(question, rows)
+            order = top_k_indices(visited_scores, top_n)
+            top_indices = visited[order]
+            similarities = SparseScores(zip(visited.tolist(), visited_scores.tolist()))
+        concatenated_chunks = "\n\n".join([self.chunks[i] for i in top_indices])
+        return concatenated_chunks, top_indices, similarities
+
+# Function to fuse several rankings with reciprocal rank fusion
+def reciprocal_rank_fusion(rankings, top_n=15, k=60):
+    fused = SparseScores()
+    for ranking in rankings:
+        for rank, index in enumerate(ranking):
+            fused[int(index)] = fused[int(index)] + 1.0 / (k + rank + 1)
+    indices = np.fromiter(fused.keys(), dtype=int, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=float, count=len(fused))
+    return indices[top_k_indices(scores, top_n)], fused
+
+# Function to load a corpus BM25 index, or build and save it if missing or stale
+def load_bm25_index(retriever, index_dir=INDEX_DIR):
+    if not retriever.chunks:
+        return None
+    if isinstance(retriever.vectorizer, HashedTfidfVectorizer):
+        return BM25Index.load_streamed(retriever)
+    bm25_index = BM25Index.load(index_dir, retriever)
+    if bm25_index is None:
+        bm25_index = BM25Index.build(retriever)
+        try:
+            bm25_index.save(index_dir)
+        except OSError as e:
+            logger.warning("Could not save BM25 index '%s': %s", retriever.name, e)
+    return bm25_index
+
+# Function to get the BM25 indexes of both corpora, building them only once per corpus version
+def get_bm25_indexes(retrievers=None):
+    retrievers = retrievers or get_retrievers()
+    return {name: derived_index(retriever, "bm25", load_bm25_index) for name, retriever in retrievers.items()}
+
+# Words ignored when mining and applying the query expansion tables
+EXPANSION_STOPWORDS = {
+    "les", "des", "une", "pour", "dans", "que", "qui", "vous", "sur", "avec", "pas", "sont", "ces",
+    "aux", "votre", "leur", "leurs", "être", "cette", "par", "plus", "son", "ses", "tout", "tous",
+    "est", "mon", "mes", "aime", "aimer", "travailler", "métier", "métiers", "conseils",
+    "quels", "quelles", "quel", "quelle", "comment", "quelqu", "personne",
+    "the", "and", "are", "for", "with", "that", "this", "you", "their", "can", "these", "from",
+    "other", "such", "also", "into", "its", "they", "them", "who", "which", "may", "all",
+}
+
+QUERY_EXPANSION_PATH = os.path.join(INDEX_DIR, 'query_expansion.json')
+
+# Function to strip accents so inflections are grouped regardless of diacritics
+def normalize_accents(text):
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+
+# Expands a question with terms mined from the corpora: co-occurrence neighbours from the skills,
+# responsibilities and sector fields of fiches-metiers.json and the ESCO descriptions of jobs.json,
+# and variant tables grouping the inflections of a word ("informatique", "informaticien")
+class QueryExpander:
+    token_pattern = r"(?u)\b[^\W\d_]{3,}\b"
+
+    def __init__(self, neighbours, variants, fingerprint=None):
+        self.neighbours = neighbours
+        self.variants = variants
+        self.fingerprint = fingerprint
+        self.analyzer = sklearn_text.CountVectorizer(token_pattern=self.token_pattern, stop_words=sorted(EXPANSION_STOPWORDS)).build_analyzer()
+
+    @staticmethod
+    def stem(term, length=6):
+        term = normalize_accents(term)
+        return term[:length] if len(term) > length else None
+
+    @staticmethod
+    def documents(occupation_records, esco_records):
+        for record in occupation_records:
+            sector = f"{record.title_fr} {record.title_en} {record.sector_fr} {record.sector_en}"
+            yield " ".join([sector] + record.knowledge + record.tools)
+            yield " ".join([sector] + record.soft_skills)
+            for responsibility in record.responsibilities:
+                yield f"{sector} {responsibility}"
+        for record in esco_records:
+            yield f"{record.uid} {record.description}"
+
+    @classmethod
+    def build(cls, occupation_records, esco_records, fingerprint=None, neighbours_per_term=5, min_association=0.1, max_df=0.2):
+        with span("mine_expansions", occupations=len(occupation_records), esco=len(esco_records)):
+            documents = list(cls.documents(occupation_records, esco_records))
+            if not documents:
+                return cls({}, {}, fingerprint)
+            vectorizer = sklearn_text.CountVectorizer(token_pattern=cls.token_pattern, stop_words=sorted(EXPANSION_STOPWORDS),
+                                         binary=True, min_df=2, max_df=max_df if len(documents) >= 50 else 1.0)
+            try:
+                incidence = vectorizer.fit_transform(documents).tocsc().astype(np.float32)
+            except ValueError:
+                return cls({}, {}, fingerprint)
+            terms = vectorizer.get_feature_names_out()
+            # Cosine of the term incidence columns: how often two terms share a document,
+            # relative to how often each of them occurs at all
+            cooccurrence = (incidence.T @ incidence).tocsr()
+            norms = 1.0 / np.sqrt(np.maximum(cooccurrence.diagonal(), 1.0))
+            cooccurrence = sparse.diags(norms) @ cooccurrence @ sparse.diags(norms)
+            cooccurrence.setdiag(0)
+            cooccurrence = cooccurrence.tocsr()
+            cooccurrence.eliminate_zeros()
+            neighbours = {}
+            for term_id, term in enumerate(terms):
+                start, end = cooccurrence.indptr[term_id], cooccurrence.indptr[term_id + 1]
+                scores = cooccurrence.data[start:end]
+                order = top_k_indices(scores, neighbours_per_term)
+                related = [[str(terms[cooccurrence.indices[start + i]]), round(float(scores[i]), 4)]
+                           for i in order if scores[i] >= min_association]
+                if related:
+                    neighbours[str(term)] = related
+            variants = {}
+            for term in terms:
+                stem = cls.stem(term)
+                if stem:
+                    variants.setdefault(stem, []).append(str(term))
+            variants = {stem: forms for stem, forms in variants.items() if len(forms) > 1}
+        return cls(neighbours, variants, fingerprint)
+
+    def save(self, file_path):
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        with open(file_path, 'w', encoding='utf-8') as file:
+            json.dump({"fingerprint": self.fingerprint, "neighbours": self.neighbours, "variants": self.variants},
+                      file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, file_path, fingerprint):
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                tables = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load query expansion tables: %s", e)
+            return None
+        if tables.get("fingerprint") != fingerprint:
+            return None
+        return cls(tables["neighbours"], tables["variants"], fingerprint)
+
+    def expand(self, question, terms_per_word=3, max_terms=30):
+        words = list(dict.fromkeys(self.analyzer(question or "")))
+        seen = set(words)
+        lines = [question]
+        added = 0
+        for word in words:
+            candidates = [form for form in self.variants.get(self.stem(word) or "", []) if form != word]
+            candidates += [term for term, _ in self.neighbours.get(word, [])]
+            expansions = []
+            for term in candidates:
+                if term not in seen and len(expansions) < terms_per_word and added < max_terms:
+                    seen.add(term)
+                    expansions.append(term)
+                    added += 1
+            # One line per expanded word, so multi-query retrieval scores each of them separately
+            if expansions:
+                lines.append(" ".join([word] + expansions))
+        return "\n".join(lines)
+
+# Function to load the query expansion tables, or mine and save them if missing or stale
+def load_query_expander(fiches_metiers_path=FICHES_METIERS_PATH, jobs_json_path=JOBS_JSON_PATH, file_path=QUERY_EXPANSION_PATH):
+    fingerprint = {"fiches_metiers": source_fingerprint(fiches_metiers_path), "jobs_json": source_fingerprint(jobs_json_path)}
+    expander = QueryExpander.load(file_path, fingerprint)
+    if expander is not None:
+        return expander
+    with span("load_corpus", corpus="query_expansion"):
+        occupation_records = corpus_records("fiches_metiers", fiches_metiers_path)
+        esco_records = corpus_records("jobs_json", jobs_json_path)
+    expander = QueryExpander.build(occupation_records, esco_records, fingerprint)
+    try:
+        expander.save(file_path)
+    except OSError as e:
+        logger.warning("Could not save query expansion tables: %s", e)
+    return expander
+
+_query_expander = None
+_query_expander_lock = threading.Lock()
+
+# Function to get the query expander, mining its tables only once per process
+def get_query_expander():
+    global _query_expander
+    if _query_expander is None:
+        with _query_expander_lock:
+            if _query_expander is None:
+                _query_expander = load_query_expander()
+    return _query_expander
+
+# Function-word lists ignored when aligning and translating; content words carry the retrieval signal
+LEXICON_STOPWORDS = {
+    "French": {"le", "la", "les", "l", "d", "de", "des", "du", "un", "une", "en", "et", "ou", "a", "au", "aux",
+               "pour", "par", "dans", "sur", "avec", "que", "qui", "quoi", "je", "tu", "il", "elle", "on",
+               "nous", "vous", "ils", "me", "mon", "ma", "mes", "ton", "ta", "tes", "son", "sa", "ses", "ce",
+               "cet", "cette", "ces", "est", "sont", "etre", "pas", "ne", "plus", "qu", "j", "s", "n", "c", "m", "t"},
+    "English": {"the", "a", "an", "and", "or", "of", "in", "on", "for", "to", "with", "by", "at", "from", "as"},
+}
+
+BILINGUAL_LEXICON_PATH = os.path.join(INDEX_DIR, 'bilingual_lexicon.json')
+
+# French-to-English lexicon mined from the paired titles and sectors of fiches-metiers.json
+# ("Manager-en-Hotellerie" / "Hospitality Manager"): whole titles and sectors become phrase
+# entries, and single words are aligned by how consistently they co-occur across the pairs,
+# with spelling similarity breaking ties between cognates ("tourisme" / "tourism")
+class BilingualLexicon:
+    max_phrase_words = 5
+
+    def __init__(self, phrases, words, fingerprint=None):
+        self.phrases = phrases
+        self.words = words
+        self.fingerprint = fingerprint
+        # English words already present in a query (from the fast expansion, or tool names) pass through
+        self.english_words = {word for translations in words.values() for word in translations}
+        self.english_words.update(word for phrase in phrases.values() for word in phrase.split())
+
+    @staticmethod
+    def tokenize(text, language="French"):
+        words = re.findall(r"[a-z]+", normalize_accents(text or "").lower())
+        return [word for word in words if word not in LEXICON_STOPWORDS[language] and len(word) > 1]
+
+    @staticmethod
+    def pairs(occupation_records):
+        for record in occupation_records:
+            yield record.title_fr, record.title_en
+            yield record.sector_fr, record.sector_en
+
+    @classmethod
+    def build(cls, occupation_records, fingerprint=None, min_score=0.5, max_translations=2):
+        with span("mine_lexicon", occupations=len(occupation_records)):
+            phrases = {}
+            pair_counts, french_counts, english_counts = {}, {}, {}
+            for french, english in cls.pairs(occupation_records):
+                french_words, english_words = cls.tokenize(french), cls.tokenize(english, "English")
+                if not french_words or not english_words:
+                    continue
+                phrases.setdefault(" ".join(french_words), " ".join(english_words))
+                for word in set(french_words):
+                    french_counts[word] = french_counts.get(word, 0) + 1
+                for word in set(english_words):
+                    english_counts[word] = english_counts.get(word, 0) + 1
+                for french_word in set(french_words):
+                    for english_word in set(english_words):
+                        pair_counts[(french_word, english_word)] = pair_counts.get((french_word, english_word), 0) + 1
+            candidates = {}
+            for (french_word, english_word), count in pair_counts.items():
+                dice = 2.0 * count / (french_counts[french_word] + english_counts[english_word])
+                similarity = difflib.SequenceMatcher(None, french_word, english_word).ratio()
+                score = dice * (0.5 + similarity)
+                if french_word == english_word or score >= min_score:
+                    candidates.setdefault(french_word, []).append((score + (french_word == english_word), english_word))
+            words = {}
+            for french_word, scored in candidates.items():
+                scored.sort(reverse=True)
+                words[french_word] = [english_word for score, english_word in scored[:max_translations]
+                                      if score >= 0.8 * scored[0][0]]
+        return cls(phrases, words, fingerprint)
+
+    def save(self, file_path):
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        with open(file_path, 'w', encoding='utf-8') as file:
+            json.dump({"fingerprint": self.fingerprint, "phrases": self.phrases, "words": self.words}, file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, file_path, fingerprint):
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                tables = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load bilingual lexicon: %s", e)
+            return None
+        if tables.get("fingerprint") != fingerprint:
+            return None
+        return cls(tables["phrases"], tables["words"], fingerprint)
+
+    # Translates a French text word by word into English retrieval terms; returns (text, coverage),
+    # coverage being the share of its content words the lexicon knew
+    def translate(self, text):
+        lines = []
+        known = total = 0
+        for line in (text or "").splitlines():
+            words = self.tokenize(line)
+            translated = []
+            position = 0
+            while position < len(words):
+                # Longest phrase entry first, so a whole title or sector keeps its English form
+                for length in range(min(self.max_phrase_words, len(words) - position), 0, -1):
+                    phrase = " ".join(words[position:position + length])
+                    if length > 1 and phrase in self.phrases:
+                        translated.append(self.phrases[phrase])
+                        known += length
+                        break
+                    if length == 1 and phrase in self.words:
+                        translated.extend(self.words[phrase])
+                        known += 1
+                        break
+                    if length == 1 and phrase in self.english_words:
+                        translated.append(phrase)
+                        known += 1
+                        break
+                position += length
+            total += len(words)
+            if translated:
+                lines.append(" ".join(translated))
+        return "\n".join(lines), (known / total if total else 0.0)
+
+# Function to load the bilingual lexicon, or mine and save it if missing or stale
+def load_bilingual_lexicon(fiches_metiers_path=FICHES_METIERS_PATH, file_path=BILINGUAL_LEXICON_PATH):
+    fingerprint = source_fingerprint(fiches_metiers_path)
+    lexicon = BilingualLexicon.load(file_path, fingerprint)
+    if lexicon is not None:
+        return lexicon
+    with span("load_corpus", corpus="bilingual_lexicon"):
+        occupation_records = corpus_records("fiches_metiers", fiches_metiers_path)
+    lexicon = BilingualLexicon.build(occupation_records, fingerprint)
+    try:
+        lexicon.save(file_path)
+    except OSError as e:
+        logger.warning("Could not save bilingual lexicon: %s", e)
+    return lexicon
+
+_bilingual_lexicon = None
+_bilingual_lexicon_lock = threading.Lock()
+
+# Function to get the bilingual lexicon, mining it only once per process
+def get_bilingual_lexicon():
+    global _bilingual_lexicon
+    if _bilingual_lexicon is None:
+        with _bilingual_lexicon_lock:
+            if _bilingual_lexicon is None:
+                _bilingual_lexicon = load_bilingual_lexicon()
+    return _bilingual_lexicon
+
+# Whether /generate_chunks infers a sector filter from the question when the request names none
+SECTOR_INFERENCE = os.getenv('RAG_SECTOR_INFERENCE', '1') != '0'
+
+# Facet index over the sectors of fiches-metiers.json: one bitmap of unit rows per sector, packed
+# eight rows to a byte, and the stems of the sector names used to infer a filter from a question
+# ("hôtellerie" -> Hôtellerie-restauration-et-tourisme). Sector ids are positions in self.sectors
+class SectorFacets:
+    def __init__(self, name, sectors, sectors_en, bitmaps, num_units, fingerprint=None):
+        self.name = name
+        self.sectors = sectors
+        self.sectors_en = sectors_en
+        self.bitmaps = bitmaps
+        self.num_units = num_units
+        self.fingerprint = fingerprint
+        # A sector can be named in French or English, with any separators ("Health social", "santé-et-social")
+        self.aliases = {}
+        keywords = {}
+        for sector_id, names in enumerate(zip(sectors, sectors_en)):
+            for name in names:
+                if name:
+                    self.aliases[" ".join(re.findall(r"[a-z]+", normalize_accents(name).lower()))] = sector_id
+                for stem in self.stems(name):
+                    keywords.setdefault(stem, set()).add(sector_id)
+        # A stem shared by most sectors says nothing about which one a question is about
+        self.keywords = {stem: sorted(ids) for stem, ids in keywords.items() if len(ids) <= max(1, len(sectors) // 2)}
+
+    # Function to get the 6-letter stems of the content words of a text, accents folded
+    @staticmethod
+    def stems(text):
+        words = re.findall(r"[a-z]+", normalize_accents(text or "").lower())
+        return {word[:6] for word in words if len(word) >= 4 and word not in EXPANSION_STOPWORDS}
+
+    @classmethod
+    def build(cls, retriever, occupation_records):
+        with span("build_facets", corpus=retriever.name, units=len(retriever)):
+            # Records share one (French, English) tuple per sector, so streamed records leave only their IDs behind
+            sector_pairs = {}
+            sector_names = {record.record_id: sector_pairs.setdefault((record.sector_fr, record.sector_en),
+                                                                      (record.sector_fr, record.sector_en))
+                            for record in occupation_records}
+            members = {}
+            for row in range(len(retriever)):
+                sector_fr, sector_en = sector_names.get(record_key(retriever.chunk_ids[row]), ("", ""))
+                if sector_fr:
+                    members.setdefault((sector_fr, sector_en), []).append(row)
+            sectors = sorted(members)
+            bitmaps = np.zeros((len(sectors), (len(retriever) + 7) // 8), dtype=np.uint8)
+            for sector_id, sector in enumerate(sectors):
+                mask = np.zeros(len(retriever), dtype=bool)
+                mask[members[sector]] = True
+                bitmaps[sector_id] = np.packbits(mask)
+        return cls(retriever.name, [fr for fr, _ in sectors], [en for _, en in sectors], bitmaps, len(retriever),
+                   retriever.fingerprint)
+
+    def save(self, index_dir):
+        prefix = os.path.join(index_dir, self.name)
+        np.save(prefix + '.facets.npy', self.bitmaps)
+        with open(prefix + '.facets.json', 'w', encoding='utf-8') as file:
+            json.dump({"fingerprint": self.fingerprint, "num_units": self.num_units, "sectors": self.sectors,
+                       "sectors_en": self.sectors_en}, file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir, retriever):
+        prefix = os.path.join(index_dir, retriever.name)
+        if not os.path.exists(prefix + '.facets.json'):
+            return None
+        try:
+            with open(prefix + '.facets.json', 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            if meta.get("fingerprint") != retriever.fingerprint or meta.get("num_units") != len(retriever):
+                return None
+            bitmaps = np.load(prefix + '.facets.npy')
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load sector facets '%s': %s", retriever.name, e)
+            return None
+        return cls(retriever.name, meta["sectors"], meta["sectors_en"], bitmaps, meta["num_units"], meta["fingerprint"])
+
+    # Function to get the sector ids of the given French or English sector names
+    def resolve(self, names):
+        sector_ids = set()
+        for name in names:
+            sector_id = self.aliases.get(" ".join(re.findall(r"[a-z]+", normalize_accents(str(name)).lower())))
+            if sector_id is None:
+                raise ValueError(f"Unknown sector '{name}'.")
+            sector_ids.add(sector_id)
+        return sorted(sector_ids)
+
+    # Function to get the sector ids whose names share a stem with the question
+    def infer(self, question):
+        return sorted({sector_id for stem in self.stems(question) for sector_id in self.keywords.get(stem, ())})
+
+    # Function to get the sorted unit rows of the union of the given sectors
+    def rows(self, sector_ids):
+        bitmap = np.bitwise_or.reduce(self.bitmaps[list(sector_ids)], axis=0)
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.num_units))
+
+    def describe(self):
+        sizes = np.unpackbits(self.bitmaps, axis=1, count=self.num_units).sum(axis=1) if self.sectors else []
+        return [{"sector": sector, "sector_en": sector_en, "units": int(size)}
+                for sector, sector_en, size in zip(self.sectors, self.sectors_en, sizes)]
+
+# Function to load the sector facets of the fiches-metiers index, or build and save them if missing or stale
+def load_sector_facets(retriever, index_dir=INDEX_DIR):
+    if not retriever.chunks:
+        return None
+    facets = SectorFacets.load(index_dir, retriever)
+    if facets is None:
+        # Under streaming the records are read one at a time; only their IDs and sectors are kept
+        records = (iter_occupation_records(FICHES_METIERS_PATH) if STREAMING_INDEX
+                   else corpus_records("fiches_metiers", FICHES_METIERS_PATH))
+        facets = SectorFacets.build(retriever, records)
+        try:
+            facets.save(index_dir)
+        except OSError as e:
+            logger.warning("Could not save sector facets: %s", e)
+    return facets
+
+# Function to get the sector facets of the fiches-metiers index (jobs.json has no sectors), built once per corpus version
+def get_sector_facets(retrievers=None):
+    retrievers = retrievers or get_retrievers()
+    return derived_index(retrievers["fiches_metiers"], "facets", load_sector_facets)
+
+# Seconds between two checks of the corpus files for changes; 0 disables the watcher
+INDEX_WATCH_INTERVAL = float(os.getenv('RAG_INDEX_WATCH_INTERVAL', 10))
+
+# Sources of the two corpora: file path, raw row reader and row parser
+CORPUS_SOURCES = {
+    "fiches_metiers": (FICHES_METIERS_PATH, occupation_rows, occupation_record_from_row),
+    "jobs_json": (JOBS_JSON_PATH, esco_rows, esco_record_from_row),
+}
+
+# Drive mirrors of the corpora that have a Drive file ID; they download into the corpus files
+drive_syncs = [DriveSync(file_id, CORPUS_SOURCES[name][0]) for name, file_id in DRIVE_FILE_IDS.items() if file_id]
+
+# Function to sync the corpora from Google Drive; returns the snapshot paths that were updated
+def sync_corpora_from_drive(syncs=None):
+    updated = []
+    for drive_sync in drive_syncs if syncs is None else syncs:
+        try:
+            if drive_sync.sync():
+                updated.append(drive_sync.snapshot_path)
+        except Exception as e:
+            DRIVE_SYNCS.labels(result="error").inc()
+            logger.error("Could not sync Drive file '%s': %s", drive_sync.file_id, e)
+    return updated
+
+# Function to hash the content of a file without reading it into memory at once
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Function to format a Unix timestamp as an ISO 8601 UTC string
+def iso_time(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+# Watches the corpus files and hot-swaps an incrementally updated index when one of them changes.
+# A change is seen from size and mtime, must be stable over two checks (so a file still being copied
+# is not loaded) and is confirmed with a content hash. Only rows whose raw text changed are parsed
+# and rendered again, and only the resulting new or changed units are vectorized. The new retrievers,
+# with the BM25 and dense indexes that were in use, are built off to the side and swapped in with one
+# assignment: requests in flight finish on the version they started with. Streamed indexes keep no
+# rows in memory: a changed file is streamed again into a new on-disk index
+class CorpusWatcher:
+    def __init__(self, interval=INDEX_WATCH_INTERVAL, index_dir=INDEX_DIR, granularity=CHUNK_GRANULARITY,
+                 sync_interval=DRIVE_SYNC_INTERVAL):
+        self.interval = interval
+        self.sync_interval = sync_interval
+        self.index_dir = index_dir
+        self.granularity = granularity
+        self.version = 1
+        self.state = {}
+        self.pending = {}
+        self.last_reload = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    # Function to parse a corpus file into units, reusing the units of rows seen in the previous parse
+    def parse(self, name, previous_rows=None):
+        file_path, rows, record_from_row = CORPUS_SOURCES[name]
+        previous_rows = previous_rows or {}
+        units, row_units, parsed = [], {}, 0
+        with open(file_path, 'r', encoding='utf-8', newline='') as file:
+            for row in rows(file):
+                row_hash = hashlib.sha1(repr(row).encode('utf-8')).hexdigest()
+                if row_hash not in row_units:
+                    if row_hash in previous_rows:
+                        row_units[row_hash] = previous_rows[row_hash]
+                    else:
+                        record = record_from_row(row)
+                        row_units[row_hash] = occupation_units([record], self.granularity) if record else []
+                        parsed += 1
+                units.extend(row_units[row_hash])
+        return units, row_units, parsed
+
+    # Function to record the served version of each corpus and, unless it is streamed, the units of its current rows
+    def prime(self):
+        retrievers = get_retrievers()
+        with self.lock:
+            for name in CORPUS_SOURCES:
+                fingerprint = retrievers[name].fingerprint or {}
+                rows = {}
+                if not STREAMING_INDEX:
+                    try:
+                        _, rows, _ = self.parse(name)
+                    except OSError:
+                        pass
+                self.state[name] = {"stat": {key: fingerprint.get(key) for key in ("size", "mtime_ns")},
+                                    "sha256": None, "rows": rows}
+
+    def changed_corpora(self, settle=True):
+        changed = []
+        for name, (file_path, _, _) in CORPUS_SOURCES.items():
+            stat = source_fingerprint(file_path)
+            known = self.state.setdefault(name, {"stat": None, "sha256": None, "rows": {}})
+            # A missing file keeps the current index serving
+            if stat is None or stat == known["stat"]:
+                continue
+            if settle and self.pending.get(name) != stat:
+                self.pending[name] = stat
+                continue
+            digest = file_digest(file_path)
+            if digest == known["sha256"]:
+                known["stat"] = stat
+                continue
+            changed.append((name, stat, digest))
+        return changed
+
+    # Function to check the corpus files once and reload the ones that changed; returns the reload report
+    def check(self, settle=True):
+        with self.lock:
+            try:
+                changed = self.changed_corpora(settle)
+                if not changed:
+                    return None
+                return self.reload(changed)
+            except Exception as e:
+                INDEX_RELOADS.labels(result="error").inc()
+                logger.error("Could not reload the corpus index: %s", e)
+                return None
+
+    def reload(self, changed):
+        global _retrievers, _query_expander, _bilingual_lexicon
+        start = time.perf_counter()
+        current = get_retrievers()
+        updated = dict(current)
+        report = {}
+        for name, stat, digest in changed:
+            previous = current[name]
+            if STREAMING_INDEX:
+                rows = {}
+                retriever = load_streaming_retriever(name, CORPUS_SOURCES[name][0], STREAMING_SOURCES[name],
+                                                     granularity=self.granularity)
+                report[name] = {"streamed_units": len(retriever)}
+            else:
+                with span("load_corpus", corpus=name, incremental=True):
+                    units, rows, parsed = self.parse(name, self.state[name]["rows"])
+                retriever, report[name] = previous.update(units, {**stat, "granularity": self.granularity})
+                report[name]["parsed_rows"] = parsed
+            # Derived indexes in use are rebuilt before the swap, so no request pays for them
+            if "bm25" in previous.derived:
+                retriever.derived["bm25"] = load_bm25_index(retriever, self.index_dir)
+            if "facets" in previous.derived:
+                retriever.derived["facets"] = load_sector_facets(retriever, self.index_dir)
+            if "dense" in previous.derived:
+                previous_dense = previous.derived["dense"]
+                retriever.derived["dense"] = load_dense_retriever(retriever, previous_dense.embedder, self.index_dir, previous_dense)
+            try:
+                retriever.save(self.index_dir)
+            except OSError as e:
+                logger.warning("Could not save index '%s': %s", name, e)
+            updated[name] = retriever
+            self.state[name] = {"stat": stat, "sha256": digest, "rows": rows}
+
+        # Tables mined from the corpora follow the new files if they were in use
+        query_expander = load_query_expander() if _query_expander is not None else None
+        bilingual_lexicon = load_bilingual_lexicon() if _bilingual_lexicon is not None and "fiches_metiers" in report else None
+        with _retrievers_lock:
+            _retrievers = updated
+            if query_expander is not None:
+                _query_expander = query_expander
+            if bilingual_lexicon is not None:
+                _bilingual_lexicon = bilingual_lexicon
+            self.version += 1
+
+        INDEX_RELOADS.labels(result="swapped").inc()
+        INDEX_VERSION.set(self.version)
+        for name in report:
+            INDEX_BUILD_TIMESTAMP.labels(corpus=name).set(updated[name].built_at)
+        self.last_reload = {"version": self.version, "at": iso_time(time.time()),
+                            "duration_ms": round((time.perf_counter() - start) * 1000, 2), "corpora": report}
+        logger.info("Corpus index reloaded: %s", json.dumps(self.last_reload))
+        return self.last_reload
+
+    def status(self):
+        retrievers = get_retrievers()
+        return {
+            "version": self.version,
+            "corpora": {name: {"built_at": iso_time(retriever.built_at), "num_chunks": len(retriever),
+                               "fingerprint": retriever.fingerprint}
+                        for name, retriever in retrievers.items()},
+            "watching": self.thread is not None and self.thread.is_alive(),
+            "last_reload": self.last_reload,
+        }
+
+    def run(self):
+        self.prime()
+        last_sync = time.monotonic()
+        while not self.stop_event.wait(self.interval):
+            # Drive snapshots are replaced atomically, so a synced file needs no settling check
+            if drive_syncs and time.monotonic() - last_sync >= self.sync_interval:
+                last_sync = time.monotonic()
+                if sync_corpora_from_drive():
+                    self.check(settle=False)
+                    continue
+            self.check()
+
+    def start(self):
+        if self.interval > 0 and self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="corpus-watcher", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+# Initialize the corpus watcher; it is started by the serve command
+corpus_watcher = CorpusWatcher()
+
+# Function to search one corpus with the requested retrieval mode
+# (rows, from SectorFacets.rows, restricts scoring to a subset of the corpus units)
+def retrieve(name, question, mode="tfidf", top_n=15, aggregation="max", retrievers=None, rows=None):
+    # Requests pass the retrievers they started with, so an index swap mid-request cannot mix versions
+    retrievers = retrievers or get_retrievers()
+    if mode in ("dense", "hybrid") and get_dense_retrievers(retrievers, build=False)[name] is None:
+        # No vector store for this corpus version: answer with TF-IDF rather than embed the corpus mid-request
+        logger.warning("No vector store for '%s', retrieving with tfidf instead of %s.", name, mode)
+        mode = "tfidf"
+    if mode == "tfidf":
+        return retrievers[name].search(question, top_n=top_n, rows=rows)
+    if mode == "dense":
+        return get_dense_retrievers(retrievers, build=False)[name].search(question, top_n=top_n, rows=rows)
+    if mode == "multi":
+        return retrievers[name].search_many(split_reformulations(question), top_n=top_n, aggregation=aggregation, rows=rows)
+    if mode in ("bm25", "hybrid"):
+        bm25_index = get_bm25_indexes(retrievers)[name]
+        if bm25_index is None:
+            return "", np.array([], dtype=int), np.array([])
+        if mode == "bm25":
+            return bm25_index.search(question, top_n=top_n, rows=rows)
+        # Hybrid: fuse the BM25 and dense rankings of a wider candidate pool
+        pool = max(top_n * 4, 50)
+        _, bm25_top, _ = bm25_index.search(question, top_n=pool, rows=rows)
+        _, dense_top, _ = get_dense_retrievers(retrievers, build=False)[name].search(question, top_n=pool, rows=rows)
+        with span("fuse", corpus=name):
+            top_indices, similarities = reciprocal_rank_fusion([bm25_top, dense_top], top_n=top_n)
+        chunks = retrievers[name].chunks
+        return "\n\n".join([chunks[i] for i in top_indices]), top_indices, similarities
+    raise ValueError(f"Unknown retrieval_mode '{mode}'.")
+
+
 
 # Create a new prompt template for question augmentation
 augmentation_template = """
@@ -182,23 +3085,37 @@ Offrez des conseils sur comment explorer les différentes carrières médicales
 
 
 """
-augmentation_prompt = ChatPromptTemplate.from_template(augmentation_template)
+augmentation_prompt = LazyObject(lambda: langchain_prompts.ChatPromptTemplate.from_template(augmentation_template))
 
 # Define a class to chain the prompt creation, model invocation, and parsing for augmentation
+AUGMENTATION_MODE = os.getenv('RAG_AUGMENTATION_MODE', 'llm')
+
 class AugmentationChain:
-    def __init__(self, prompt, model):
+    def __init__(self, prompt, model, cache=None, expander=None):
         self.prompt = prompt
         self.model = model
+        self.cache = cache
+        # Callable returning the QueryExpander used by the "fast" mode, so its tables load lazily
+        self.expander = expander
 
     def invoke(self, input_data):
         required_keys = ["question"]
         for key in required_keys:
             if key not in input_data:
                 raise KeyError(f"Missing required key '{key}' in input_data.")
-        
-        formatted_prompt = self.prompt.format(**input_data)
-        model_response = self.model.invoke(formatted_prompt)
-        print(f"Augmentation Response: {model_response}")
+
+        mode = input_data.get("mode") or AUGMENTATION_MODE
+        if mode == "fast":
+            # Local expansion from the mined corpus tables: no LLM call
+            with span("augmentation", mode="fast"):
+                return self.expander().expand(input_data["question"])
+        if mode != "llm":
+            raise ValueError(f"Unknown augmentation_mode '{mode}'.")
+
+        with span("augmentation") as attributes:
+            formatted_prompt = self.prompt.format(**input_data)
+            model_response = cached_model_invoke(self.model, formatted_prompt, self.cache, attributes)
+        log_model_response("Augmentation", model_response)
         if hasattr(model_response, 'content'):
             return model_response.content
         else:
@@ -206,7 +3123,7 @@ class AugmentationChain:
 
 
 # Initialize the augmentation chain
-augmentation_chain = AugmentationChain(augmentation_prompt, model)
+augmentation_chain = AugmentationChain(augmentation_prompt, short_call_model, llm_cache, get_query_expander)
 
 
 # Create a new prompt template that uses two contexts
@@ -379,14 +3296,23 @@ L'output doit être parfaitement en corrélation avec la {question}. LE PLUS IMP
 REPOND EN FRANCAIS.
 
 """
-combined_prompt = ChatPromptTemplate.from_template(combined_template)
+combined_prompt = LazyObject(lambda: langchain_prompts.ChatPromptTemplate.from_template(combined_template))
+
+# Same prompt with a closing instruction that overrides the French-only directives, so an answer
+# in another language is generated in one call instead of being translated afterwards
+combined_language_template = combined_template + """
+IMPORTANT : ignorez les consignes de langue ci-dessus et rédigez toute la réponse en {language}.
+ANSWER ENTIRELY IN {language}.
+"""
+combined_language_prompt = LazyObject(lambda: langchain_prompts.ChatPromptTemplate.from_template(combined_language_template))
 
 # Define a class to chain the prompt creation, model invocation, and parsing
 class PromptToModelChain:
-    def __init__(self, prompt, model, parser):
+    def __init__(self, prompt, model, parser, cache=None):
         self.prompt = prompt
         self.model = model
         self.parser = parser
+        self.cache = cache
 
     def invoke(self, input_data):
         required_keys = ["context1", "context2", "question"]
@@ -394,17 +3320,29 @@ class PromptToModelChain:
             if key not in input_data:
                 raise KeyError(f"Missing required key '{key}' in input_data.")
         
-        formatted_prompt = self.prompt.format(**input_data)
-        model_response = self.model.invoke(formatted_prompt)
-        print(f"Model Response: {model_response}")
+        with span("generation") as attributes:
+            formatted_prompt = self.prompt.format(**input_data)
+            model_response = cached_model_invoke(self.model, formatted_prompt, self.cache, attributes)
+        log_model_response("Generation", model_response)
         if hasattr(model_response, 'content'):
             parsed_response = self.parser.invoke(model_response.content)
         else:
             parsed_response = "No content attribute in model response"
         return parsed_response
 
+    def stream(self, input_data):
+        required_keys = ["context1", "context2", "question"]
+        for key in required_keys:
+            if key not in input_data:
+                raise KeyError(f"Missing required key '{key}' in input_data.")
+
+        with span("generation", streamed=True) as attributes:
+            formatted_prompt = self.prompt.format(**input_data)
+            yield from cached_model_stream(self.model, formatted_prompt, self.cache, attributes)
+
 # Initialize the chain with the prompt, model, and parser
-initial_chain = PromptToModelChain(combined_prompt, model, StrOutputParser())
+initial_chain = PromptToModelChain(combined_prompt, model, parser, llm_cache)
+direct_language_chain = PromptToModelChain(combined_language_prompt, model, parser, llm_cache)
 
 # Create a translation prompt template
 translation_template = """
@@ -412,14 +3350,15 @@ Translate the following text to {language}:
 
 Text: {answer}
 """
-translation_prompt = ChatPromptTemplate.from_template(translation_template)
+translation_prompt = LazyObject(lambda: langchain_prompts.ChatPromptTemplate.from_template(translation_template))
 
 
 
 class TranslationChain:
-    def __init__(self, prompt, model):
+    def __init__(self, prompt, model, cache=None):
         self.prompt = prompt
         self.model = model
+        self.cache = cache
 
     def invoke(self, input_data):
         required_keys = ["answer", "language"]
@@ -427,39 +3366,563 @@ class TranslationChain:
             if key not in input_data:
                 raise KeyError(f"Missing required key '{key}' in input_data.")
         
-        formatted_prompt = self.prompt.format(**input_data)
-        model_response = self.model.invoke(formatted_prompt)
-        print(f"Model Response: {model_response}")
+        with span("translation") as attributes:
+            formatted_prompt = self.prompt.format(**input_data)
+            model_response = cached_model_invoke(self.model, formatted_prompt, self.cache, attributes)
+        log_model_response("Translation", model_response)
         if hasattr(model_response, 'content'):
             return model_response.content
         else:
             return "No content attribute in model response"
 
+    def stream(self, input_data):
+        required_keys = ["answer", "language"]
+        for key in required_keys:
+            if key not in input_data:
+                raise KeyError(f"Missing required key '{key}' in input_data.")
+
+        with span("translation", streamed=True) as attributes:
+            formatted_prompt = self.prompt.format(**input_data)
+            yield from cached_model_stream(self.model, formatted_prompt, self.cache, attributes)
+
 # Initialize the translation chain
-translation_chain = TranslationChain(translation_prompt, model)
+translation_chain = TranslationChain(translation_prompt, short_call_model, llm_cache)
+
+TRANSLATION_MODE = os.getenv('RAG_TRANSLATION_MODE', 'llm')
+TRANSLATION_MIN_COVERAGE = float(os.getenv('RAG_TRANSLATION_MIN_COVERAGE', 0.6))
+
+# Translates retrieval queries into English with the bilingual lexicon, and only calls the
+# LLM translation chain when the lexicon covers too few of the query's content words
+class QueryTranslator:
+    def __init__(self, lexicon, fallback_chain, min_coverage=TRANSLATION_MIN_COVERAGE):
+        # Callable returning the BilingualLexicon, so it is mined lazily
+        self.lexicon = lexicon
+        self.fallback_chain = fallback_chain
+        self.min_coverage = min_coverage
+        self.path_counts = {"local": 0, "llm": 0, "fallback": 0}
+        self.lock = threading.Lock()
+
+    def _record(self, path):
+        with self.lock:
+            self.path_counts[path] += 1
+
+    def invoke(self, input_data):
+        required_keys = ["answer", "language"]
+        for key in required_keys:
+            if key not in input_data:
+                raise KeyError(f"Missing required key '{key}' in input_data.")
+
+        mode = input_data.get("mode") or TRANSLATION_MODE
+        if mode not in ("local", "llm"):
+            raise ValueError(f"Unknown translation_mode '{mode}'.")
+        if mode == "local" and input_data["language"] == "English":
+            with span("translation", mode="local") as attributes:
+                translated, coverage = self.lexicon().translate(input_data["answer"])
+                attributes["coverage"] = round(coverage, 3)
+            if coverage >= self.min_coverage:
+                self._record("local")
+                return translated
+            self._record("fallback")
+        else:
+            self._record("llm")
+        return self.fallback_chain.invoke({"answer": input_data["answer"], "language": input_data["language"]})
+
+    def stats(self):
+        with self.lock:
+            return dict(self.path_counts)
+
+# Initialize the query translator used on the retrieval path
+query_translator = QueryTranslator(get_bilingual_lexicon, translation_chain)
+
+# Frequent function words per language, used to detect the language of a text without a model call.
+# Words common to several languages (e.g. "de", "en") are listed under each of them.
+LANGUAGE_STOPWORDS = {
+    "French": {"le", "la", "les", "de", "des", "du", "et", "en", "à", "au", "aux", "est", "une", "un", "pour",
+               "dans", "que", "qui", "il", "ne", "vous", "sur", "avec", "pas", "sont", "ces", "votre", "leur",
+               "être", "cette"},
+    "English": {"the", "and", "is", "are", "of", "to", "in", "for", "with", "that", "this", "you",
+                "on", "as", "be", "by", "your", "their", "it", "or", "can", "these", "from", "an"},
+    "Dutch": {"de", "het", "een", "en", "van", "is", "dat", "die", "voor", "met", "zijn", "niet",
+              "op", "te", "ook", "als", "bij", "worden", "je", "uw", "naar", "deze", "wordt", "om"},
+    "German": {"der", "die", "das", "und", "ist", "nicht", "mit", "sich", "auf", "für", "ein", "eine",
+               "zu", "von", "den", "dem", "sie", "werden", "auch", "oder", "bei", "wird", "im", "ihre"},
+    "Spanish": {"el", "la", "los", "las", "de", "en", "y", "es", "un", "una", "por", "con", "para", "como",
+                "del", "se", "su", "sus", "al", "lo", "más", "pero", "esta", "son", "este", "muy", "también", "hay"},
+}
+
+# Latin letters with the accents used by the languages above (a range like à-ÿ would also match ÷)
+LANGUAGE_WORD_PATTERN = re.compile(r"[a-zàáâäæçèéêëìíîïñòóôöœùúûüÿß]+")
+
+# Function to detect the language of a text from the share of its words that are stopwords of each
+# language; returns None when unsure (too few hits, too small a share of the text, or a tie)
+def detect_language(text, min_hits=5, min_share=0.05):
+    words = LANGUAGE_WORD_PATTERN.findall((text or "").lower())
+    if not words:
+        return None
+    hits = sorted(((sum(1 for word in words if word in stopwords), language)
+                   for language, stopwords in LANGUAGE_STOPWORDS.items()), reverse=True)
+    (best_hits, language), (runner_up_hits, _) = hits[0], hits[1]
+    if best_hits < min_hits or best_hits / len(words) < min_share or best_hits == runner_up_hits:
+        return None
+    return language
 
 ## Modify the CombinedChain class to use the new combined prompt:
 class CombinedChain:
-    def __init__(self, initial_chain, translation_chain):
+    # Language that combined_template asks the model to answer in
+    template_language = "French"
+
+    def __init__(self, initial_chain, translation_chain, direct_language_chain=None):
         self.initial_chain = initial_chain
         self.translation_chain = translation_chain
+        self.direct_language_chain = direct_language_chain
+        self.path_counts = {"native": 0, "direct_language": 0, "translated": 0, "streamed": 0}
+        self.lock = threading.Lock()
+
+    def _record(self, path):
+        with self.lock:
+            self.path_counts[path] += 1
+
+    def _generate(self, input_data, language):
+        if language.lower() == self.template_language.lower() or self.direct_language_chain is None:
+            return self.initial_chain.invoke(input_data), "native"
+        return self.direct_language_chain.invoke({**input_data, "language": language}), "direct_language"
 
     def invoke(self, input_data):
         required_keys = ["context1", "context2", "question"]
         for key in required_keys:
             if key not in input_data:
                 raise KeyError(f"Missing required key '{key}' in input_data.")
-        
-        answer = self.initial_chain.invoke(input_data)
+
+        language = input_data.get("language", self.template_language)
+        answer, path = self._generate(input_data, language)
+        # The detector can only confirm the languages it has stopwords for; an answer generated directly in
+        # another language is kept as it is rather than "corrected" from a wrong guess
+        known_language = language.lower() in {name.lower() for name in LANGUAGE_STOPWORDS}
+        detected_language = detect_language(answer) if known_language else None
+        if detected_language is None or detected_language.lower() == language.lower():
+            # The answer is already in the requested language, so the translation pass is skipped
+            self._record(path)
+            return answer
+
+        # The model ignored the language instruction; fall back to a translation pass
+        self._record("translated")
         translation_input = {
             "answer": answer,
-            "language": input_data.get("language", "French")
+            "language": language
         }
         translated_answer = self.translation_chain.invoke(translation_input)
         return translated_answer
 
+    def stream(self, input_data):
+        required_keys = ["context1", "context2", "question"]
+        for key in required_keys:
+            if key not in input_data:
+                raise KeyError(f"Missing required key '{key}' in input_data.")
+
+        # Streamed tokens cannot be taken back, so the answer is generated directly in the
+        # requested language and is not checked afterwards
+        self._record("streamed")
+        language = input_data.get("language", self.template_language)
+        if language.lower() == self.template_language.lower() or self.direct_language_chain is None:
+            yield from self.initial_chain.stream(input_data)
+        else:
+            yield from self.direct_language_chain.stream({**input_data, "language": language})
+
+    def stats(self):
+        with self.lock:
+            return dict(self.path_counts)
+
 # Initialize the combined chain with the new combined prompt
-combined_chain = CombinedChain(initial_chain, translation_chain)
+combined_chain = CombinedChain(initial_chain, translation_chain, direct_language_chain)
+
+# Function to swap the chat model behind the LLM gateway of every chain (e.g. for a local stand-in in benchmarks)
+def use_chat_model(chat_model):
+    for gateway in (model, short_call_model):
+        gateway.client = chat_model
+
+
+# Raised when one stage of a pipeline fails; the original exception is kept as __cause__
+class PipelineError(Exception):
+    def __init__(self, stage, error):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+# Runs named stages as a dependency graph on a thread pool, so independent stages overlap. Stages that
+# wait on the model run on their own pool, sized like the LLM limiter, so local stages never queue behind them.
+class PipelineExecutor:
+    def __init__(self, max_workers=4, llm_workers=LLM_MAX_CONCURRENCY):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+        self.llm_pool = ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix="pipeline-llm")
+
+    def run(self, stages, llm_stages=()):
+        """Run {name: (function, [dependencies])}; each function gets its dependencies' results as keyword arguments.
+        Stages named in llm_stages run on the LLM pool."""
+        for name, (_, dependencies) in stages.items():
+            for dependency in dependencies:
+                if dependency not in stages:
+                    raise ValueError(f"Stage '{name}' depends on unknown stage '{dependency}'.")
+        results, timings, running = {}, {}, {}
+        pending = dict(stages)
+        started_at = time.perf_counter()
+
+        def timed(name, function, kwargs):
+            stage_start = time.perf_counter()
+            try:
+                return function(**kwargs)
+            finally:
+                stage_end = time.perf_counter()
+                timings[name] = {
+                    "start_ms": round((stage_start - started_at) * 1000, 2),
+                    "duration_ms": round((stage_end - stage_start) * 1000, 2),
+                }
+
+        while pending or running:
+            for name in [name for name, (_, deps) in pending.items() if all(dep in results for dep in deps)]:
+                function, dependencies = pending.pop(name)
+                kwargs = {dependency: results[dependency] for dependency in dependencies}
+                pool = self.llm_pool if name in llm_stages else self.pool
+                running[pool.submit(timed, name, function, kwargs)] = name
+            if not running:
+                raise ValueError(f"Stages {sorted(pending)} have circular dependencies.")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    for other in running:
+                        other.cancel()
+                    raise PipelineError(name, e) from e
+
+        wall_ms = round((time.perf_counter() - started_at) * 1000, 2)
+        sequential_ms = round(sum(timing["duration_ms"] for timing in timings.values()), 2)
+        timings["total"] = {"wall_ms": wall_ms, "sequential_ms": sequential_ms,
+                            "overlap_saved_ms": round(max(sequential_ms - wall_ms, 0.0), 2)}
+        return results, timings
+
+# Initialize the pipeline executor shared by the endpoints
+pipeline_executor = PipelineExecutor(max_workers=int(os.getenv('RAG_PIPELINE_WORKERS', 4)))
+
+# Server-side store of retrieval results, so /answer_question only needs a short handle.
+# Entries are kept in least-recently-used order, capped in number and dropped after an idle timeout.
+class RetrievalSessionStore:
+    def __init__(self, max_sessions=1000, idle_ttl=1800, path=None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        # With a path, sessions live in SQLite so any worker process can answer for them
+        self.connection = None
+        if path:
+            path = os.path.expanduser(path)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False, timeout=10)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, value TEXT, accessed_at REAL)")
+            self.connection.commit()
+
+    def _evict(self, now):
+        while self.sessions:
+            session_id, (_, last_access) = next(iter(self.sessions.items()))
+            if now - last_access <= self.idle_ttl and len(self.sessions) <= self.max_sessions:
+                break
+            del self.sessions[session_id]
+
+    def _evict_stored(self, now):
+        self.connection.execute("DELETE FROM sessions WHERE accessed_at < ?", (now - self.idle_ttl,))
+        self.connection.execute(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,))
+
+    def put(self, session):
+        now = time.time()
+        session_id = secrets.token_urlsafe(12)
+        with self.lock:
+            if self.connection is not None:
+                self.connection.execute("INSERT INTO sessions (id, value, accessed_at) VALUES (?, ?, ?)",
+                                        (session_id, json.dumps(session, ensure_ascii=False), now))
+                self._evict_stored(now)
+                self.connection.commit()
+                return session_id
+            self.sessions[session_id] = (session, now)
+            self._evict(now)
+        return session_id
+
+    def get(self, session_id):
+        now = time.time()
+        with self.lock:
+            if self.connection is not None:
+                row = self.connection.execute("SELECT value, accessed_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+                if row is None or now - row[1] > self.idle_ttl:
+                    return None
+                self.connection.execute("UPDATE sessions SET accessed_at = ? WHERE id = ?", (now, session_id))
+                self.connection.commit()
+                return json.loads(row[0])
+            self._evict(now)
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return None
+            self.sessions[session_id] = (entry[0], now)
+            self.sessions.move_to_end(session_id)
+            return entry[0]
+
+    def __len__(self):
+        if self.connection is not None:
+            with self.lock:
+                return self.connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return len(self.sessions)
+
+# Initialize the retrieval session store
+retrieval_sessions = RetrievalSessionStore(
+    max_sessions=int(os.getenv('RAG_SESSION_MAX', 1000)),
+    idle_ttl=float(os.getenv('RAG_SESSION_IDLE_TTL', 1800)),
+    path=os.getenv('RAG_SESSION_PATH')
+)
+
+# Function to rebuild the generation input of a retrieval session from the chunk IDs it stored; the session is returned too
+def session_answer_input(session_id, language="French"):
+    session = retrieval_sessions.get(session_id)
+    if session is None:
+        raise KeyError(f"Unknown or expired session_id '{session_id}'.")
+    retrievers = get_retrievers()
+    input_data = {
+        "context1": retrievers["fiches_metiers"].context_for(session["fiches_metiers_ids"]),
+        "context2": retrievers["jobs_json"].context_for(session["jobs_json_ids"]),
+        "question": session["augmented_question"],
+        "language": language
+    }
+    return input_data, session
+
+# Settings for the semantic answer cache: a question at least RAG_SEMANTIC_CACHE_THRESHOLD similar to an
+# earlier one reuses its retrieval and answers. RAG_SEMANTIC_CACHE_VECTORS is "tfidf" (the fiches-metiers
+# vectorizer) or "embeddings" (the RAG_EMBEDDER embedder).
+SEMANTIC_CACHE_ENABLED = os.getenv('RAG_SEMANTIC_CACHE', '1') != '0'
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('RAG_SEMANTIC_CACHE_THRESHOLD', 0.9))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('RAG_SEMANTIC_CACHE_MAX_ENTRIES', 1000))
+SEMANTIC_CACHE_TTL = float(os.getenv('RAG_SEMANTIC_CACHE_TTL', 24 * 3600))
+SEMANTIC_CACHE_VECTORS = os.getenv('RAG_SEMANTIC_CACHE_VECTORS', 'tfidf')
+
+# Cache of final answers keyed on a normalized question vector. A question whose vector is at least
+# `threshold` cosine-similar to a cached one reuses its retrieval (augmented question, selected units,
+# top chunks) and its answers, one per language. Entries expire after `ttl` seconds, the least recently
+# used are evicted beyond `max_entries`, and all are dropped when the served corpus index changes.
+# Each entry belongs to the partition of the retrieval settings it was built with, and only matches
+# lookups from the same partition.
+class SemanticAnswerCache:
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+                 ttl=SEMANTIC_CACHE_TTL, vectors=SEMANTIC_CACHE_VECTORS):
+        if vectors not in ('tfidf', 'embeddings'):
+            raise ValueError(f"Unknown semantic cache vectors '{vectors}'.")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.vectors = vectors
+        self.embedder = None
+        self.entries = OrderedDict()
+        # Out-of-vocabulary words get cache-local columns past the vocabulary, so they still tell questions apart
+        self.extra_columns = {}
+        self.width = 0
+        self.matrix = None
+        self.matrix_ids = []
+        self.matrix_partitions = []
+        self.index_key = None
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "answer_hits": 0, "answer_misses": 0, "inserts": 0,
+                       "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @staticmethod
+    def index_key_of(retrievers):
+        return tuple((name, retriever.fingerprint, retriever.built_at) for name, retriever in sorted(retrievers.items()))
+
+    # Weighted features of a question: the content words and their inflection variants (stopwords dropped)
+    # weighted by the idf of the fiches-metiers vectorizer, as (column, weight) pairs for vocabulary terms
+    # and (term, weight) pairs for the others. With embeddings, the columns are the embedding dimensions.
+    def features(self, question, retrievers):
+        if self.vectors == 'embeddings':
+            if self.embedder is None:
+                self.embedder = create_embedder()
+            return list(enumerate(self.embedder.embed_query(question).tolist())), []
+        expander = get_query_expander()
+        words = list(dict.fromkeys(expander.analyzer(question or "")))
+        terms = list(dict.fromkeys(words + [form for word in words
+                                            for form in expander.variants.get(expander.stem(word) or "", [])]))
+        if not terms:
+            return [], []
+        vectorizer = retrievers["fiches_metiers"].vectorizer
+        idf = np.asarray(vectorizer.idf_)
+        rows = vectorizer.transform(terms).tocsr()
+        known, unknown = [], []
+        for position, term in enumerate(terms):
+            term_columns = rows.indices[rows.indptr[position]:rows.indptr[position + 1]]
+            if len(term_columns):
+                known.extend(zip(term_columns.tolist(), idf[term_columns].tolist()))
+            else:
+                unknown.append((term, float(idf.max())))
+        return known, unknown
+
+    # L2-normalized (columns, weights) of question features. Unknown terms get a column when `assign` is set;
+    # otherwise those without one only count towards the norm. Called with the lock held.
+    def _vector(self, features, vocabulary_size, assign):
+        known, unknown = features
+        columns = [column for column, _ in known]
+        weights = [weight for _, weight in known]
+        for position, (term, weight) in enumerate(unknown):
+            column = self.extra_columns.get(term)
+            if column is None and assign:
+                column = self.extra_columns[term] = vocabulary_size + len(self.extra_columns)
+            columns.append(-1 - position if column is None else column)
+            weights.append(weight)
+        if not columns:
+            return None
+        columns, inverse = np.unique(np.asarray(columns, dtype=np.int64), return_inverse=True)
+        weights = np.bincount(inverse, weights=weights)
+        norm = np.linalg.norm(weights)
+        if not norm:
+            return None
+        keep = columns >= 0
+        return columns[keep], weights[keep] / norm
+
+    @staticmethod
+    def _vocabulary_size(retrievers):
+        return len(retrievers["fiches_metiers"].vectorizer.idf_) if retrievers["fiches_metiers"].vectorizer is not None else 0
+
+    # Drops every entry when the index changed, and the expired ones; called with the lock held
+    def _refresh(self, retrievers, now):
+        index_key = self.index_key_of(retrievers)
+        if index_key != self.index_key:
+            if self.entries:
+                self.counts["invalidations"] += 1
+                SEMANTIC_CACHE_REQUESTS.labels("index", "invalidated").inc()
+                logger.info("Semantic answer cache cleared: the corpus index changed")
+            self.entries.clear()
+            self.extra_columns.clear()
+            self.width = 0
+            self.matrix = None
+            self.index_key = index_key
+        expired = [entry_id for entry_id, entry in self.entries.items() if now - entry["created_at"] > self.ttl]
+        for entry_id in expired:
+            del self.entries[entry_id]
+        if expired:
+            self.counts["expirations"] += len(expired)
+            self.matrix = None
+        SEMANTIC_CACHE_ENTRIES.set(len(self.entries))
+
+    # Returns (entry_id, entry, similarity) of the most similar cached question of the partition,
+    # with entry None on a miss
+    def lookup(self, question, retrievers, partition=None):
+        features = self.features(question, retrievers)
+        with self.lock:
+            self._refresh(retrievers, time.time())
+            entry_id, entry, similarity = None, None, 0.0
+            vector = self._vector(features, self._vocabulary_size(retrievers), assign=False)
+            if vector is not None and self.entries:
+                if self.matrix is None:
+                    self.matrix_ids = list(self.entries)
+                    self.matrix_partitions = np.array([self.entries[key]["partition"] for key in self.matrix_ids], dtype=object)
+                    vectors = [self.entries[key]["vector"] for key in self.matrix_ids]
+                    indptr = np.cumsum([0] + [len(columns) for columns, _ in vectors])
+                    self.matrix = sparse.csr_matrix((np.concatenate([weights for _, weights in vectors]),
+                                                     np.concatenate([columns for columns, _ in vectors]), indptr),
+                                                    shape=(len(vectors), self.width))
+                query = np.zeros(self.width)
+                columns, weights = vector
+                inside = columns < self.width
+                query[columns[inside]] = weights[inside]
+                similarities = self.matrix @ query
+                # Entries built with other retrieval settings never match
+                similarities[self.matrix_partitions != partition] = -np.inf
+                best = int(np.argmax(similarities))
+                similarity = float(similarities[best])
+                if similarity >= self.threshold:
+                    entry_id = self.matrix_ids[best]
+                    entry = self.entries[entry_id]
+                    self.entries.move_to_end(entry_id)
+            self.counts["hits" if entry is not None else "misses"] += 1
+            SEMANTIC_CACHE_REQUESTS.labels("retrieval", "hit" if entry is not None else "miss").inc()
+        return entry_id, entry, similarity
+
+    # Stores the retrieval of a question (a retrieval session payload plus the chunk details shown to the
+    # user) in a partition and returns the new entry's ID, or None for a question without content words
+    def put(self, question, retrievers, retrieval, details=None, context_packing=None, partition=None):
+        features = self.features(question, retrievers)
+        entry_id = secrets.token_hex(8)
+        with self.lock:
+            now = time.time()
+            self._refresh(retrievers, now)
+            vector = self._vector(features, self._vocabulary_size(retrievers), assign=True)
+            if vector is None:
+                return None
+            self.width = max(self.width, int(vector[0].max()) + 1 if len(vector[0]) else 0)
+            self.entries[entry_id] = {"question": question, "vector": vector, "retrieval": retrieval,
+                                      "details": details, "context_packing": context_packing, "answers": {},
+                                      "partition": partition, "created_at": now}
+            self.matrix = None
+            self.counts["inserts"] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counts["evictions"] += 1
+            SEMANTIC_CACHE_ENTRIES.set(len(self.entries))
+        return entry_id
+
+    def answer(self, entry_id, language):
+        with self.lock:
+            entry = self.entries.get(entry_id)
+            answer = entry["answers"].get(language) if entry is not None else None
+            self.counts["answer_hits" if answer is not None else "answer_misses"] += 1
+        SEMANTIC_CACHE_REQUESTS.labels("answer", "hit" if answer is not None else "miss").inc()
+        return answer
+
+    # Records the answer of an entry in a language; returns False when the entry is gone
+    def set_answer(self, entry_id, language, answer):
+        with self.lock:
+            entry = self.entries.get(entry_id)
+            if entry is None:
+                return False
+            entry["answers"][language] = answer
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.matrix = None
+            SEMANTIC_CACHE_ENTRIES.set(0)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats["entries"] = len(self.entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        answers = stats["answer_hits"] + stats["answer_misses"]
+        stats["answer_hit_rate"] = stats["answer_hits"] / answers if answers else 0.0
+        stats["threshold"] = self.threshold
+        return stats
+
+semantic_answer_cache = SemanticAnswerCache() if SEMANTIC_CACHE_ENABLED else None
+
+# Function to get the semantic cache partition of a retrieval's settings, as a string so that it can be
+# kept in a retrieval session. Default modes are resolved, and the aggregation only counts for "multi"
+def semantic_cache_partition(retrieval_mode="tfidf", aggregation="max", augmentation_mode=None,
+                             translation_mode=None, infer_sectors=False):
+    return json.dumps({"retrieval_mode": retrieval_mode,
+                       "aggregation": aggregation if retrieval_mode == "multi" else None,
+                       "augmentation_mode": augmentation_mode or AUGMENTATION_MODE,
+                       "translation_mode": translation_mode or TRANSLATION_MODE,
+                       "infer_sectors": bool(infer_sectors)}, sort_keys=True)
+
+# Function to remember a generated answer of a retrieval session, creating its semantic cache entry if needed.
+# Sessions without a partition (explicit sector filters, cache turned off) are not cached
+def remember_session_answer(session, language, answer):
+    if semantic_answer_cache is None or session.get("semantic_cache_partition") is None:
+        return
+    if not semantic_answer_cache.set_answer(session.get("semantic_cache_id"), language, answer):
+        retrieval = {key: value for key, value in session.items()
+                     if key not in ("semantic_cache_id", "semantic_cache_partition")}
+        entry_id = semantic_answer_cache.put(session["question"], get_retrievers(), retrieval,
+                                             partition=session["semantic_cache_partition"])
+        if entry_id is not None:
+            semantic_answer_cache.set_answer(entry_id, language, answer)
 
 
 
@@ -571,6 +4034,7 @@ def index():
                 let concatenatedChunksFichesMetiers = "";
                 let concatenatedChunksJobsJson = "";
                 let chunkDetails = [];
+                let sessionId = null;
 
                 document.getElementById('chat-form').addEventListener('submit', function(event) {
                     event.preventDefault();
@@ -592,14 +4056,15 @@ def index():
                         context2Div.innerHTML = "";
                         if (data.details_fiches_metiers.length > 0 && data.details_jobs_json.length > 0) {
                             data.details_fiches_metiers.forEach((detail, index) => {
-                                chunksDiv.innerHTML += `Chunk ${detail.index + 1} similarity: ${detail.similarity.toFixed(4)}<br>${detail.preview}<br><br>`;
+                                chunksDiv.innerHTML += `Chunk ${detail.index + 1} (${detail.id}) similarity: ${detail.similarity.toFixed(4)}<br>${detail.preview}<br><br>`;
                             });
                             data.details_jobs_json.forEach((detail, index) => {
-                                chunksDiv.innerHTML += `Chunk ${detail.index + 1} similarity: ${detail.similarity.toFixed(4)}<br>${detail.preview}<br><br>`;
+                                chunksDiv.innerHTML += `Chunk ${detail.index + 1} (${detail.id}) similarity: ${detail.similarity.toFixed(4)}<br>${detail.preview}<br><br>`;
                             });
                             concatenatedChunksFichesMetiers = data.chunks_fiches_metiers;
                             concatenatedChunksJobsJson = data.chunks_jobs_json;
                             chunkDetails = data.details_fiches_metiers.concat(data.details_jobs_json);
+                            sessionId = data.session_id;
                             context1Div.textContent = concatenatedChunksFichesMetiers;
                             context2Div.textContent = concatenatedChunksJobsJson;
                             document.getElementById('augmented_question').textContent = data.augmented_question;
@@ -614,21 +4079,61 @@ def index():
 
                 document.getElementById('answer-button').addEventListener('click', function() {
                     const question = document.getElementById('question').value;
-                    fetch('/answer_question', {
+                    const responseDiv = document.getElementById('response');
+                    let answerSpan = null;
+                    responseDiv.innerHTML = "";
+
+                    // Render one server-sent event from /answer_question_stream
+                    function handleEvent(frame) {
+                        let eventName = 'message';
+                        let eventData = '';
+                        frame.split('\\n').forEach(line => {
+                            if (line.startsWith('event: ')) {
+                                eventName = line.slice(7);
+                            } else if (line.startsWith('data: ')) {
+                                eventData += line.slice(6);
+                            }
+                        });
+                        const payload = eventData ? JSON.parse(eventData) : null;
+                        if (eventName === 'top_chunks') {
+                            responseDiv.innerHTML = `<strong>Top 5 Chunks:</strong><br>`;
+                            payload.forEach((chunk, index) => {
+                                responseDiv.innerHTML += `Chunk ${chunk.index + 1} similarity: ${chunk.similarity.toFixed(4)}<br>`;
+                            });
+                            responseDiv.innerHTML += `<br><strong>Answer:</strong><br><span id="answer-text"></span>`;
+                            answerSpan = document.getElementById('answer-text');
+                        } else if ((eventName === 'token' || eventName === 'error') && answerSpan) {
+                            answerSpan.textContent += payload;
+                        }
+                    }
+
+                    fetch('/answer_question_stream', {
                         method: 'POST',
                         headers: {
                             'Content-Type': 'application/json',
                         },
-                        body: JSON.stringify({ question: question, context1: concatenatedChunksFichesMetiers, context2: concatenatedChunksJobsJson, chunks: chunkDetails }),
+                        // The retrieval results stay on the server; only their session handle is sent back
+                        body: JSON.stringify(sessionId ? { session_id: sessionId } : { question: question, context1: concatenatedChunksFichesMetiers, context2: concatenatedChunksJobsJson, chunks: chunkDetails }),
                     })
-                    .then(response => response.json())
-                    .then(data => {
-                        const responseDiv = document.getElementById('response');
-                        responseDiv.innerHTML = `<strong>Top 5 Chunks:</strong><br>`;
-                        data.top_chunks.forEach((chunk, index) => {
-                            responseDiv.innerHTML += `Chunk ${chunk.index + 1} similarity: ${chunk.similarity.toFixed(4)}<br>`;
-                        });
-                        responseDiv.innerHTML += `<br><strong>Answer:</strong><br>${data.answer}`;
+                    .then(response => {
+                        const reader = response.body.getReader();
+                        const decoder = new TextDecoder();
+                        let buffer = '';
+                        function read() {
+                            return reader.read().then(({ done, value }) => {
+                                if (done) {
+                                    return;
+                                }
+                                buffer += decoder.decode(value, { stream: true });
+                                let boundary;
+                                while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                                    handleEvent(buffer.slice(0, boundary));
+                                    buffer = buffer.slice(boundary + 2);
+                                }
+                                return read();
+                            });
+                        }
+                        return read();
                     })
                     .catch(error => console.error('Error:', error));
                 });
@@ -640,58 +4145,188 @@ def index():
         
     ''')
 
+# Function to describe retrieved chunks for the client: position, unit id, similarity, preview and packing
+def describe_chunks(retriever, top_indices, similarities, selected_ids):
+    selected_ids = set(selected_ids)
+    return [{"index": int(idx), "id": retriever.chunk_ids[idx], "similarity": float(similarities[idx]),
+             "preview": retriever.chunks[idx][:100], "selected": retriever.chunk_ids[idx] in selected_ids}
+            for idx in top_indices]
+
+# Function to describe the sector filter a fiches-metiers retrieval ran under
+def describe_sector_filter(retrievers, sector_ids, source):
+    if not sector_ids:
+        return {"applied": [], "source": "fallback" if source == "inferred" else "none",
+                "candidates": len(retrievers["fiches_metiers"])}
+    facets = get_sector_facets(retrievers)
+    return {"applied": [facets.sectors[sector_id] for sector_id in sector_ids], "source": source,
+            "candidates": int(len(facets.rows(sector_ids)))}
+
+# Function to answer /generate_chunks from a semantic cache entry: a new session reuses the entry's retrieval
+def semantic_cache_response(question, entry_id, entry, similarity, retrievers):
+    retrieval = entry["retrieval"]
+    details = entry["details"] or {}
+    session_id = retrieval_sessions.put({**retrieval, "question": question, "semantic_cache_id": entry_id,
+                                         "semantic_cache_partition": entry["partition"]})
+    return {
+        "session_id": session_id,
+        "chunks_fiches_metiers": retrievers["fiches_metiers"].context_for(retrieval["fiches_metiers_ids"]),
+        "details_fiches_metiers": details.get("fiches_metiers", []),
+        "chunks_jobs_json": retrievers["jobs_json"].context_for(retrieval["jobs_json_ids"]),
+        "details_jobs_json": details.get("jobs_json", []),
+        "augmented_question": retrieval["augmented_question"],
+        "translated_question": retrieval["translated_question"],
+        "context_packing": entry["context_packing"],
+        "semantic_cache": {"similarity": round(similarity, 4), "question": entry["question"],
+                           "languages": sorted(entry["answers"])},
+        "timings": {}
+    }
+
+# Function to pick the sector filter of a fiches-metiers retrieval: the sectors the request names, or
+# the ones inferred from the question; returns the sector ids (none means the whole corpus) and their source
+def select_sectors(question, sectors, infer, retrievers):
+    facets = get_sector_facets(retrievers)
+    if facets is None:
+        return [], "none"
+    if sectors:
+        return facets.resolve([sectors] if isinstance(sectors, str) else sectors), "explicit"
+    if infer:
+        sector_ids = facets.infer(question)
+        return sector_ids, "inferred" if sector_ids else "none"
+    return [], "none"
+
+# Function to search fiches-metiers within the selected sectors only. An inferred filter under which
+# nothing matches falls back to the whole corpus; returns the retrieval and the sector ids applied
+def retrieve_in_sectors(question, sector_ids, source, mode, aggregation, retrievers):
+    if sector_ids:
+        rows = get_sector_facets(retrievers).rows(sector_ids)
+        result = retrieve("fiches_metiers", question, mode, aggregation=aggregation, retrievers=retrievers, rows=rows)
+        _, top_indices, similarities = result
+        if source == "explicit" or any(similarities[i] > 0 for i in top_indices):
+            SECTOR_FILTERS.labels(source).inc()
+            return result, sector_ids
+        source = "fallback"
+    SECTOR_FILTERS.labels(source).inc()
+    return retrieve("fiches_metiers", question, mode, aggregation=aggregation, retrievers=retrievers), []
+
 ## Modify the /generate_chunks endpoint:
 @app.route('/generate_chunks', methods=['POST'])
 def generate_chunks():
     data = request.get_json()
     question = data.get('question')
+    retrieval_mode = data.get('retrieval_mode', 'tfidf')
+    aggregation = data.get('multi_query_aggregation', 'max')
+    augmentation_mode = data.get('augmentation_mode')
+    translation_mode = data.get('translation_mode')
+    # fiches-metiers is searched within these sectors (French or English names), or within the sectors named
+    # in the question; an explicit filter bypasses the semantic cache
+    sectors = data.get('sectors')
+    infer_sectors = data.get('infer_sectors', SECTOR_INFERENCE)
 
-    # Augment the question
-    try:
-        augmented_question = augmentation_chain.invoke({"question": question})
-    except Exception as e:
-        return jsonify({"error": str(e)})
+    # A near-duplicate of an earlier question asked with the same retrieval settings reuses its retrieval
+    # without any model call
+    use_semantic_cache = semantic_answer_cache is not None and data.get('semantic_cache', True) and not sectors
+    partition = (semantic_cache_partition(retrieval_mode, aggregation, augmentation_mode, translation_mode, infer_sectors)
+                 if use_semantic_cache else None)
+    if use_semantic_cache:
+        retrievers = get_retrievers()
+        entry_id, entry, similarity = semantic_answer_cache.lookup(question, retrievers, partition)
+        if entry is not None:
+            return jsonify(semantic_cache_response(question, entry_id, entry, similarity, retrievers))
 
-    # Translate the augmented question to English
+    # Stages run as a dependency graph: corpus loading overlaps the LLM calls, and the
+    # fiches-metiers retrieval only waits for the augmented question, not the translation
+    stages = {
+        "augmentation": (lambda: augmentation_chain.invoke({"question": question, "mode": augmentation_mode}), []),
+        "translation": (lambda augmentation: query_translator.invoke({
+            "answer": augmentation,
+            "language": "English",
+            "mode": translation_mode
+        }), ["augmentation"]),
+        "load_corpora": (get_retrievers, []),
+        "select_sectors": (lambda load_corpora: select_sectors(question, sectors, infer_sectors, load_corpora), ["load_corpora"]),
+        "retrieve_fiches_metiers": (lambda augmentation, load_corpora, select_sectors: retrieve_in_sectors(augmentation, *select_sectors, retrieval_mode, aggregation, load_corpora), ["augmentation", "load_corpora", "select_sectors"]),
+        "retrieve_jobs_json": (lambda translation, load_corpora: retrieve("jobs_json", translation, retrieval_mode, aggregation=aggregation, retrievers=load_corpora), ["translation", "load_corpora"]),
+        "pack_fiches_metiers": (lambda retrieve_fiches_metiers, load_corpora: context_packer.pack(load_corpora["fiches_metiers"], *retrieve_fiches_metiers[0][1:]), ["retrieve_fiches_metiers", "load_corpora"]),
+        "pack_jobs_json": (lambda retrieve_jobs_json, load_corpora: context_packer.pack(load_corpora["jobs_json"], *retrieve_jobs_json[1:]), ["retrieve_jobs_json", "load_corpora"]),
+    }
     try:
-        translated_question = translation_chain.invoke({
-            "answer": augmented_question,
-            "language": "English"
-        })
-    except Exception as e:
-        return jsonify({"error": str(e)})
+        results, timings = pipeline_executor.run(stages, llm_stages=("augmentation", "translation"))
+    except PipelineError as e:
+        return jsonify({"error": str(e.error)})
 
-    # Load chunks from the fiches-metiers.json file
-    fiches_metiers_path = os.path.expanduser('~/coding/fiches-metiers.json')
-    chunks_fiches_metiers = load_chunks_from_json(fiches_metiers_path)
-
-    # Load chunks from the jobs.json file
-    jobs_json_path = os.path.expanduser('~/coding/jobs.json')
-    chunks_jobs_json = load_chunks_from_jobs_json(jobs_json_path)
+    augmented_question = results["augmentation"]
+    translated_question = results["translation"]
+    retriever_fiches_metiers = results["load_corpora"]["fiches_metiers"]
+    retriever_jobs_json = results["load_corpora"]["jobs_json"]
+    chunks_fiches_metiers = retriever_fiches_metiers.chunks
+    chunks_jobs_json = retriever_jobs_json.chunks
 
     if not chunks_fiches_metiers or not chunks_jobs_json:
         return jsonify({"chunks": "", "details": []})
 
-    # Find relevant chunks for both contexts
-    concatenated_chunks_fiches_metiers, top_indices_fiches_metiers, similarities_fiches_metiers = find_relevant_chunks(augmented_question, chunks_fiches_metiers, top_n=15)
-    concatenated_chunks_jobs_json, top_indices_jobs_json, similarities_jobs_json = find_relevant_chunks(translated_question, chunks_jobs_json, top_n=15)
+    (_, top_indices_fiches_metiers, similarities_fiches_metiers), sector_ids = results["retrieve_fiches_metiers"]
+    _, top_indices_jobs_json, similarities_jobs_json = results["retrieve_jobs_json"]
+    # The contexts are the budgeted, deduplicated packs rather than the raw top-15 concatenation
+    concatenated_chunks_fiches_metiers, selected_ids_fiches_metiers, packing_fiches_metiers = results["pack_fiches_metiers"]
+    concatenated_chunks_jobs_json, selected_ids_jobs_json, packing_jobs_json = results["pack_jobs_json"]
+
+    details_fiches_metiers = describe_chunks(retriever_fiches_metiers, top_indices_fiches_metiers, similarities_fiches_metiers, selected_ids_fiches_metiers)
+    details_jobs_json = describe_chunks(retriever_jobs_json, top_indices_jobs_json, similarities_jobs_json, selected_ids_jobs_json)
 
-    details_fiches_metiers = [{"index": int(idx), "similarity": float(similarities_fiches_metiers[idx]), "preview": chunks_fiches_metiers[idx][:100]} for idx in top_indices_fiches_metiers]
-    details_jobs_json = [{"index": int(idx), "similarity": float(similarities_jobs_json[idx]), "preview": chunks_jobs_json[idx][:100]} for idx in top_indices_jobs_json]
+    # Keep what /answer_question needs on the server and hand back a short handle to it
+    top_chunks = sorted(details_fiches_metiers + details_jobs_json, key=lambda x: x['similarity'], reverse=True)[:15]
+    session = {
+        "question": question,
+        "augmented_question": augmented_question,
+        "translated_question": translated_question,
+        "fiches_metiers_ids": selected_ids_fiches_metiers,
+        "jobs_json_ids": selected_ids_jobs_json,
+        "top_chunks": top_chunks
+    }
+    context_packing = {"fiches_metiers": packing_fiches_metiers, "jobs_json": packing_jobs_json}
+    semantic_cache_id = None
+    if use_semantic_cache:
+        semantic_cache_id = semantic_answer_cache.put(question, results["load_corpora"], session, {
+            "fiches_metiers": details_fiches_metiers, "jobs_json": details_jobs_json}, context_packing, partition)
+    session_id = retrieval_sessions.put({**session, "semantic_cache_id": semantic_cache_id,
+                                         "semantic_cache_partition": partition})
 
     return jsonify({
+        "session_id": session_id,
         "chunks_fiches_metiers": concatenated_chunks_fiches_metiers,
         "details_fiches_metiers": details_fiches_metiers,
         "chunks_jobs_json": concatenated_chunks_jobs_json,
         "details_jobs_json": details_jobs_json,
         "augmented_question": augmented_question,
-        "translated_question": translated_question
+        "translated_question": translated_question,
+        "context_packing": context_packing,
+        "sectors": describe_sector_filter(results["load_corpora"], sector_ids, results["select_sectors"][1]),
+        "timings": timings
     })
 
 
 @app.route('/answer_question', methods=['POST'])
 def answer_question():
     data = request.get_json()
+
+    # With a session handle the contexts and augmented question come from /generate_chunks
+    if data.get('session_id'):
+        language = data.get('language', 'French')
+        try:
+            input_data, session = session_answer_input(data['session_id'], language)
+        except KeyError as e:
+            return jsonify({"error": e.args[0]})
+        answer = None
+        if semantic_answer_cache is not None and session.get("semantic_cache_id"):
+            answer = semantic_answer_cache.answer(session["semantic_cache_id"], language)
+        if answer is None:
+            try:
+                answer = combined_chain.invoke(input_data)
+                remember_session_answer(session, language, answer)
+            except Exception as e:
+                answer = str(e)
+        return jsonify({"answer": answer, "top_chunks": session["top_chunks"]})
+
     question = data.get('question')
     context1 = data.get('context1')
     context2 = data.get('context2')
@@ -699,7 +4334,7 @@ def answer_question():
 
     # Augment the question
     try:
-        augmented_question = augmentation_chain.invoke({"question": question})
+        augmented_question = augmentation_chain.invoke({"question": question, "mode": data.get('augmentation_mode')})
     except Exception as e:
         return jsonify({"error": str(e)})
 
@@ -732,5 +4367,312 @@ def answer_question():
     return jsonify({"answer": answer, "top_chunks": top_chunks})
 
 
+# Function to format one server-sent event
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/answer_question_stream', methods=['POST'])
+def answer_question_stream():
+    data = request.get_json()
+    question = data.get('question')
+    context1 = data.get('context1')
+    context2 = data.get('context2')
+    chunk_details = data.get('chunks') or []
+    language = data.get('language', 'French')
+
+    # Find the top 15 chunks for answering the question
+    chunk_details.sort(key=lambda x: x['similarity'], reverse=True)
+    top_chunks = chunk_details[:15]
+
+    def generate_from_session():
+        try:
+            input_data, session = session_answer_input(data['session_id'], language)
+        except KeyError as e:
+            yield sse_event("error", e.args[0])
+            yield sse_event("done", {})
+            return
+        yield sse_event("top_chunks", session["top_chunks"])
+        cached_answer = None
+        if semantic_answer_cache is not None and session.get("semantic_cache_id"):
+            cached_answer = semantic_answer_cache.answer(session["semantic_cache_id"], language)
+        if cached_answer is not None:
+            yield sse_event("token", cached_answer)
+            yield sse_event("done", {})
+            return
+        try:
+            tokens = []
+            for token in combined_chain.stream(input_data):
+                tokens.append(token)
+                yield sse_event("token", token)
+            remember_session_answer(session, language, "".join(tokens))
+        except Exception as e:
+            yield sse_event("error", str(e))
+        yield sse_event("done", {})
+
+    if data.get('session_id'):
+        return Response(stream_with_context(generate_from_session()), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    def generate():
+        # The chunk metadata is already known, so it goes out before any model call
+        yield sse_event("top_chunks", top_chunks)
+        try:
+            augmented_question = augmentation_chain.invoke({"question": question, "mode": data.get('augmentation_mode')})
+            input_data = {
+                "context1": context1,
+                "context2": context2,
+                "question": augmented_question,
+                "language": language
+            }
+            for token in combined_chain.stream(input_data):
+                yield sse_event("token", token)
+        except Exception as e:
+            yield sse_event("error", str(e))
+        yield sse_event("done", {})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# LLM calls of /batch_answer share one bounded pool, so concurrent batches cannot exceed the limit together
+BATCH_LLM_CONCURRENCY = int(os.getenv('RAG_BATCH_LLM_CONCURRENCY', 8))
+BATCH_MAX_QUESTIONS = int(os.getenv('RAG_BATCH_MAX_QUESTIONS', 200))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY, thread_name_prefix="batch-llm")
+
+# Function to prepare one batch question for retrieval: augmentation, then the English translation
+def prepare_batch_question(question, augmentation_mode=None, translation_mode=None):
+    augmented_question = augmentation_chain.invoke({"question": question, "mode": augmentation_mode})
+    translated_question = query_translator.invoke({"answer": augmented_question, "language": "English", "mode": translation_mode})
+    return augmented_question, translated_question
+
+# Function to retrieve and pack the contexts of every prepared question, one batched scoring pass per corpus
+def retrieve_batch(retrievers, queries_by_corpus, retrieval_mode="tfidf"):
+    packed = {}
+    for name, queries in queries_by_corpus.items():
+        if retrieval_mode == "tfidf":
+            results = retrievers[name].search_batch(queries)
+        else:
+            results = [retrieve(name, query, retrieval_mode, retrievers=retrievers) for query in queries]
+        packed[name] = [(top_indices, similarities, context_packer.pack(retrievers[name], top_indices, similarities))
+                        for _, top_indices, similarities in results]
+    return packed
+
+@app.route('/batch_answer', methods=['POST'])
+def batch_answer():
+    data = request.get_json()
+    questions = data.get('questions') or []
+    language = data.get('language', 'French')
+    retrieval_mode = data.get('retrieval_mode', 'tfidf')
+    augmentation_mode = data.get('augmentation_mode')
+    translation_mode = data.get('translation_mode')
+    use_semantic_cache = semantic_answer_cache is not None and data.get('semantic_cache', True)
+    # Batched retrieval applies no sector filter
+    partition = semantic_cache_partition(retrieval_mode, augmentation_mode=augmentation_mode,
+                                         translation_mode=translation_mode)
+    if not isinstance(questions, list) or not all(isinstance(question, str) for question in questions):
+        return jsonify({"error": "'questions' must be a list of strings."})
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"At most {BATCH_MAX_QUESTIONS} questions per batch."})
+
+    # Identical questions (up to whitespace) are answered once and reported at all their positions
+    positions = OrderedDict()
+    for index, question in enumerate(questions):
+        positions.setdefault(" ".join(question.split()), []).append(index)
+    unique_questions = [question for question in positions if question]
+
+    def generate():
+        started_at = time.perf_counter()
+        futures = []
+        if "" in positions:
+            yield json.dumps({"indexes": positions[""], "question": "", "error": "Empty question."}) + "\n"
+        # Near-duplicates of questions answered earlier in this language are answered from the semantic cache
+        cached = set()
+        if use_semantic_cache:
+            retrievers = get_retrievers()
+            for question in unique_questions:
+                entry_id, entry, similarity = semantic_answer_cache.lookup(question, retrievers, partition)
+                cached_answer = semantic_answer_cache.answer(entry_id, language) if entry is not None else None
+                if cached_answer is not None:
+                    cached.add(question)
+                    yield json.dumps({"indexes": positions[question], "question": question,
+                                      "top_chunks": entry["retrieval"]["top_chunks"], "answer": cached_answer,
+                                      "semantic_cache": round(similarity, 4)}, ensure_ascii=False) + "\n"
+        try:
+            # Augmentation and translation run under the shared LLM concurrency limit
+            prepared_futures = {batch_executor.submit(prepare_batch_question, question, augmentation_mode, translation_mode): question
+                                for question in unique_questions if question not in cached}
+            futures.extend(prepared_futures)
+            prepared = {}
+            for future in as_completed(prepared_futures):
+                question = prepared_futures[future]
+                try:
+                    prepared[question] = future.result()
+                except Exception as e:
+                    yield json.dumps({"indexes": positions[question], "question": question, "error": str(e)}, ensure_ascii=False) + "\n"
+            ready = [question for question in unique_questions if question in prepared]
+            prepared_at = time.perf_counter()
+
+            retrievers = get_retrievers()
+            try:
+                packed = retrieve_batch(retrievers, {
+                    "fiches_metiers": [prepared[question][0] for question in ready],
+                    "jobs_json": [prepared[question][1] for question in ready],
+                }, retrieval_mode)
+            except Exception as e:
+                yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+                return
+            retrieved_at = time.perf_counter()
+
+            def answer(position):
+                question = ready[position]
+                contexts = {}
+                selected = {}
+                details = {}
+                context_packing = {}
+                for name in ("fiches_metiers", "jobs_json"):
+                    top_indices, similarities, (context, selected[name], context_packing[name]) = packed[name][position]
+                    contexts[name] = context
+                    details[name] = describe_chunks(retrievers[name], top_indices, similarities, selected[name])
+                top_chunks = sorted(details["fiches_metiers"] + details["jobs_json"], key=lambda x: x['similarity'], reverse=True)[:15]
+                result = {"indexes": positions[question], "question": question, "top_chunks": top_chunks}
+                try:
+                    result["answer"] = combined_chain.invoke({
+                        "context1": contexts["fiches_metiers"],
+                        "context2": contexts["jobs_json"],
+                        "question": prepared[question][0],
+                        "language": language
+                    })
+                except Exception as e:
+                    result["error"] = str(e)
+                    return result
+                if use_semantic_cache:
+                    entry_id = semantic_answer_cache.put(question, retrievers, {
+                        "question": question,
+                        "augmented_question": prepared[question][0],
+                        "translated_question": prepared[question][1],
+                        "fiches_metiers_ids": selected["fiches_metiers"],
+                        "jobs_json_ids": selected["jobs_json"],
+                        "top_chunks": top_chunks
+                    }, details, context_packing, partition)
+                    if entry_id is not None:
+                        semantic_answer_cache.set_answer(entry_id, language, result["answer"])
+                return result
+
+            # Answers stream back in completion order, one JSON object per line
+            answer_futures = [batch_executor.submit(answer, position) for position in range(len(ready))]
+            futures.extend(answer_futures)
+            for future in as_completed(answer_futures):
+                yield json.dumps(future.result(), ensure_ascii=False) + "\n"
+            yield json.dumps({"done": True, "questions": len(questions), "unique_questions": len(unique_questions),
+                              "semantic_cache_hits": len(cached), "timings": {
+                "prepare_ms": round((prepared_at - started_at) * 1000, 2),
+                "retrieve_ms": round((retrieved_at - prepared_at) * 1000, 2),
+                "total_ms": round((time.perf_counter() - started_at) * 1000, 2),
+            }}) + "\n"
+        finally:
+            # A client that disconnects mid-batch frees the pool for other requests
+            for future in futures:
+                future.cancel()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    semantic_answers = semantic_answer_cache.stats() if semantic_answer_cache is not None else {"enabled": False}
+    if llm_cache is None:
+        return jsonify({"enabled": False, "semantic_answers": semantic_answers})
+    return jsonify({"enabled": True, **llm_cache.stats(), "semantic_answers": semantic_answers})
+
+
+@app.route('/sectors', methods=['GET'])
+def list_sectors():
+    facets = get_sector_facets()
+    return jsonify({"sectors": facets.describe() if facets is not None else []})
+
+@app.route('/index_status', methods=['GET'])
+def index_status():
+    return jsonify(corpus_watcher.status())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Gauges read from state kept outside the registry, then every declared metric so untouched ones export as zero
+    for key, value in startup_timings.items():
+        STARTUP_SECONDS.labels(key[:-len("_ms")]).set(value / 1000)
+    INDEX_VERSION.set(corpus_watcher.version)
+    for metric in lazy_metrics:
+        metric._resolve()
+    return Response(prometheus.generate_latest(metrics_registry._resolve()), mimetype=prometheus.CONTENT_TYPE_LATEST)
+
+
+@app.route('/chain_stats', methods=['GET'])
+def chain_stats():
+    return jsonify({"combined_chain": combined_chain.stats(), "query_translator": query_translator.stats(),
+                    "llm_gateway": model.stats()})
+
+
+# Function to record the time to the first served request, and log the startup report then
+@app.after_request
+def record_first_request(response):
+    if "first_request_ms" not in startup_timings:
+        mark_startup("first_request")
+        logger.info("Startup report: %s", json.dumps(startup_report()))
+    return response
+
+# Function to build the startup report: time to each phase and lazily imported modules in first-use order
+def startup_report():
+    return {**startup_timings, "lazy_imports": dict(lazy_import_timings)}
+
+@app.route('/startup_stats', methods=['GET'])
+def startup_stats():
+    return jsonify(startup_report())
+
+
+# Function to create the app for a WSGI server (see wsgi.py). The corpora are loaded before the first
+# request; with shared_index they are mapped from the shared on-disk index, so a worker boots without
+# vectorizing anything and its memory does not grow with the corpus. With dense, the vector stores are
+# loaded (or built) too.
+def create_app(shared_index=None, dense=DENSE_AT_STARTUP):
+    global SHARED_INDEX
+    if shared_index is not None:
+        SHARED_INDEX = shared_index
+    get_retrievers()
+    if dense:
+        get_dense_retrievers()
+    mark_startup("ready")
+    return app
+
+
+mark_startup("module_loaded")
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    logging.basicConfig(level=os.getenv('RAG_LOG_LEVEL', 'INFO'))
+    cli = argparse.ArgumentParser(description="Career guidance chatbot")
+    cli.add_argument('command', nargs='?', choices=['serve', 'build-index'], default='serve')
+    cli.add_argument('--dense', action='store_true', help="also embed both corpora for dense retrieval")
+    cli.add_argument('--shared', action='store_true', help="also write the memory-mapped index used by wsgi.py workers")
+    args = cli.parse_args()
+
+    # Refresh the Drive-hosted corpora, then build or reload the retrieval index before serving the first request
+    sync_corpora_from_drive()
+    get_retrievers()
+    if args.shared:
+        for name, (file_path, load_chunks) in {"fiches_metiers": (FICHES_METIERS_PATH, load_chunks_from_json),
+                                               "jobs_json": (JOBS_JSON_PATH, load_chunks_from_jobs_json)}.items():
+            load_shared_retriever(name, file_path, load_chunks)
+    get_bm25_indexes()
+    get_sector_facets()
+    get_query_expander()
+    get_bilingual_lexicon()
+    if args.dense or DENSE_AT_STARTUP:
+        get_dense_retrievers()
+    mark_startup("ready")
+    if args.command == 'build-index':
+        logger.info("Startup report: %s", json.dumps(startup_report()))
+    if args.command == 'serve':
+        # With debug=True the app is served by the reloader's child process, which sets WERKZEUG_RUN_MAIN
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            corpus_watcher.start()
+        app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,292 @@
+"""Offline benchmarks for the retrieval and answer pipeline of app-v3-git.py.
+
+The OpenAI model is replaced by benchmarks.fakes.FakeChatModel and the corpora by synthetic
+ones, so the suite runs without network access:
+
+    python benchmarks/bench.py --sizes 100 1000 10000 --runs 20 --llm-latency 0.05
+
+--compare-augmentation also times the LLM augmentation against the local "fast" expansion
+and reports how much of the LLM-augmented top 15 the other variants retrieve. The fake
+model's reformulations are random words, so run it with --openai for meaningful overlaps.
+
+--llm-stub serves the fake model over a local OpenAI-compatible HTTP server, so the model calls
+go through the real ChatOpenAI client and the app's LLM gateway (pool, deadlines, retries, limiter).
+
+--startup also times cold worker processes: module import, index load, first request served
+and the cost of each dependency imported on first use.
+"""
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeChatModel, StubOpenAIServer
+from benchmarks.synthetic_corpus import write_corpora
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app-v3-git.py')
+
+SAMPLE_QUESTIONS = [
+    "J'aime la médecine et travailler de manière minutieuse, des conseils de métiers ?",
+    "Quels métiers dans l'hôtellerie pour quelqu'un qui aime le service client ?",
+    "Je veux travailler dans le logiciel et l'analyse de données",
+    "Métiers de la logistique avec des responsabilités d'équipe",
+    "Quel salaire pour un technicien de maintenance ?",
+]
+
+# Function to import app-v3-git.py (its file name is not a valid module name) with the given settings
+def load_app(fiches_metiers_path, jobs_json_path, index_dir, use_cache=False):
+    os.environ['FICHES_METIERS_PATH'] = fiches_metiers_path
+    os.environ['JOBS_JSON_PATH'] = jobs_json_path
+    os.environ['RAG_INDEX_DIR'] = index_dir
+    os.environ['RAG_LLM_CACHE'] = '1' if use_cache else '0'
+    os.environ['RAG_SEMANTIC_CACHE'] = '1' if use_cache else '0'
+    spec = importlib.util.spec_from_file_location('rag_jobs_app', APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Cold worker started in a fresh interpreter: import the app, load the persisted index and serve one request.
+# argv: app path, question, and "fake" to answer model calls with FakeChatModel (otherwise the configured model)
+STARTUP_PROBE = """
+import importlib.util, json, os, sys
+spec = importlib.util.spec_from_file_location('rag_jobs_app', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+if sys.argv[3] == 'fake':
+    # Same stand-in as the parent benchmark, for the model calls the first request still makes
+    sys.path.insert(0, os.path.dirname(sys.argv[1]))
+    from benchmarks.fakes import FakeChatModel
+    module.use_chat_model(FakeChatModel())
+client = module.create_app().test_client()
+response = client.post('/generate_chunks', json={"question": sys.argv[2], "augmentation_mode": "fast", "translation_mode": "local"}).get_json()
+# An error response returns before retrieval and scoring, so it would not time a real first request
+assert "error" not in response, f"First request failed: {response['error']}"
+print(json.dumps(module.startup_report()))
+"""
+
+# Function to start one cold worker and return its startup report
+def run_startup_probe(fake_model):
+    probe = subprocess.run([sys.executable, '-c', STARTUP_PROBE, APP_PATH, SAMPLE_QUESTIONS[2], 'fake' if fake_model else 'configured'],
+                           capture_output=True, text=True)
+    if probe.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{probe.stderr}")
+    return json.loads(probe.stdout.splitlines()[-1])
+
+# Function to measure the startup of cold worker processes; the index is built beforehand so only its load is timed
+def measure_startup(size, runs, fake_model=True):
+    reports = [run_startup_probe(fake_model) for _ in range(runs)]
+    results = []
+    for phase in ("imports", "module_loaded", "ready", "first_request"):
+        results.append({**summarise(f"startup_{phase}", size, [report[f"{phase}_ms"] / 1000 for report in reports], 0),
+                        "peak_memory_mb": None})
+    lazy_imports = {}
+    for report in reports:
+        for name, timing in report["lazy_imports"].items():
+            lazy_imports.setdefault(name, []).append(timing["import_ms"] / 1000)
+    for name, durations in lazy_imports.items():
+        results.append({**summarise(f"lazy_import {name}", size, durations, 0), "peak_memory_mb": None})
+    return results
+
+# Function to time a callable several times, then measure its peak traced memory in one more run.
+# tracemalloc slows down every allocation, so it is off while the runs are timed. reset, when given,
+# restores the state the first timed run started from (e.g. drops what it cached) before the traced run
+def measure(function, runs, reset=None):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    if reset is not None:
+        reset()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return durations, peak
+
+# Function to summarise durations as p50/p95 latency and throughput
+def summarise(stage, size, durations, peak):
+    ordered = sorted(durations)
+    p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+    return {
+        "stage": stage,
+        "occupations": size,
+        "runs": len(durations),
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[p95_index] * 1000, 3),
+        "throughput_per_s": round(len(durations) / sum(durations), 2) if sum(durations) else None,
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+    }
+
+# Function to compare LLM augmentation with the local expansion on latency and fiches-metiers top-15 overlap
+def compare_augmentation(app_module, retriever, size, runs):
+    # Mining the expansion tables is an index-build cost, so it is timed apart from the requests
+    def forget_expander():
+        app_module._query_expander = None
+        if os.path.exists(app_module.QUERY_EXPANSION_PATH):
+            os.remove(app_module.QUERY_EXPANSION_PATH)
+    forget_expander()
+    results = [summarise("mine_expansions", size, *measure(app_module.get_query_expander, 1, forget_expander))]
+    augmented = {}
+    for mode in ("llm", "fast"):
+        questions = iter(SAMPLE_QUESTIONS * runs)
+        augmented[mode] = []
+        def augment():
+            augmented[mode].append(app_module.augmentation_chain.invoke({"question": next(questions), "mode": mode}))
+        results.append(summarise(f"augmentation_{mode}", size, *measure(augment, runs)))
+    augmented["none"] = (SAMPLE_QUESTIONS * runs)[:runs]
+
+    top_ids = {mode: [set(retriever.search(text, top_n=15)[1].tolist()) for text in texts]
+               for mode, texts in augmented.items()}
+    results.append({"stage": "augmentation_none", "occupations": size})
+    for row, mode in zip(results[1:], ("llm", "fast", "none")):
+        # Recall of the LLM-augmented top 15: the share of those chunks this variant also retrieves
+        recalls = [len(reference & found) / len(reference) if reference else 1.0
+                   for reference, found in zip(top_ids["llm"], top_ids[mode])]
+        row["overlap_vs_llm"] = round(statistics.mean(recalls), 3)
+    return results
+
+# Function to benchmark every stage for one corpus size
+def run_size(size, runs, chat_model, workdir, augmentation=False, startup=False):
+    fiches_metiers_path = os.path.join(workdir, f'fiches-metiers-{size}.json')
+    jobs_json_path = os.path.join(workdir, f'jobs-{size}.json')
+    write_corpora(fiches_metiers_path, jobs_json_path, size)
+    app_module = load_app(fiches_metiers_path, jobs_json_path, os.path.join(workdir, f'index-{size}'))
+    if chat_model is not None:
+        app_module.use_chat_model(chat_model)
+    results = []
+
+    units = {}
+    def parse():
+        units["fiches_metiers"] = app_module.load_chunks_from_json(fiches_metiers_path)
+        units["jobs_json"] = app_module.load_chunks_from_jobs_json(jobs_json_path)
+    # The first load parses the files and writes the corpus snapshots; later loads only map them
+    def drop_snapshots():
+        shutil.rmtree(app_module.SNAPSHOT_DIR, ignore_errors=True)
+    results.append(summarise("load", size, *measure(parse, 1, drop_snapshots)))
+    results.append(summarise("load_snapshot", size, *measure(parse, runs)))
+
+    # scikit-learn is imported on first use; import it here so the vectorize stage does not time the import
+    app_module.timed_import('sklearn.feature_extraction.text')
+    retrievers = {}
+    def vectorize():
+        for name, corpus_units in units.items():
+            retrievers[name] = app_module.TfidfRetriever.build(name, corpus_units)
+    results.append(summarise("vectorize", size, *measure(vectorize, 1)))
+
+    # The same corpora streamed from the source files into hashed on-disk indexes, as under RAG_STREAMING_INDEX=1
+    streamed = itertools.count()
+    def stream_index():
+        run = next(streamed)
+        for name, (file_path, stream_chunks) in {"fiches_metiers": (fiches_metiers_path, app_module.stream_chunks_from_json),
+                                                 "jobs_json": (jobs_json_path, app_module.stream_chunks_from_jobs_json)}.items():
+            app_module.build_streaming_index(name, stream_chunks(file_path), os.path.join(workdir, f'streamed-{size}', f'{name}-{run}'))
+    results.append(summarise("stream_index", size, *measure(stream_index, 1)))
+
+    queries = iter(SAMPLE_QUESTIONS * runs)
+    def score():
+        question = next(queries)
+        for retriever in retrievers.values():
+            retriever.search(question, top_n=15)
+    results.append(summarise("score", size, *measure(score, runs)))
+
+    # The same questions with fiches-metiers scored within one sector, as under a /generate_chunks sector filter
+    facets = app_module.SectorFacets.build(retrievers["fiches_metiers"], app_module.load_occupation_records(fiches_metiers_path))
+    sector_rows = facets.rows([0]) if facets.sectors else None
+    def score_sector():
+        question = next(queries)
+        retrievers["fiches_metiers"].search(question, top_n=15, rows=sector_rows)
+        retrievers["jobs_json"].search(question, top_n=15)
+    queries = iter(SAMPLE_QUESTIONS * runs)
+    results.append(summarise("score_sector", size, *measure(score_sector, runs)))
+    if augmentation:
+        results.extend(compare_augmentation(app_module, retrievers["fiches_metiers"], size, runs))
+
+    # Warm the persisted index so the endpoint stages measure requests, not the first build
+    app_module.get_retrievers()
+    client = app_module.app.test_client()
+    sessions = []
+    questions = iter(SAMPLE_QUESTIONS * runs)
+    def generate_chunks():
+        response = client.post('/generate_chunks', json={"question": next(questions)}).get_json()
+        sessions.append(response.get("session_id"))
+    results.append(summarise("generate_chunks", size, *measure(generate_chunks, runs)))
+
+    session_ids = iter(sessions)
+    def answer_question():
+        client.post('/answer_question', json={"session_id": next(session_ids)}).get_json()
+    results.append(summarise("answer_question", size, *measure(answer_question, runs)))
+
+    # One /batch_answer call over every sample question, duplicates included
+    def batch_answer():
+        client.post('/batch_answer', json={"questions": SAMPLE_QUESTIONS * 2}).get_data()
+    results.append(summarise("batch_answer", size, *measure(batch_answer, runs)))
+    if startup:
+        results.extend(measure_startup(size, runs, fake_model=chat_model is not None))
+    return results
+
+# Function to print results as an aligned table
+def print_table(results):
+    columns = ["stage", "occupations", "runs", "p50_ms", "p95_ms", "throughput_per_s", "peak_memory_mb"]
+    if any("overlap_vs_llm" in row for row in results):
+        columns.append("overlap_vs_llm")
+    widths = {column: max(len(column), *(len(str(row.get(column, ""))) for row in results)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in results:
+        print("  ".join(str(row.get(column, "")).ljust(widths[column]) for column in columns))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help="numbers of synthetic occupations per corpus (up to 100000)")
+    parser.add_argument('--runs', type=int, default=10, help="timed runs per request-level stage")
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="fake model latency per call, in seconds")
+    parser.add_argument('--llm-token-latency', type=float, default=0.0, help="fake model latency per output token, in seconds")
+    parser.add_argument('--llm-tokens', type=int, default=200, help="output tokens per fake model call")
+    parser.add_argument('--compare-augmentation', action='store_true',
+                        help="also compare LLM augmentation with the local fast expansion")
+    parser.add_argument('--openai', action='store_true',
+                        help="use the app's OpenAI model instead of the fake one (needs OPENAI_API_KEY)")
+    parser.add_argument('--llm-stub', action='store_true',
+                        help="serve the fake model over a local OpenAI-compatible HTTP server, so the calls go through "
+                             "the real client and the LLM gateway")
+    parser.add_argument('--startup', action='store_true',
+                        help="also time cold worker startups: imports, index load, first request, lazy imports")
+    parser.add_argument('--json', dest='json_path', help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    chat_model = None if args.openai else FakeChatModel(latency=args.llm_latency, token_latency=args.llm_token_latency,
+                                                        completion_tokens=args.llm_tokens)
+    stub_server = None
+    if args.llm_stub:
+        stub_server = StubOpenAIServer(latency=args.llm_latency, model=chat_model).start()
+        os.environ['RAG_LLM_BASE_URL'] = stub_server.base_url
+        chat_model = None
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for size in args.sizes:
+                results.extend(run_size(size, args.runs, chat_model, workdir, args.compare_augmentation, args.startup))
+    finally:
+        if stub_server is not None:
+            stub_server.stop()
+    print_table(results)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    return results
+
+if __name__ == '__main__':
+    main()
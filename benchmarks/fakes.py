@@ -0,0 +1,223 @@
+# Local stand-ins for the external services used by app-v3-git.py, so the app can be
+# profiled offline and in CI without an OpenAI key or network access.
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# French filler vocabulary for generated answers
+FAKE_WORDS = [
+    "métier", "compétences", "formation", "salaire", "secteur", "carrière", "santé", "hôtellerie",
+    "gestion", "équipe", "client", "précision", "médecine", "technique", "projet", "outils",
+    "responsabilités", "tendance", "évolution", "stage", "université", "conseil", "travail", "qualité",
+]
+
+# Deterministic chat model with configurable latency and output length
+class FakeChatModel:
+    def __init__(self, latency=0.0, token_latency=0.0, completion_tokens=200, words_per_line=12,
+                 model_name="fake-chat-model"):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.completion_tokens = completion_tokens
+        self.words_per_line = words_per_line
+        self.model_name = model_name
+        self.calls = 0
+
+    def _tokens(self, prompt):
+        # The output only depends on the prompt, so repeated prompts give identical answers
+        seed = int(hashlib.sha256(str(prompt).encode('utf-8')).hexdigest()[:16], 16)
+        rng = random.Random(seed)
+        tokens = []
+        for position in range(self.completion_tokens):
+            word = rng.choice(FAKE_WORDS)
+            end_of_line = (position + 1) % self.words_per_line == 0
+            tokens.append(word + ("\n" if end_of_line else " "))
+        return tokens
+
+    def _usage(self, prompt):
+        prompt_tokens = len(str(prompt)) // 4
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": self.completion_tokens,
+                "total_tokens": prompt_tokens + self.completion_tokens}
+
+    def invoke(self, prompt, **kwargs):
+        self.calls += 1
+        tokens = self._tokens(prompt)
+        time.sleep(self.latency + self.token_latency * len(tokens))
+        return AIMessage(content="".join(tokens), response_metadata={"token_usage": self._usage(prompt), "model_name": self.model_name})
+
+    def stream(self, prompt, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        for token in self._tokens(prompt):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield AIMessageChunk(content=token)
+
+# In-memory Google Drive v3 service covering what DriveSync uses: files().get() for metadata and
+# files().get_media() for ranged downloads through MediaIoBaseDownload
+class FakeDriveService:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.files_by_id = {}
+        self.metadata_requests = 0
+        self.media_requests = 0
+        self.bytes_served = 0
+
+    def put(self, file_id, content, name=None):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        self.files_by_id[file_id] = {
+            "content": content,
+            "name": name or file_id,
+            "modifiedTime": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()) + f".{time.time_ns() % 10**9:09d}Z",
+        }
+
+    def files(self):
+        return _FakeFilesResource(self)
+
+class _FakeFilesResource:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, fileId, fields=None):
+        return _FakeMetadataRequest(self.service, fileId)
+
+    def get_media(self, fileId):
+        return _FakeMediaRequest(self.service, fileId)
+
+class _FakeMetadataRequest:
+    def __init__(self, service, file_id):
+        self.service = service
+        self.file_id = file_id
+
+    def execute(self):
+        self.service.metadata_requests += 1
+        time.sleep(self.service.latency)
+        stored = self.service.files_by_id[self.file_id]
+        return {"id": self.file_id, "name": stored["name"], "modifiedTime": stored["modifiedTime"],
+                "md5Checksum": hashlib.md5(stored["content"]).hexdigest(), "size": str(len(stored["content"]))}
+
+# Response object with the parts of httplib2.Response that MediaIoBaseDownload reads
+class _FakeResponse(dict):
+    def __init__(self, status, headers):
+        super().__init__(headers)
+        self.status = status
+
+class _FakeMediaRequest:
+    def __init__(self, service, file_id):
+        self.service = service
+        self.file_id = file_id
+        self.uri = f"fake-drive://files/{file_id}?alt=media"
+        self.headers = {}
+        self.http = self
+
+    # Called by MediaIoBaseDownload.next_chunk with a "range: bytes=start-end" header
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        self.service.media_requests += 1
+        time.sleep(self.service.latency)
+        content = self.service.files_by_id[self.file_id]["content"]
+        start, end = (int(bound) for bound in headers["range"].split("=")[1].split("-"))
+        if not content:
+            return _FakeResponse(416, {"content-range": "bytes */0"}), b""
+        chunk = content[start:end + 1]
+        self.service.bytes_served += len(chunk)
+        return _FakeResponse(206, {"content-range": f"bytes {start}-{start + len(chunk) - 1}/{len(content)}"}), chunk
+
+# Local HTTP server speaking the OpenAI chat completions API (plain and streamed), so the real ChatOpenAI
+# client and the app's LLM gateway can be exercised offline. Point the app at it with RAG_LLM_BASE_URL.
+# `failures` is a list of HTTP status codes answered, in order, before normal responses resume.
+class StubOpenAIServer:
+    def __init__(self, latency=0.0, completion_tokens=50, failures=None, model=None):
+        self.model = model or FakeChatModel(completion_tokens=completion_tokens, model_name="stub-chat-model")
+        self.latency = latency
+        self.failures = list(failures or [])
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubOpenAIHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Returns the status code of the next scripted failure, or None for a normal response
+    def next_failure(self):
+        with self.lock:
+            self.requests += 1
+            return self.failures.pop(0) if self.failures else None
+
+class _StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        stub = self.server.stub
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        failure = stub.next_failure()
+        time.sleep(stub.latency)
+        if failure is not None:
+            headers = {"Retry-After": "0"} if failure == 429 else None
+            self._send_json(failure, {"error": {"message": f"stub failure {failure}", "type": "stub_error"}}, headers)
+            return
+        prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+        tokens = stub.model._tokens(prompt)
+        created = int(time.time())
+        if not request.get("stream"):
+            usage = stub.model._usage(prompt)
+            self._send_json(200, {
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": created, "model": request.get("model"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": usage})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for position, token in enumerate(tokens + [None]):
+            delta = {"content": token} if token is not None else {}
+            if position == 0:
+                delta["role"] = "assistant"
+            event = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created,
+                     "model": request.get("model"),
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": None if token is not None else "stop"}]}
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
@@ -0,0 +1,75 @@
+# Generators for synthetic corpora in the formats of fiches-metiers.json (one delimited row
+# per occupation, no header) and jobs.json (tab-separated ESCO table with a header line).
+import csv
+import random
+
+# French / English sector pairs, in the style of the real fiches-metiers.json rows
+SECTORS = [
+    ("Hôtellerie-restauration-et-tourisme", "Hotels_restaurants_tourism"),
+    ("Santé-et-social", "Health_social"),
+    ("Informatique-et-numérique", "IT_digital"),
+    ("Construction-et-immobilier", "Construction_real_estate"),
+    ("Finance-et-assurance", "Finance_insurance"),
+    ("Industrie-et-production", "Manufacturing"),
+    ("Transport-et-logistique", "Transport_logistics"),
+    ("Arts-et-culture", "Arts_culture"),
+]
+
+ROLES_FR = ["Manager", "Technicien", "Assistant", "Ingénieur", "Conseiller", "Responsable", "Analyste", "Opérateur"]
+ROLES_EN = ["Manager", "Technician", "Assistant", "Engineer", "Advisor", "Lead", "Analyst", "Operator"]
+DOMAINS_FR = ["hôtellerie", "santé", "logiciel", "chantier", "assurance", "production", "logistique", "musée",
+              "laboratoire", "réseau", "qualité", "maintenance", "marketing", "finance", "pharmacie", "énergie"]
+DOMAINS_EN = ["hospitality", "health", "software", "construction", "insurance", "production", "logistics", "museum",
+              "laboratory", "network", "quality", "maintenance", "marketing", "finance", "pharmacy", "energy"]
+SKILLS = ["Gestion de projet", "Service client", "Analyse de données", "Communication", "Précision",
+          "Travail d'équipe", "Gestion financière", "Sécurité", "Organisation", "Négociation",
+          "Diagnostic", "Planification", "Contrôle qualité", "Leadership", "Rédaction technique"]
+TOOLS = ["Excel", "SAP", "OPERA", "Python", "AutoCAD", "Salesforce", "Jira", "Tableau", "Revit", "Cloudbeds"]
+SOFT_SKILLS = ["S'organise avec méthode", "Contrôle ses émotions", "Capacité à prendre des décisions",
+               "Persévère face aux obstacles", "Consulte avant de décider", "S'ouvre aux idées des autres"]
+VERBS = ["Superviser", "Contrôler", "Élaborer", "Assurer", "Gérer", "Coordonner", "Évaluer", "Analyser"]
+OBJECTS = ["les opérations quotidiennes", "les budgets", "la qualité du service", "les équipes",
+           "les relations clients", "les contrats fournisseurs", "la sécurité", "les projets"]
+ENGLISH_WORDS = ["operate", "maintain", "coordinate", "design", "inspect", "plan", "manage", "analyse",
+                 "equipment", "systems", "teams", "safety", "quality", "clients", "processes", "standards"]
+
+# Function to build one synthetic fiches-metiers row with the 22 columns of the real file
+def fiche_row(number, rng):
+    role = rng.randrange(len(ROLES_FR))
+    domain = rng.randrange(len(DOMAINS_FR))
+    sector_fr, sector_en = SECTORS[domain % len(SECTORS)]
+    slug = f"{ROLES_FR[role]}-en-{DOMAINS_FR[domain].capitalize()}-{number}"
+    title_en = f"{DOMAINS_EN[domain].capitalize()} {ROLES_EN[role]}"
+    description = (f"Un(e) {ROLES_FR[role]} en {DOMAINS_FR[domain]} travaille dans le secteur {sector_fr}. "
+                   f"Il/elle {rng.choice(VERBS).lower()} {rng.choice(OBJECTS)} avec {rng.choice(SKILLS).lower()}.")
+    responsibilities = ", ".join(f"{rng.choice(VERBS)} {rng.choice(OBJECTS)}" for _ in range(4))
+    trends = [f"Tendance {DOMAINS_FR[domain]} {i}\n{rng.choice(VERBS)} {rng.choice(OBJECTS)} grâce aux outils {rng.choice(TOOLS)}."
+              for i in range(1, 5)]
+    return [
+        str(number), slug, title_en, sector_fr, sector_en, description, responsibilities,
+        ",".join(rng.sample(SKILLS, 4)) + ".", ",".join(rng.sample(TOOLS, 3)) + ".",
+        ",".join(rng.sample(SOFT_SKILLS, 3)), f"Gestion, {DOMAINS_FR[domain].capitalize()}",
+        f"haute-école-{DOMAINS_FR[domain]}-{number}",
+        "25.000-35.000€", "37.000-50.000€", "55.000-70.000€",
+        f"Junior {title_en},", f"{title_en},", f"Senior {title_en},",
+    ] + trends
+
+# Function to build one synthetic ESCO row (title, English description)
+def esco_row(number, rng):
+    role = rng.randrange(len(ROLES_EN))
+    domain = rng.randrange(len(DOMAINS_EN))
+    title = f"{DOMAINS_EN[domain]} {ROLES_EN[role].lower()} {number}"
+    words = " ".join(rng.choice(ENGLISH_WORDS) for _ in range(20))
+    return [title, f"{DOMAINS_EN[domain].capitalize()} {ROLES_EN[role].lower()}s {words}."]
+
+# Function to write both synthetic corpora with the given number of occupations
+def write_corpora(fiches_metiers_path, jobs_json_path, occupations, seed=0):
+    rng = random.Random(seed)
+    with open(fiches_metiers_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        for number in range(1, occupations + 1):
+            writer.writerow(fiche_row(number, rng))
+    with open(jobs_json_path, 'w', encoding='utf-8', newline='') as file:
+        file.write("ESCO UID\tdescription_en\n")
+        for number in range(1, occupations + 1):
+            file.write("\t".join(esco_row(number, rng)) + "\n")
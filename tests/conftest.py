@@ -0,0 +1,45 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app-v3-git.py is not a valid module name, so it is imported from its path, with the caches and
+# indexes kept out of the home directory
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("app")
+    os.environ['RAG_INDEX_DIR'] = str(workdir / 'index')
+    os.environ['RAG_LLM_CACHE'] = '0'
+    os.environ['RAG_SEMANTIC_CACHE'] = '0'
+    spec = importlib.util.spec_from_file_location('rag_jobs_app', os.path.join(ROOT, 'app-v3-git.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# The app serving synthetic corpora, with the fake chat model behind the LLM gateway; returns its test
+# client and the fake model
+@pytest.fixture
+def served_app(app_module, tmp_path, monkeypatch):
+    from benchmarks.fakes import FakeChatModel
+    from benchmarks.synthetic_corpus import write_corpora
+
+    fiches_metiers_path, jobs_json_path = str(tmp_path / 'fiches-metiers.json'), str(tmp_path / 'jobs.json')
+    write_corpora(fiches_metiers_path, jobs_json_path, 120)
+    occupation_records = app_module.load_occupation_records(fiches_metiers_path)
+    retrievers = {
+        "fiches_metiers": app_module.TfidfRetriever.build(
+            "fiches_metiers", app_module.occupation_units(occupation_records)),
+        "jobs_json": app_module.TfidfRetriever.build(
+            "jobs_json", app_module.occupation_units(app_module.load_esco_records(jobs_json_path))),
+    }
+    retrievers["fiches_metiers"].derived["facets"] = app_module.SectorFacets.build(retrievers["fiches_metiers"],
+                                                                                   occupation_records)
+    monkeypatch.setattr(app_module, "_retrievers", retrievers)
+    chat_model = FakeChatModel(completion_tokens=40)
+    for gateway in (app_module.model, app_module.short_call_model):
+        monkeypatch.setattr(gateway, "client", chat_model)
+    return app_module.app.test_client(), chat_model
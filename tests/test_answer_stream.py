@@ -0,0 +1,40 @@
+# /answer_question_stream: server-sent events, chunk metadata first, then the answer token by token
+import json
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+def test_stream_sends_chunks_then_tokens_then_done(served_app):
+    client, chat_model = served_app
+    chunks = [{"chunk": "b", "similarity": 0.2}, {"chunk": "a", "similarity": 0.9}]
+    response = client.post('/answer_question_stream', json={
+        "question": "Quels métiers dans la santé ?", "context1": "contexte 1", "context2": "context 2",
+        "chunks": chunks, "augmentation_mode": "llm"})
+    assert response.mimetype == 'text/event-stream'
+    events = parse_events(response.get_data(as_text=True))
+    assert events[0] == ("top_chunks", sorted(chunks, key=lambda chunk: -chunk["similarity"]))
+    assert events[-1] == ("done", {})
+    tokens = [data for event, data in events if event == "token"]
+    assert len(tokens) == chat_model.completion_tokens
+    assert "error" not in {event for event, _ in events}
+
+def test_stream_answers_a_retrieval_session(served_app):
+    client, chat_model = served_app
+    retrieval = client.post('/generate_chunks', json={"question": "Je cherche un métier en logistique",
+                                                      "augmentation_mode": "llm", "translation_mode": "llm",
+                                                      "semantic_cache": False}).get_json()
+    calls = chat_model.calls
+    events = parse_events(client.post('/answer_question_stream', json={"session_id": retrieval["session_id"]})
+                          .get_data(as_text=True))
+    assert events[0][0] == "top_chunks" and events[0][1]
+    assert [event for event, _ in events[1:]] == ["token"] * chat_model.completion_tokens + ["done"]
+    assert chat_model.calls == calls + 1
+
+def test_unknown_session_streams_an_error(served_app):
+    client, _ = served_app
+    events = parse_events(client.post('/answer_question_stream', json={"session_id": "unknown"}).get_data(as_text=True))
+    assert [event for event, _ in events] == ["error", "done"]
@@ -0,0 +1,38 @@
+# /batch_answer: deduplicated questions, one batched scoring pass per corpus, NDJSON results
+import json
+
+import numpy as np
+
+def test_batched_search_matches_one_search_per_question(served_app, app_module):
+    retriever = app_module.get_retrievers()["fiches_metiers"]
+    questions = ["technicien de maintenance", "ingénieur logiciel python", "question sans rapport xyz"]
+    for question, (_, top_indices, similarities) in zip(questions, retriever.search_batch(questions)):
+        _, expected_top, expected_similarities = retriever.search(question)
+        # The batch only ranks chunks a question matches, search() pads with zero-score chunks
+        assert list(top_indices) == [i for i in expected_top if expected_similarities[i] > 0]
+        assert np.allclose([similarities[i] for i in range(len(retriever))], expected_similarities)
+
+def test_duplicates_are_answered_once_and_reported_at_every_position(served_app):
+    client, chat_model = served_app
+    response = client.post('/batch_answer', json={
+        "questions": ["Quels métiers en santé ?", "  Quels métiers   en santé ? ", "Un métier en logistique ?", ""],
+        "augmentation_mode": "llm", "translation_mode": "llm", "semantic_cache": False})
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    summary = lines.pop()
+    assert summary["done"] and summary["questions"] == 4 and summary["unique_questions"] == 2
+    results = {line["question"]: line for line in lines}
+    assert results[""]["indexes"] == [3] and "error" in results[""]
+    assert results["Quels métiers en santé ?"]["indexes"] == [0, 1]
+    assert results["Un métier en logistique ?"]["indexes"] == [2]
+    assert all(results[question]["answer"] and results[question]["top_chunks"]
+               for question in ("Quels métiers en santé ?", "Un métier en logistique ?"))
+    # Augmentation, translation and answer for each distinct question
+    assert chat_model.calls == 3 * 2
+
+def test_invalid_batches_are_rejected(served_app, app_module, monkeypatch):
+    client, chat_model = served_app
+    assert "error" in client.post('/batch_answer', json={"questions": "une question"}).get_json()
+    monkeypatch.setattr(app_module, "BATCH_MAX_QUESTIONS", 2)
+    assert "error" in client.post('/batch_answer', json={"questions": ["a", "b", "c"]}).get_json()
+    assert chat_model.calls == 0
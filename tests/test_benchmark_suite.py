@@ -0,0 +1,38 @@
+# Offline benchmark suite: deterministic fakes and corpora, and the latency summary
+from benchmarks import bench
+from benchmarks.fakes import FakeChatModel
+from benchmarks.synthetic_corpus import write_corpora
+
+def test_fake_chat_model_is_deterministic_per_prompt():
+    model = FakeChatModel(completion_tokens=30, words_per_line=10)
+    first, again, other = model.invoke("prompt"), model.invoke("prompt"), model.invoke("other prompt")
+    assert first.content == again.content != other.content
+    assert first.content.count("\n") == 3
+    assert "".join(chunk.content for chunk in model.stream("prompt")) == first.content
+    assert first.response_metadata["token_usage"]["completion_tokens"] == 30
+    assert model.calls == 4
+
+def test_synthetic_corpora_parse_at_the_requested_size(app_module, tmp_path):
+    paths = [str(tmp_path / name) for name in ('fiches-metiers.json', 'jobs.json')]
+    write_corpora(*paths, 40)
+    records = app_module.load_occupation_records(paths[0])
+    assert len(records) == 40 and len(app_module.load_esco_records(paths[1])) == 40
+    assert all(record.sector_fr and record.responsibilities and record.tools for record in records)
+    again = [str(tmp_path / name) for name in ('fiches-metiers-2.json', 'jobs-2.json')]
+    write_corpora(*again, 40)
+    assert open(paths[0], 'rb').read() == open(again[0], 'rb').read()
+    write_corpora(*again, 40, seed=1)
+    assert open(paths[0], 'rb').read() != open(again[0], 'rb').read()
+
+def test_summary_reports_percentiles_and_throughput():
+    summary = bench.summarise("stage", 100, [0.01 * run for run in range(1, 21)], 2 * 1024 * 1024)
+    assert summary["runs"] == 20
+    assert summary["p50_ms"] == 105.0 and summary["p95_ms"] == 190.0
+    assert summary["throughput_per_s"] == round(20 / 2.1, 2)
+    assert summary["peak_memory_mb"] == 2.0
+
+def test_measure_times_every_run_and_traces_one_more():
+    calls = []
+    durations, peak = bench.measure(lambda: calls.append(bytearray(1 << 20)), 3, reset=lambda: calls.clear())
+    assert len(durations) == 3 and len(calls) == 1
+    assert peak >= 1 << 20
@@ -0,0 +1,48 @@
+# Local query translation with a lexicon mined from the FR/EN title and sector pairs of fiches-metiers
+import pytest
+
+from benchmarks.fakes import FakeChatModel
+
+def record(app_module, number, slug, title_en, sector_fr, sector_en):
+    return app_module.OccupationRecord(number=str(number), slug=slug, title_en=title_en, sector_fr=sector_fr,
+                                       sector_en=sector_en)
+
+@pytest.fixture
+def lexicon(app_module):
+    health, hospitality = ("Santé-et-social", "Health_social"), ("Hôtellerie-et-tourisme", "Hospitality_tourism")
+    records = [
+        record(app_module, 1, "Infirmier-en-Santé", "Health Nurse", *health),
+        record(app_module, 2, "Technicien-en-Santé", "Health Technician", *health),
+        record(app_module, 3, "Technicien-en-Hôtellerie", "Hospitality Technician", *hospitality),
+        record(app_module, 4, "Manager-en-Hôtellerie", "Hospitality Manager", *hospitality),
+        record(app_module, 5, "Manager-en-Tourisme", "Tourism Manager", *hospitality),
+    ]
+    return app_module.BilingualLexicon.build(records)
+
+def test_words_are_aligned_across_title_pairs(lexicon):
+    assert lexicon.words["technicien"] == ["technician"]
+    assert lexicon.words["hotellerie"][0] == "hospitality"
+    assert lexicon.words["tourisme"][0] == "tourism"
+
+def test_whole_titles_keep_their_english_form(lexicon):
+    assert lexicon.phrases["infirmier sante"] == "health nurse"
+    translated, coverage = lexicon.translate("Je veux devenir infirmier en santé")
+    assert translated == "health nurse"
+    # "veux" and "devenir" are unknown content words
+    assert coverage == pytest.approx(2 / 4)
+
+def test_english_words_and_lines_pass_through(lexicon):
+    translated, coverage = lexicon.translate("manager hospitality\ntechnicien")
+    assert translated.splitlines() == ["manager hospitality", "technician"]
+    assert coverage == 1.0
+
+def test_low_coverage_falls_back_to_the_model(app_module, lexicon):
+    model = FakeChatModel()
+    fallback = app_module.TranslationChain(app_module.translation_prompt, model)
+    translator = app_module.QueryTranslator(lambda: lexicon, fallback, min_coverage=0.6)
+    assert translator.invoke({"answer": "technicien hôtellerie", "language": "English", "mode": "local"}) \
+        == "hospitality technician"
+    assert model.calls == 0
+    translator.invoke({"answer": "je cherche un travail passionnant", "language": "English", "mode": "local"})
+    assert model.calls == 1
+    assert translator.stats() == {"local": 1, "llm": 0, "fallback": 1}
@@ -0,0 +1,67 @@
+# BM25 over an inverted index, and hybrid retrieval fusing it with the dense ranking
+import math
+
+import numpy as np
+
+UNITS = [("R1", "infirmier soins hôpital soins"), ("R2", "cuisinier restaurant"),
+         ("R3", "infirmier urgences hôpital"), ("R4", "aide soignant maison de repos soins"),
+         ("R5", "pilote avion transport")]
+
+# Okapi BM25 computed document by document, as a reference for the postings-based scores
+def reference_bm25(retriever, question, k1=1.5, b=0.75):
+    analyzer = retriever.vectorizer.build_analyzer()
+    documents = [analyzer(text) for text in retriever.chunks]
+    average_length = sum(len(document) for document in documents) / len(documents)
+    scores = np.zeros(len(documents))
+    for term in set(analyzer(question)):
+        frequency = sum(1 for document in documents if term in document)
+        if not frequency:
+            continue
+        idf = math.log1p((len(documents) - frequency + 0.5) / (frequency + 0.5))
+        for row, document in enumerate(documents):
+            tf = document.count(term)
+            scores[row] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(document) / average_length))
+    return scores
+
+def test_postings_scores_match_okapi_bm25(app_module):
+    retriever = app_module.TfidfRetriever.build("bm25", UNITS)
+    bm25_index = app_module.BM25Index.build(retriever)
+    for question in ("infirmier soins", "hôpital urgences avion", "inconnu"):
+        expected = reference_bm25(retriever, question)
+        _, top_indices, similarities = bm25_index.search(question, top_n=5)
+        assert np.allclose([similarities[row] for row in range(len(UNITS))], expected, rtol=1e-5)
+        assert sorted(top_indices.tolist()) == sorted(np.flatnonzero(expected).tolist())
+        assert all(expected[a] >= expected[c] for a, c in zip(top_indices, top_indices[1:]))
+
+def test_rows_restrict_the_postings_visited(app_module):
+    bm25_index = app_module.BM25Index.build(app_module.TfidfRetriever.build("bm25", UNITS))
+    _, top_indices, similarities = bm25_index.search("infirmier soins", top_n=5, rows=np.array([2, 3]))
+    assert sorted(top_indices.tolist()) == [2, 3]
+    assert similarities[0] == 0.0
+
+def test_saved_postings_reload_for_the_same_corpus_version(app_module, tmp_path):
+    retriever = app_module.TfidfRetriever.build("bm25", UNITS, fingerprint={"size": 1})
+    app_module.BM25Index.build(retriever).save(str(tmp_path))
+    loaded = app_module.BM25Index.load(str(tmp_path), retriever)
+    built = app_module.BM25Index.build(retriever)
+    assert loaded.search("infirmier soins")[1].tolist() == built.search("infirmier soins")[1].tolist()
+    stale = app_module.TfidfRetriever.build("bm25", UNITS, fingerprint={"size": 2})
+    assert app_module.BM25Index.load(str(tmp_path), stale) is None
+
+def test_reciprocal_rank_fusion_rewards_agreement(app_module):
+    top_indices, fused = app_module.reciprocal_rank_fusion([[0, 1, 2], [2, 1, 3]], top_n=4, k=1)
+    # Ranked second by both, chunk 1 beats chunk 0, ranked first by one ranking only
+    assert top_indices.tolist() == [2, 1, 0, 3]
+    assert np.isclose(fused[1], 1 / 3 + 1 / 3) and np.isclose(fused[0], 1 / 2)
+
+def test_hybrid_retrieval_fuses_bm25_and_dense_rankings(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "_embedder", app_module.HashingEmbedder(dimensions=64))
+    retrievers = {"hybrid": app_module.TfidfRetriever.build("hybrid", UNITS)}
+    app_module.get_dense_retrievers(retrievers)
+    _, top_indices, similarities = app_module.retrieve("hybrid", "infirmier hôpital", "hybrid", top_n=3,
+                                                       retrievers=retrievers)
+    _, bm25_top, _ = app_module.get_bm25_indexes(retrievers)["hybrid"].search("infirmier hôpital", top_n=50)
+    _, dense_top, _ = retrievers["hybrid"].derived["dense"].search("infirmier hôpital", top_n=50)
+    expected, _ = app_module.reciprocal_rank_fusion([bm25_top, dense_top], top_n=3)
+    assert top_indices.tolist() == expected.tolist()
+    assert set(top_indices[:2].tolist()) == {0, 2}
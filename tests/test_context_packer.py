@@ -0,0 +1,61 @@
+# ContextPacker: record merging, near-duplicate removal, MMR selection and the token budget
+import numpy as np
+
+def build(app_module, units):
+    return app_module.TfidfRetriever.build("packer", units)
+
+def scores(retriever, relevance):
+    similarities = np.zeros(len(retriever.chunks))
+    for chunk_id, score in relevance.items():
+        similarities[retriever.index_of(chunk_id)] = score
+    top_indices = np.argsort(-similarities)[:int((similarities > 0).sum())]
+    return top_indices, similarities
+
+def test_units_of_one_record_are_merged_without_repeated_lines(app_module):
+    retriever = build(app_module, [("R1#a", "Infirmier\nSoins aux patients"), ("R1#b", "Infirmier\nGardes de nuit"),
+                                   ("R2", "Cuisinier\nRestaurant")])
+    top_indices, similarities = scores(retriever, {"R1#a": 0.9, "R1#b": 0.5, "R2": 0.4})
+    context, selected_ids, report = app_module.ContextPacker(token_budget=1000).pack(retriever, top_indices, similarities)
+    assert report["blocks"] == 2
+    assert context.count("Infirmier") == 1
+    assert context.index("Gardes de nuit") < context.index("Cuisinier")
+    assert selected_ids == ["R1#a", "R1#b", "R2"]
+
+def test_near_duplicate_blocks_keep_the_more_relevant_one(app_module):
+    text = "Boulanger\nFabrication du pain et des viennoiseries"
+    retriever = build(app_module, [("R1", text), ("R2", text), ("R3", "Pilote de ligne\nTransport aérien")])
+    top_indices, similarities = scores(retriever, {"R1": 0.5, "R2": 0.8, "R3": 0.3})
+    _, selected_ids, report = app_module.ContextPacker(token_budget=1000).pack(retriever, top_indices, similarities)
+    assert report["duplicates_dropped"] == 1
+    assert selected_ids == ["R2", "R3"]
+
+def test_mmr_prefers_a_diverse_block_over_a_redundant_one(app_module):
+    retriever = build(app_module, [
+        ("A", "Infirmier soins patients hôpital urgences"),
+        ("B", "Infirmier soins patients hôpital clinique"),
+        ("C", "Comptable bilan fiscalité entreprise"),
+    ])
+    top_indices, similarities = scores(retriever, {"A": 1.0, "B": 0.9, "C": 0.8})
+    block_tokens = app_module.estimate_tokens(retriever.chunks[0])
+    packer = app_module.ContextPacker(token_budget=2 * block_tokens + 1)
+    _, selected_ids, report = packer.pack(retriever, top_indices, similarities)
+    assert selected_ids == ["A", "C"]
+    assert report["duplicates_dropped"] == 0
+
+def test_context_stays_within_the_token_budget(app_module):
+    units = [(f"R{i}", f"Métier {i}\n" + " ".join(f"mot{i}x{j}" for j in range(40))) for i in range(10)]
+    retriever = build(app_module, units)
+    top_indices, similarities = scores(retriever, {f"R{i}": 1.0 - i / 20 for i in range(10)})
+    block_tokens = app_module.estimate_tokens(retriever.chunks[0])
+    budget = 3 * block_tokens + 10
+    context, selected_ids, report = app_module.ContextPacker(token_budget=budget).pack(retriever, top_indices, similarities)
+    assert report["selected"] == 3
+    assert report["packed_tokens"] <= budget
+    assert selected_ids[0] == "R0"
+    assert report["tokens_saved"] == report["naive_tokens"] - report["packed_tokens"]
+
+def test_the_most_relevant_block_is_kept_even_over_budget(app_module):
+    retriever = build(app_module, [("R1", "Infirmier " * 50), ("R2", "Cuisinier")])
+    top_indices, similarities = scores(retriever, {"R1": 0.9, "R2": 0.5})
+    context, selected_ids, _ = app_module.ContextPacker(token_budget=5).pack(retriever, top_indices, similarities)
+    assert selected_ids == ["R1"]
@@ -0,0 +1,42 @@
+# Binary corpus snapshots: records decode back unchanged, with repeated values stored once
+import os
+
+from benchmarks.synthetic_corpus import write_corpora
+
+def test_snapshot_round_trip(app_module, tmp_path):
+    fiches_metiers_path, jobs_json_path = str(tmp_path / 'fiches-metiers.json'), str(tmp_path / 'jobs.json')
+    write_corpora(fiches_metiers_path, jobs_json_path, 150)
+    snapshot_dir = str(tmp_path / 'snapshots')
+    for kind, file_path, load_records in (("fiches_metiers", fiches_metiers_path, app_module.load_occupation_records),
+                                          ("jobs_json", jobs_json_path, app_module.load_esco_records)):
+        records = load_records(file_path)
+        snapshot = app_module.load_corpus_snapshot(kind, file_path, 'record', snapshot_dir)
+        assert len(snapshot) == len(records)
+        assert list(snapshot) == records
+        units = snapshot.units()
+        assert list(zip(units.ids, units.texts)) == app_module.occupation_units(records, 'record')
+
+def test_repeated_values_are_interned(app_module, tmp_path):
+    fiches_metiers_path = str(tmp_path / 'fiches-metiers.json')
+    write_corpora(fiches_metiers_path, str(tmp_path / 'jobs.json'), 150)
+    snapshot = app_module.load_corpus_snapshot("fiches_metiers", fiches_metiers_path, 'record', str(tmp_path / 's'))
+    records = list(snapshot)
+    # Sectors and list items (tools, skills...) repeat across records but are stored once
+    distinct = {record.sector_fr for record in records} | {tool for record in records for tool in record.tools}
+    assert set(snapshot.values) >= distinct
+    assert len(snapshot.values) == snapshot.meta["num_values"] == len(set(snapshot.values))
+    assert "sector_fr" in snapshot.interned_fields and "tools" in snapshot.list_fields
+
+def test_snapshot_is_rewritten_when_the_source_changes(app_module, tmp_path):
+    fiches_metiers_path = str(tmp_path / 'fiches-metiers.json')
+    write_corpora(fiches_metiers_path, str(tmp_path / 'jobs.json'), 20)
+    snapshot_dir = str(tmp_path / 'snapshots')
+    first = app_module.load_corpus_snapshot("fiches_metiers", fiches_metiers_path, 'record', snapshot_dir)
+    assert len(first) == 20
+    write_corpora(fiches_metiers_path, str(tmp_path / 'jobs.json'), 30, seed=1)
+    os.utime(fiches_metiers_path, ns=(0, os.stat(fiches_metiers_path).st_mtime_ns + 10**9))
+    second = app_module.load_corpus_snapshot("fiches_metiers", fiches_metiers_path, 'record', snapshot_dir)
+    assert len(second) == 30
+    assert list(second) == app_module.load_occupation_records(fiches_metiers_path)
+    # The previous version is removed once the new one is published
+    assert len([entry for entry in os.listdir(snapshot_dir) if entry.startswith("fiches_metiers-")]) == 1
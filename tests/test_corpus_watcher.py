@@ -0,0 +1,62 @@
+# CorpusWatcher: a changed corpus file is re-parsed incrementally and swapped in as a new index version
+import csv
+import os
+import random
+
+from benchmarks.synthetic_corpus import fiche_row, write_corpora
+
+def touch(path):
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+
+def test_changed_file_is_hot_swapped_after_settling(app_module, tmp_path, monkeypatch):
+    fiches_metiers_path, jobs_json_path = str(tmp_path / 'fiches-metiers.json'), str(tmp_path / 'jobs.json')
+    write_corpora(fiches_metiers_path, jobs_json_path, 50)
+    sources = {"fiches_metiers": (fiches_metiers_path, app_module.occupation_rows, app_module.occupation_record_from_row,
+                                  app_module.load_chunks_from_json),
+               "jobs_json": (jobs_json_path, app_module.esco_rows, app_module.esco_record_from_row,
+                             app_module.load_chunks_from_jobs_json)}
+    index_dir = str(tmp_path / 'index')
+    retrievers = {}
+    for name, (file_path, rows, record_from_row, load_chunks) in sources.items():
+        monkeypatch.setitem(app_module.CORPUS_SOURCES, name, (file_path, rows, record_from_row))
+        retrievers[name] = app_module.load_retriever(name, file_path, load_chunks, index_dir=index_dir)
+    monkeypatch.setattr(app_module, "_retrievers", retrievers)
+    monkeypatch.setattr(app_module, "_query_expander", None)
+    monkeypatch.setattr(app_module, "_bilingual_lexicon", None)
+    watcher = app_module.CorpusWatcher(interval=0, index_dir=index_dir)
+    watcher.prime()
+    assert watcher.check() is None
+
+    with open(fiches_metiers_path, 'a', encoding='utf-8', newline='') as file:
+        csv.writer(file).writerow(fiche_row(9999, random.Random(1)))
+    touch(fiches_metiers_path)
+    # The first check only sees the change; it is loaded once the file is stable
+    assert watcher.check() is None
+    report = watcher.check()
+    assert report["version"] == watcher.version == 2
+    assert report["corpora"]["fiches_metiers"]["parsed_rows"] == 1
+    assert report["corpora"]["fiches_metiers"]["added"] == 1
+    assert "jobs_json" not in report["corpora"]
+
+    served = app_module.get_retrievers()
+    assert served["jobs_json"] is retrievers["jobs_json"]
+    # Requests that started on the previous version keep it
+    assert len(retrievers["fiches_metiers"]) == 50 and len(served["fiches_metiers"]) == 51
+    assert served["fiches_metiers"].chunk_ids[-1] == "fm:9999"
+    _, top_indices, _ = served["fiches_metiers"].search(" ".join(fiche_row(9999, random.Random(1))[1:3]), top_n=1)
+    assert served["fiches_metiers"].chunk_ids[top_indices[0]] == "fm:9999"
+
+def test_touched_but_identical_file_is_not_reloaded(app_module, tmp_path, monkeypatch):
+    fiches_metiers_path, jobs_json_path = str(tmp_path / 'fiches-metiers.json'), str(tmp_path / 'jobs.json')
+    write_corpora(fiches_metiers_path, jobs_json_path, 20)
+    monkeypatch.setitem(app_module.CORPUS_SOURCES, "fiches_metiers",
+                        (fiches_metiers_path, app_module.occupation_rows, app_module.occupation_record_from_row))
+    monkeypatch.setitem(app_module.CORPUS_SOURCES, "jobs_json",
+                        (jobs_json_path, app_module.esco_rows, app_module.esco_record_from_row))
+    watcher = app_module.CorpusWatcher(interval=0, index_dir=str(tmp_path / 'index'))
+    watcher.state = {name: {"stat": app_module.source_fingerprint(path), "sha256": app_module.file_digest(path),
+                            "rows": {}}
+                     for name, path in (("fiches_metiers", fiches_metiers_path), ("jobs_json", jobs_json_path))}
+    touch(jobs_json_path)
+    assert watcher.changed_corpora(settle=False) == []
+    assert watcher.state["jobs_json"]["stat"] == app_module.source_fingerprint(jobs_json_path)
@@ -0,0 +1,48 @@
+# Dense retrieval: vector stores are built ahead of requests, never on the request path
+import numpy as np
+import pytest
+
+UNITS = [("1", "infirmier soins hôpital"), ("2", "cuisinier restaurant"), ("3", "infirmier urgences"),
+         ("4", "développeur logiciel")]
+
+class CountingEmbedder:
+    def __init__(self, app_module):
+        self.inner = app_module.HashingEmbedder(dimensions=64)
+        self.name = "counting-64"
+        self.documents = 0
+
+    def embed_documents(self, texts):
+        self.documents += len(texts)
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.inner.embed_query(text)
+
+@pytest.fixture
+def embedder(app_module, monkeypatch):
+    embedder = CountingEmbedder(app_module)
+    monkeypatch.setattr(app_module, "_embedder", embedder)
+    return embedder
+
+def test_request_without_store_falls_back_to_tfidf(app_module, embedder):
+    retrievers = {"dense_missing": app_module.TfidfRetriever.build("dense_missing", UNITS)}
+    for mode in ("dense", "hybrid"):
+        _, top_indices, similarities = app_module.retrieve("dense_missing", "infirmier", mode, top_n=2,
+                                                           retrievers=retrievers)
+        _, tfidf_top, tfidf_similarities = retrievers["dense_missing"].search("infirmier", top_n=2)
+        assert list(top_indices) == list(tfidf_top)
+        assert np.allclose(similarities, tfidf_similarities)
+    assert embedder.documents == 0
+    assert "dense" not in retrievers["dense_missing"].derived
+
+def test_store_built_ahead_is_used_without_embedding_the_corpus(app_module, embedder):
+    retrievers = {"dense_built": app_module.TfidfRetriever.build("dense_built", UNITS)}
+    app_module.get_dense_retrievers(retrievers)
+    assert embedder.documents == len(UNITS)
+    _, top_indices, _ = app_module.retrieve("dense_built", "infirmier urgences", "dense", top_n=1,
+                                            retrievers=retrievers)
+    assert list(top_indices) == [2]
+    # A later corpus version of the same content finds the store on disk, as a worker would after build-index
+    fresh = {"dense_built": app_module.TfidfRetriever.build("dense_built", UNITS)}
+    assert app_module.get_dense_retrievers(fresh, build=False)["dense_built"] is not None
+    assert embedder.documents == len(UNITS)
@@ -0,0 +1,56 @@
+# DriveSync against the in-memory Drive service: conditional, chunked and checksummed downloads
+import json
+
+import pytest
+
+from benchmarks.fakes import FakeDriveService
+
+@pytest.fixture
+def service():
+    service = FakeDriveService()
+    service.put("corpus", "ligne 1\nligne 2\n" * 100)
+    return service
+
+def test_first_sync_streams_the_file_in_chunks(app_module, service, tmp_path):
+    snapshot = tmp_path / "corpus.json"
+    drive_sync = app_module.DriveSync("corpus", str(snapshot), service=service, chunk_size=256)
+    assert drive_sync.sync() is True
+    content = service.files_by_id["corpus"]["content"]
+    assert snapshot.read_bytes() == content
+    assert service.media_requests == -(-len(content) // 256)
+    state = json.loads((tmp_path / "corpus.json.drive.json").read_text())
+    assert state["size"] == len(content) and state["id"] == "corpus"
+    assert not (tmp_path / "corpus.json.part").exists()
+
+def test_unchanged_file_only_fetches_metadata(app_module, service, tmp_path):
+    drive_sync = app_module.DriveSync("corpus", str(tmp_path / "corpus.json"), service=service)
+    drive_sync.sync()
+    media_requests = service.media_requests
+    assert drive_sync.sync() is False
+    assert service.media_requests == media_requests
+    assert service.metadata_requests == 2
+
+def test_changed_file_is_downloaded_again(app_module, service, tmp_path):
+    snapshot = tmp_path / "corpus.json"
+    drive_sync = app_module.DriveSync("corpus", str(snapshot), service=service)
+    drive_sync.sync()
+    service.put("corpus", "nouvelle version\n")
+    assert drive_sync.sync() is True
+    assert snapshot.read_text() == "nouvelle version\n"
+
+def test_checksum_mismatch_keeps_the_previous_snapshot(app_module, service, tmp_path, monkeypatch):
+    snapshot = tmp_path / "corpus.json"
+    drive_sync = app_module.DriveSync("corpus", str(snapshot), service=service)
+    drive_sync.sync()
+    previous = snapshot.read_bytes()
+    service.put("corpus", "nouvelle version\n")
+    # The metadata announces another file than the bytes served, as with a corrupted transfer
+    execute = type(service.files().get("corpus")).execute
+    monkeypatch.setattr(type(service.files().get("corpus")), "execute",
+                        lambda request: {**execute(request), "md5Checksum": "0" * 32})
+    with pytest.raises(ValueError):
+        drive_sync.sync()
+    assert snapshot.read_bytes() == previous
+    assert not (tmp_path / "corpus.json.part").exists()
+    # sync_corpora_from_drive logs the failure and reports nothing updated
+    assert app_module.sync_corpora_from_drive([drive_sync]) == []
@@ -0,0 +1,47 @@
+# TfidfRetriever.update: an incremental update matches a full refit of the new units
+import numpy as np
+
+OLD_UNITS = [("R1", "infirmier soins hôpital"), ("R2", "cuisinier restaurant cuisine"),
+             ("R3", "boulanger pain viennoiseries"), ("R4", "pilote avion transport aérien")]
+NEW_UNITS = [("R1", "infirmier soins hôpital"), ("R2", "cuisinier restaurant gastronomique"),
+             ("R4", "pilote avion transport aérien"), ("R5", "infirmier puériculteur soins enfants")]
+
+def term_weights(retriever, row):
+    terms = {column: term for term, column in retriever.vectorizer.vocabulary_.items()}
+    vector = retriever.chunk_vectors[row]
+    return {terms[column]: weight for column, weight in zip(vector.indices, vector.data)}
+
+def test_update_matches_full_refit(app_module):
+    old = app_module.TfidfRetriever.build("incremental", OLD_UNITS)
+    updated, report = old.update(NEW_UNITS)
+    refit = app_module.TfidfRetriever.build("incremental", NEW_UNITS)
+    assert report == {"added": 1, "changed": 1, "removed": 1, "unchanged": 2}
+    assert updated.chunk_ids == refit.chunk_ids and updated.chunks == refit.chunks
+    for row in range(len(NEW_UNITS)):
+        expected = term_weights(refit, row)
+        actual = term_weights(updated, row)
+        assert actual.keys() == expected.keys()
+        assert np.allclose([actual[term] for term in expected], list(expected.values()))
+
+def test_updated_index_ranks_like_a_refit(app_module):
+    updated, _ = app_module.TfidfRetriever.build("incremental", OLD_UNITS).update(NEW_UNITS)
+    refit = app_module.TfidfRetriever.build("incremental", NEW_UNITS)
+    for question in ("infirmier soins", "restaurant gastronomique", "transport avion"):
+        _, updated_top, updated_similarities = updated.search(question, top_n=4)
+        _, refit_top, refit_similarities = refit.search(question, top_n=4)
+        assert list(updated_top) == list(refit_top)
+        assert np.allclose(updated_similarities, refit_similarities)
+
+def test_unchanged_units_are_not_vectorized_again(app_module, monkeypatch):
+    old = app_module.TfidfRetriever.build("incremental", OLD_UNITS)
+    seen = []
+    count_vectorizer = app_module.sklearn_text.CountVectorizer
+
+    class RecordingCountVectorizer(count_vectorizer):
+        def transform(self, raw_documents):
+            seen.extend(raw_documents)
+            return super().transform(raw_documents)
+
+    monkeypatch.setattr(app_module.sklearn_text._module, "CountVectorizer", RecordingCountVectorizer)
+    old.update(NEW_UNITS)
+    assert seen == ["cuisinier restaurant gastronomique", "infirmier puériculteur soins enfants"]
@@ -0,0 +1,37 @@
+# The TF-IDF index is built once, saved, and reloaded until its source file changes
+import os
+
+import numpy as np
+
+UNITS = [("R1", "infirmier soins hôpital"), ("R2", "cuisinier restaurant"), ("R3", "pilote avion")]
+
+def test_saved_index_reloads_identically(app_module, tmp_path):
+    retriever = app_module.TfidfRetriever.build("persisted", UNITS, fingerprint={"size": 1})
+    retriever.save(str(tmp_path))
+    loaded = app_module.TfidfRetriever.load(str(tmp_path), "persisted", {"size": 1})
+    assert loaded.chunk_ids == retriever.chunk_ids and loaded.chunks == retriever.chunks
+    assert (loaded.chunk_vectors != retriever.chunk_vectors).nnz == 0
+    _, top_indices, similarities = loaded.search("infirmier soins", top_n=2)
+    _, expected_top, expected_similarities = retriever.search("infirmier soins", top_n=2)
+    assert list(top_indices) == list(expected_top)
+    assert np.allclose(similarities, expected_similarities)
+    # An index saved for another source version is not loaded
+    assert app_module.TfidfRetriever.load(str(tmp_path), "persisted", {"size": 2}) is None
+
+def test_load_retriever_only_builds_when_the_source_changes(app_module, tmp_path, monkeypatch):
+    source = tmp_path / "corpus.txt"
+    source.write_text("v1", encoding="utf-8")
+    builds = []
+    build = app_module.TfidfRetriever.build.__func__
+    monkeypatch.setattr(app_module.TfidfRetriever, "build",
+                        classmethod(lambda cls, *args, **kwargs: builds.append(args[0]) or build(cls, *args, **kwargs)))
+    load_units = lambda file_path, granularity: list(UNITS)
+    index_dir = str(tmp_path / "index")
+    first = app_module.load_retriever("persisted", str(source), load_units, index_dir=index_dir)
+    second = app_module.load_retriever("persisted", str(source), load_units, index_dir=index_dir)
+    assert builds == ["persisted"]
+    assert second.chunk_ids == first.chunk_ids
+    source.write_text("version 2", encoding="utf-8")
+    os.utime(source, ns=(0, os.stat(source).st_mtime_ns + 10**9))
+    app_module.load_retriever("persisted", str(source), load_units, index_dir=index_dir)
+    assert builds == ["persisted", "persisted"]
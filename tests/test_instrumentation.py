@@ -0,0 +1,41 @@
+# Stage spans, token counters and the per-stage timings of /generate_chunks
+import pytest
+
+from benchmarks.fakes import FakeChatModel
+
+def sample(app_module, name, **labels):
+    return app_module.metrics_registry._resolve().get_sample_value(name, labels) or 0.0
+
+def test_span_observes_its_duration_and_counts_errors(app_module):
+    observed = sample(app_module, 'rag_stage_duration_seconds_count', stage='test_stage', cache='none')
+    with app_module.span("test_stage") as attributes:
+        attributes["rows"] = 3
+    with pytest.raises(RuntimeError):
+        with app_module.span("test_stage"):
+            raise RuntimeError("boom")
+    assert sample(app_module, 'rag_stage_duration_seconds_count', stage='test_stage', cache='none') == observed + 2
+    assert sample(app_module, 'rag_stage_errors_total', stage='test_stage') == 1
+
+def test_token_usage_is_read_from_the_provider_response(app_module):
+    model = FakeChatModel(completion_tokens=7)
+    response = model.invoke("x" * 400)
+    attributes = {"stage": "test_tokens"}
+    app_module.record_token_usage(attributes, "x" * 400, response)
+    assert attributes["prompt_tokens"] == 100 and attributes["completion_tokens"] == 7
+    assert sample(app_module, 'rag_llm_tokens_total', stage='test_tokens', kind='completion') == 7
+    # Without provider usage, tokens are estimated from the text
+    attributes = {"stage": "test_tokens"}
+    app_module.record_token_usage(attributes, "x" * 40, completion_text="y" * 8)
+    assert attributes["prompt_tokens"] == 10 and attributes["completion_tokens"] == 2
+
+def test_generate_chunks_reports_stage_timings(served_app):
+    client, _ = served_app
+    response = client.post('/generate_chunks', json={"question": "Un métier dans la santé", "augmentation_mode": "llm",
+                                                     "translation_mode": "llm", "semantic_cache": False}).get_json()
+    timings = response["timings"]
+    assert {"augmentation", "translation", "load_corpora", "retrieve_fiches_metiers", "retrieve_jobs_json",
+            "pack_fiches_metiers", "pack_jobs_json", "total"} <= set(timings)
+    # The translation waits for the augmentation it translates (timings are rounded to 0.01 ms)
+    augmentation = timings["augmentation"]
+    assert timings["translation"]["start_ms"] >= augmentation["start_ms"] + augmentation["duration_ms"] - 0.02
+    assert timings["total"]["overlap_saved_ms"] >= 0
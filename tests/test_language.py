@@ -0,0 +1,68 @@
+# Stopword-based language detection, which lets CombinedChain skip the translation pass
+import pytest
+
+FRENCH_ANSWER = """Secteur de la santé
+- Infirmier en soins généraux : travail en équipe de soins à l'hôpital, formation en haute école.
+- Technologue de laboratoire médical : analyses de précision, diplôme de bachelier en biologie médicale.
+- Kinésithérapeute : rééducation des patients, master en kinésithérapie."""
+
+ANSWERS = {
+    "French": FRENCH_ANSWER,
+    "Spanish": "Sector de la salud\n- Enfermero en cuidados generales: trabajo en equipo de la unidad de cuidados "
+               "en el hospital, formación en la universidad.\n- Técnico de laboratorio: análisis de precisión, es un "
+               "trabajo muy técnico para personas con paciencia.",
+    "Dutch": "Sector van de gezondheidszorg\n- Verpleegkundige: werken in een team op de afdeling van het ziekenhuis, "
+             "opleiding aan de hogeschool.\n- Laborant: analyses met precisie, dit is een technische job voor mensen "
+             "die nauwkeurig zijn.",
+    "English": "The health sector offers many jobs. A nurse works with a team in the hospital and can train at a "
+               "college for these roles.",
+    "German": "Im Gesundheitswesen gibt es viele Berufe. Eine Pflegekraft arbeitet mit dem Team auf der Station und "
+              "wird an der Hochschule ausgebildet, und sie ist auch für die Patienten da.",
+}
+
+@pytest.mark.parametrize("language", sorted(ANSWERS))
+def test_detects_structured_answers(app_module, language):
+    assert app_module.detect_language(ANSWERS[language]) == language
+
+def test_unsure_on_short_or_symbol_text(app_module):
+    assert app_module.detect_language("Infirmier, kinésithérapeute") is None
+    assert app_module.detect_language("÷ ÷ ÷ 42") is None
+    assert app_module.detect_language("") is None
+
+class _Chain:
+    def __init__(self, output):
+        self.output = output
+        self.calls = 0
+
+    def invoke(self, input_data):
+        self.calls += 1
+        return self.output
+
+def test_french_answer_skips_the_translation_pass(app_module):
+    translation_chain = _Chain("traduction")
+    chain = app_module.CombinedChain(_Chain(FRENCH_ANSWER), translation_chain)
+    answer = chain.invoke({"context1": "", "context2": "", "question": "Quels métiers de la santé ?", "language": "French"})
+    assert answer == FRENCH_ANSWER
+    assert translation_chain.calls == 0
+    assert chain.stats()["native"] == 1
+
+def test_answer_in_a_language_the_detector_does_not_know_is_kept(app_module):
+    # Italian shares enough function words with Spanish to be detected as Spanish
+    italian = ("Settore della sanità\n- Infermiere: lavora con una squadra al reparto, come professionista della cura. "
+               "La formazione si svolge in una scuola superiore o all'università, con un tirocinio.\n"
+               "- Tecnico di laboratorio: esegue le analisi con precisione, lo strumento è al centro del lavoro, "
+               "e la carriera può evolvere come responsabile del laboratorio.")
+    assert app_module.detect_language(italian) == "Spanish"
+    translation_chain = _Chain("traduzione")
+    chain = app_module.CombinedChain(_Chain("risposta"), translation_chain, direct_language_chain=_Chain(italian))
+    answer = chain.invoke({"context1": "", "context2": "", "question": "Quali mestieri ?", "language": "Italian"})
+    assert answer == italian
+    assert translation_chain.calls == 0
+    assert chain.stats()["direct_language"] == 1
+
+def test_answer_in_the_wrong_known_language_is_translated(app_module):
+    translation_chain = _Chain("Réponse traduite")
+    chain = app_module.CombinedChain(_Chain(ANSWERS["Spanish"]), translation_chain)
+    answer = chain.invoke({"context1": "", "context2": "", "question": "Quels métiers ?", "language": "French"})
+    assert answer == "Réponse traduite"
+    assert chain.stats()["translated"] == 1
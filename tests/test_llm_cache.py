@@ -0,0 +1,46 @@
+# LLM response cache: in-memory LRU in front of a persistent SQLite tier
+from benchmarks.fakes import FakeChatModel
+
+def test_responses_survive_a_restart(app_module, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = app_module.LLMResponseCache(path)
+    model = FakeChatModel()
+    key = cache.key(model, "prompt")
+    assert cache.lookup(key) == (None, "miss")
+    cache.set(key, "réponse", model.model_name)
+    assert cache.lookup(key) == ("réponse", "memory_hit")
+    assert app_module.LLMResponseCache(path).lookup(key) == ("réponse", "disk_hit")
+
+def test_key_depends_on_the_model_and_the_prompt(app_module):
+    key = app_module.LLMResponseCache.key
+    assert key(FakeChatModel(), "prompt") == key(FakeChatModel(), "prompt")
+    assert key(FakeChatModel(), "prompt") != key(FakeChatModel(), "other prompt")
+    assert key(FakeChatModel(), "prompt") != key(FakeChatModel(model_name="other-model"), "prompt")
+
+def test_expired_entries_are_misses(app_module, tmp_path, monkeypatch):
+    cache = app_module.LLMResponseCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+    cache.set("key", "réponse")
+    now = app_module.time.time()
+    monkeypatch.setattr(app_module.time, "time", lambda: now + 61)
+    assert cache.lookup("key") == (None, "miss")
+
+def test_both_tiers_are_bounded(app_module, tmp_path):
+    cache = app_module.LLMResponseCache(str(tmp_path / "cache.sqlite3"), max_memory_entries=2, max_disk_entries=3)
+    for index in range(5):
+        cache.set(f"key{index}", f"value{index}")
+    stats = cache.stats()
+    assert stats["memory_entries"] == 2 and stats["disk_entries"] == 3
+    assert list(cache.memory) == ["key3", "key4"]
+    assert cache.lookup("key0") == (None, "miss")
+    assert cache.lookup("key2") == ("value2", "disk_hit")
+
+def test_repeated_augmentation_calls_the_model_once(app_module, tmp_path):
+    model = FakeChatModel(model_name="fake-augmentation-model")
+    chain = app_module.AugmentationChain(app_module.augmentation_prompt, model,
+                                         app_module.LLMResponseCache(str(tmp_path / "cache.sqlite3")))
+    first = chain.invoke({"question": "Quels métiers dans la santé ?", "mode": "llm"})
+    second = chain.invoke({"question": "Quels métiers dans la santé ?", "mode": "llm"})
+    assert first == second
+    assert model.calls == 1
+    chain.invoke({"question": "Quels métiers dans la finance ?", "mode": "llm"})
+    assert model.calls == 2
@@ -0,0 +1,121 @@
+# LLMGateway against the local OpenAI-compatible stub server: retries, hedging, limiter and circuit breaker
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.fakes import StubOpenAIServer
+
+@pytest.fixture
+def stub():
+    with StubOpenAIServer(completion_tokens=5) as server:
+        yield server
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+@pytest.fixture
+def make_gateway(app_module, stub, executor):
+    def make(limiter=None, breaker=None, **options):
+        client = app_module.langchain_openai.ChatOpenAI(openai_api_key="test", model="stub-chat-model",
+                                                        openai_api_base=stub.base_url, max_retries=0, timeout=5)
+        options = {"deadline": 5, "backoff": 0.01, "backoff_max": 0.05, **options}
+        return app_module.LLMGateway(client, limiter or app_module.LLMLimiter(max_concurrency=4, rate=0),
+                                     breaker or app_module.CircuitBreaker(), executor, **options)
+    return make
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.01)
+
+def test_retries_retryable_failures_with_backoff(make_gateway, stub):
+    stub.failures = [503, 429]
+    gateway = make_gateway(max_retries=2)
+    assert gateway.invoke("Bonjour").content
+    assert stub.requests == 3
+    assert gateway.counts["retries"] == 2
+    assert gateway.counts["failures"] == 0
+
+def test_does_not_retry_client_errors(app_module, make_gateway, stub):
+    stub.failures = [400]
+    gateway = make_gateway(max_retries=2)
+    with pytest.raises(Exception) as raised:
+        gateway.invoke("Bonjour")
+    assert getattr(raised.value, 'status_code', None) == 400
+    assert stub.requests == 1
+    assert gateway.counts["failures"] == 1
+
+def test_gives_up_after_max_retries(make_gateway, stub):
+    stub.failures = [503, 503, 503]
+    gateway = make_gateway(max_retries=1)
+    with pytest.raises(Exception) as raised:
+        gateway.invoke("Bonjour")
+    assert getattr(raised.value, 'status_code', None) == 503
+    assert stub.requests == 2
+
+def test_slow_hedge_wins_after_the_primary_fails(app_module, make_gateway, stub, monkeypatch):
+    # The primary fails at 0.5 s while the hedge sent at 0.2 s answers at 0.7 s
+    stub.latency = 0.5
+    stub.failures = [503]
+    waits = []
+    real_wait = app_module.wait
+    def counting_wait(futures, *args, **kwargs):
+        waits.append(len(futures))
+        return real_wait(futures, *args, **kwargs)
+    monkeypatch.setattr(app_module, 'wait', counting_wait)
+    gateway = make_gateway(max_retries=0, hedge_delay=0.2)
+    assert gateway.invoke("Bonjour").content
+    assert stub.requests == 2
+    assert gateway.counts["hedges"] == 1
+    assert gateway.counts["hedge_wins"] == 1
+    # Waiting only on the pending hedge once the primary failed, instead of spinning on the failed future
+    assert len(waits) <= 4
+    assert waits[-1] == 1
+
+def test_full_limiter_queue_raises_overloaded(app_module, make_gateway, stub, executor):
+    stub.latency = 0.5
+    limiter = app_module.LLMLimiter(max_concurrency=1, rate=0, max_queue=1)
+    gateway = make_gateway(limiter=limiter, max_retries=0)
+    running = executor.submit(gateway.invoke, "Bonjour")
+    wait_until(lambda: limiter.in_flight == 1)
+    queued = executor.submit(gateway.invoke, "Salut")
+    wait_until(lambda: limiter.waiting == 1)
+    with pytest.raises(app_module.LLMOverloaded):
+        gateway.invoke("Coucou")
+    assert running.result().content and queued.result().content
+    assert limiter.stats()["in_flight"] == 0 and limiter.stats()["queued"] == 0
+
+def test_breaker_opens_half_opens_and_closes(app_module, make_gateway, stub, executor):
+    breaker = app_module.CircuitBreaker(failure_threshold=2, reset_timeout=0.3)
+    gateway = make_gateway(breaker=breaker, max_retries=0)
+    stub.failures = [503, 503, 503]
+    for _ in range(2):
+        with pytest.raises(Exception):
+            gateway.invoke("Bonjour")
+    assert breaker.state == "open"
+    with pytest.raises(app_module.CircuitOpenError):
+        gateway.invoke("Bonjour")
+    assert stub.requests == 2
+
+    # After the reset timeout one trial call goes through; its failure reopens the circuit
+    time.sleep(0.35)
+    with pytest.raises(Exception) as raised:
+        gateway.invoke("Bonjour")
+    assert getattr(raised.value, 'status_code', None) == 503
+    assert breaker.state == "open" and stub.requests == 3
+
+    # The next trial succeeds; calls made while it is in flight still fail fast
+    time.sleep(0.35)
+    stub.latency = 0.3
+    trial = executor.submit(gateway.invoke, "Bonjour")
+    wait_until(lambda: breaker.state == "half_open")
+    with pytest.raises(app_module.CircuitOpenError):
+        gateway.invoke("Salut")
+    assert trial.result().content
+    assert breaker.state == "closed" and breaker.failures == 0
+    assert stub.requests == 4
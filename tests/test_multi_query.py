@@ -0,0 +1,24 @@
+# Multi-query retrieval: reciprocal rank fusion over the sparse per-query score columns
+import numpy as np
+from scipy import sparse
+
+def test_rrf_fuses_sparse_columns(app_module):
+    # 4 chunks x 2 queries; chunk 3 matches neither query and chunk 2 only the second
+    scores = sparse.csc_matrix(np.array([[0.9, 0.1], [0.5, 0.0], [0.0, 0.8], [0.0, 0.0]]))
+    fused = app_module.rrf_over_columns(scores, pool=50, k=60)
+    expected = [1 / 61 + 1 / 62, 1 / 62, 1 / 61, 0.0]
+    assert np.allclose(fused, expected)
+
+def test_rrf_pool_limits_each_column(app_module):
+    scores = sparse.csc_matrix(np.array([[0.9], [0.5], [0.3]]))
+    assert np.allclose(app_module.rrf_over_columns(scores, pool=2, k=0), [1.0, 0.5, 0.0])
+
+def test_search_many_rrf_ranks_chunks_matching_most_queries_first(app_module):
+    units = [("1", "infirmier soins hôpital"), ("2", "cuisinier restaurant"), ("3", "infirmier urgences"),
+             ("4", "soins à domicile infirmier")]
+    retriever = app_module.TfidfRetriever.build("test", units)
+    _, top_indices, similarities = retriever.search_many(["infirmier soins", "soins hôpital", "cuisinier"],
+                                                         top_n=4, aggregation="rrf")
+    assert top_indices[0] == 0
+    assert similarities[1] > 0
+    assert isinstance(similarities, np.ndarray) and similarities.shape == (4,)
@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+
+def test_stages_receive_dependency_results(app_module):
+    executor = app_module.PipelineExecutor(max_workers=2, llm_workers=1)
+    results, timings = executor.run({
+        "a": (lambda: 2, []),
+        "b": (lambda a: a * 3, ["a"]),
+        "c": (lambda a, b: a + b, ["a", "b"]),
+    }, llm_stages=("b",))
+    assert results == {"a": 2, "b": 6, "c": 8}
+    assert set(timings) == {"a", "b", "c", "total"}
+
+
+def test_llm_stages_do_not_hold_local_workers(app_module):
+    # One local worker: if the waiting model stages ran on it, the local stage could never start
+    executor = app_module.PipelineExecutor(max_workers=1, llm_workers=2)
+    released = threading.Event()
+    thread_names = {}
+
+    def waiting_on_model(name):
+        thread_names[name] = threading.current_thread().name
+        return released.wait(timeout=5)
+
+    def local():
+        thread_names["local"] = threading.current_thread().name
+        released.set()
+        return True
+
+    results, _ = executor.run({
+        "augmentation": (lambda: waiting_on_model("augmentation"), []),
+        "translation": (lambda: waiting_on_model("translation"), []),
+        "load_corpora": (local, []),
+    }, llm_stages=("augmentation", "translation"))
+    assert results == {"augmentation": True, "translation": True, "load_corpora": True}
+    assert thread_names["local"].startswith("pipeline_")
+    assert thread_names["augmentation"].startswith("pipeline-llm")
+
+
+def test_failing_stage_raises_pipeline_error(app_module):
+    executor = app_module.PipelineExecutor(max_workers=1, llm_workers=1)
+    with pytest.raises(app_module.PipelineError) as raised:
+        executor.run({"a": (lambda: 1 / 0, []), "b": (lambda a: a, ["a"])})
+    assert raised.value.stage == "a"
+    assert isinstance(raised.value.error, ZeroDivisionError)
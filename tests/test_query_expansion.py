@@ -0,0 +1,44 @@
+# Fast augmentation: query expansion from term associations mined in the corpora, without a model call
+import pytest
+
+from benchmarks.fakes import FakeChatModel
+from benchmarks.synthetic_corpus import write_corpora
+
+@pytest.fixture(scope="module")
+def records(app_module, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("expansion")
+    fiches_metiers_path, jobs_json_path = str(directory / 'fiches-metiers.json'), str(directory / 'jobs.json')
+    write_corpora(fiches_metiers_path, jobs_json_path, 200)
+    return app_module.load_occupation_records(fiches_metiers_path), app_module.load_esco_records(jobs_json_path)
+
+@pytest.fixture(scope="module")
+def expander(app_module, records):
+    return app_module.QueryExpander.build(*records)
+
+def test_expansion_adds_one_line_per_expanded_word(expander):
+    question = "Je cherche un métier en logistique avec Excel"
+    lines = expander.expand(question, terms_per_word=3).splitlines()
+    assert lines[0] == question
+    expanded = {line.split()[0]: line.split()[1:] for line in lines[1:]}
+    assert set(expanded) <= {"cherche", "métier", "logistique", "excel"}
+    # The sector is named in French and English in the same records, so the two are associated
+    assert "logistics" in expanded["logistique"]
+    assert all(len(terms) <= 3 for terms in expanded.values())
+    assert len({term for terms in expanded.values() for term in terms}) == sum(map(len, expanded.values()))
+
+def test_inflected_forms_are_grouped_by_stem(expander):
+    assert {"analyste", "analyst"} <= set(expander.variants["analys"])
+
+def test_tables_reload_only_for_the_same_corpus_version(app_module, expander, tmp_path):
+    path = str(tmp_path / "expansion.json")
+    app_module.QueryExpander(expander.neighbours, expander.variants, {"fiches_metiers": {"size": 1}}).save(path)
+    loaded = app_module.QueryExpander.load(path, {"fiches_metiers": {"size": 1}})
+    assert loaded.expand("métier logistique") == expander.expand("métier logistique")
+    assert app_module.QueryExpander.load(path, {"fiches_metiers": {"size": 2}}) is None
+
+def test_fast_augmentation_makes_no_model_call(app_module, expander):
+    model = FakeChatModel()
+    chain = app_module.AugmentationChain(app_module.augmentation_prompt, model, expander=lambda: expander)
+    augmented = chain.invoke({"question": "métier en logistique", "mode": "fast"})
+    assert augmented == expander.expand("métier en logistique")
+    assert model.calls == 0
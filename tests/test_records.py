@@ -0,0 +1,42 @@
+# Record-aware ingestion: corpus rows parse into occupation records, indexed one unit per record
+import csv
+
+ROW = ["28", "Infirmier-en-Santé", "Nurse", "Santé-et-social", "Health_social",
+       "Un infirmier soigne les patients.", "Soigner les patients, Préparer les traitements, la nuit comprise",
+       "Anatomie,Pharmacologie.", "Seringue, Tensiomètre.", "", "", "École A; École B"]
+
+def test_row_parses_into_a_record_with_list_fields(app_module):
+    record = app_module.occupation_record_from_row(ROW)
+    assert record.record_id == "fm:28"
+    assert record.title_fr == "Infirmier en Santé"
+    # Commas inside a sentence are kept, list items start with a capital
+    assert record.responsibilities == ["Soigner les patients", "Préparer les traitements, la nuit comprise"]
+    assert record.tools == ["Seringue", "Tensiomètre"]
+    assert record.schools == ["École A", "École B"]
+    assert record.trend_4 == ""
+
+def test_blank_rows_are_skipped(app_module):
+    assert app_module.occupation_record_from_row([]) is None
+    assert app_module.occupation_record_from_row(["", " ", ""]) is None
+    assert app_module.esco_record_from_row({"ESCO UID": " ", "description_en": "x"}) is None
+
+def test_one_unit_per_record_or_per_field_group(app_module):
+    record = app_module.occupation_record_from_row(ROW)
+    [(unit_id, text)] = app_module.occupation_units([record], granularity='record')
+    assert unit_id == "fm:28"
+    assert "Responsabilités: Soigner les patients, Préparer les traitements, la nuit comprise" in text
+    assert "Tendance" not in text
+    units = dict(app_module.occupation_units([record], granularity='fields'))
+    # Field groups with no value are not indexed; every unit keeps the occupation title
+    assert sorted(units) == ["fm:28#carriere", "fm:28#missions", "fm:28#profil"]
+    assert all(text.startswith("Nom du métier: Infirmier en Santé") for text in units.values())
+
+def test_corpus_files_load_as_units(app_module, tmp_path):
+    fiches = tmp_path / "fiches.json"
+    with open(fiches, "w", encoding="utf-8", newline="") as file:
+        csv.writer(file).writerows([ROW, [], ["29", "Cuisinier"]])
+    jobs = tmp_path / "jobs.json"
+    jobs.write_text("ESCO UID\tdescription_en\nchef\tCooks meals.\n\tno uid\n", encoding="utf-8")
+    assert [unit_id for unit_id, _ in app_module.occupation_units(app_module.load_occupation_records(str(fiches)))] \
+        == ["fm:28", "fm:29"]
+    assert app_module.occupation_units(app_module.load_esco_records(str(jobs))) == [("esco:chef", "chef: Cooks meals.")]
@@ -0,0 +1,38 @@
+# Server-side retrieval sessions: bounded, expiring, and shareable between workers through SQLite
+import pytest
+
+SESSION = {"augmented_question": "Quels métiers ?", "fiches_metiers_ids": ["fm:1"], "jobs_json_ids": ["esco:a"]}
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, app_module, tmp_path):
+    path = str(tmp_path / "sessions.sqlite3") if request.param == "sqlite" else None
+    return lambda **kwargs: app_module.RetrievalSessionStore(path=path, **kwargs)
+
+def test_session_round_trip(make_store):
+    store = make_store()
+    session_id = store.put(SESSION)
+    assert store.get(session_id) == SESSION
+    assert store.get("unknown") is None
+
+def test_least_recently_used_sessions_are_evicted(make_store, app_module, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(app_module.time, "time", lambda: float(next(clock)))
+    store = make_store(max_sessions=2)
+    first, second = store.put(SESSION), store.put(SESSION)
+    store.get(first)
+    third = store.put(SESSION)
+    assert store.get(second) is None
+    assert store.get(first) == SESSION and store.get(third) == SESSION
+    assert len(store) == 2
+
+def test_idle_sessions_expire(make_store, app_module, monkeypatch):
+    store = make_store(idle_ttl=10)
+    now = app_module.time.time()
+    session_id = store.put(SESSION)
+    monkeypatch.setattr(app_module.time, "time", lambda: now + 11)
+    assert store.get(session_id) is None
+
+def test_workers_share_sqlite_sessions(app_module, tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    session_id = app_module.RetrievalSessionStore(path=path).put(SESSION)
+    assert app_module.RetrievalSessionStore(path=path).get(session_id) == SESSION
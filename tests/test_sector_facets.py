@@ -0,0 +1,59 @@
+# Sector facets: per-sector bitmaps over the fiches-metiers units, used to pre-filter retrieval
+import pytest
+
+@pytest.fixture
+def corpus(app_module):
+    records = [
+        app_module.OccupationRecord(number="1", slug="Infirmier", sector_fr="Santé-et-social", sector_en="Health_social",
+                                    description="Soins aux patients à l'hôpital"),
+        app_module.OccupationRecord(number="2", slug="Cuisinier", sector_fr="Hôtellerie-restauration-et-tourisme",
+                                    sector_en="Hotels_restaurants_tourism", description="Cuisine au restaurant"),
+        app_module.OccupationRecord(number="3", slug="Aide-soignant", sector_fr="Santé-et-social",
+                                    sector_en="Health_social", description="Soins aux patients en maison de repos"),
+        app_module.OccupationRecord(number="4", slug="Comptable", sector_fr="Finance-et-assurance",
+                                    sector_en="Finance_insurance", description="Bilan et fiscalité"),
+    ]
+    retriever = app_module.TfidfRetriever.build("fiches_metiers",
+                                                app_module.occupation_units(records, granularity='fields'))
+    facets = app_module.SectorFacets.build(retriever, records)
+    retriever.derived["facets"] = facets
+    return {"fiches_metiers": retriever}, facets
+
+def test_bitmaps_hold_the_rows_of_each_sector(app_module, corpus):
+    retrievers, facets = corpus
+    retriever = retrievers["fiches_metiers"]
+    [health] = facets.resolve(["Santé-et-social"])
+    rows = facets.rows([health])
+    assert {app_module.record_key(retriever.chunk_ids[row]) for row in rows} == {"fm:1", "fm:3"}
+    # Every unit of a record (one per field group) is in its sector
+    assert len(rows) == sum(1 for chunk_id in retriever.chunk_ids if chunk_id.startswith(("fm:1#", "fm:3#")))
+    assert {entry["sector"]: entry["units"] for entry in facets.describe()}["Santé-et-social"] == len(rows)
+
+def test_sectors_resolve_from_french_or_english_names(corpus):
+    _, facets = corpus
+    assert facets.resolve(["sante et social"]) == facets.resolve(["Health social"])
+    with pytest.raises(ValueError):
+        facets.resolve(["Aéronautique"])
+
+def test_sector_is_inferred_from_the_question(corpus):
+    _, facets = corpus
+    assert facets.infer("Quels métiers dans la restauration ?") == facets.resolve(["Hotels_restaurants_tourism"])
+    assert facets.infer("Quels métiers me conseillez-vous ?") == []
+
+def test_filtered_retrieval_only_returns_units_of_the_sector(app_module, corpus):
+    retrievers, facets = corpus
+    retriever = retrievers["fiches_metiers"]
+    sector_ids = facets.resolve(["Santé-et-social"])
+    (_, top_indices, _), applied = app_module.retrieve_in_sectors("soins aux patients", sector_ids, "explicit",
+                                                                  "tfidf", "max", retrievers)
+    assert applied == sector_ids
+    assert {app_module.record_key(retriever.chunk_ids[i]) for i in top_indices} <= {"fm:1", "fm:3"}
+
+def test_inferred_filter_without_matches_falls_back_to_the_whole_corpus(app_module, corpus):
+    retrievers, facets = corpus
+    retriever = retrievers["fiches_metiers"]
+    sector_ids = facets.resolve(["Finance-et-assurance"])
+    (_, top_indices, similarities), applied = app_module.retrieve_in_sectors("cuisine restaurant", sector_ids,
+                                                                             "inferred", "tfidf", "max", retrievers)
+    assert applied == []
+    assert app_module.record_key(retriever.chunk_ids[top_indices[0]]) == "fm:2"
@@ -0,0 +1,47 @@
+# Semantic answer cache partitions: a cached retrieval only serves requests with the same retrieval settings
+import pytest
+
+QUESTION = "Quels métiers dans l'hôtellerie pour quelqu'un qui aime le service client ?"
+
+@pytest.fixture
+def retrievers(app_module):
+    return {name: app_module.TfidfRetriever(name, [], []) for name in ("fiches_metiers", "jobs_json")}
+
+@pytest.fixture
+def cache(app_module):
+    cache = app_module.SemanticAnswerCache(vectors='embeddings')
+    cache.embedder = app_module.HashingEmbedder()
+    return cache
+
+def test_entries_only_match_their_partition(app_module, cache, retrievers):
+    tfidf = app_module.semantic_cache_partition("tfidf", infer_sectors=True)
+    bm25 = app_module.semantic_cache_partition("bm25", infer_sectors=True)
+    no_inference = app_module.semantic_cache_partition("tfidf", infer_sectors=False)
+    entry_id = cache.put(QUESTION, retrievers, {"question": QUESTION}, partition=tfidf)
+    assert cache.lookup(QUESTION, retrievers, tfidf)[0] == entry_id
+    for other in (bm25, no_inference, None):
+        assert cache.lookup(QUESTION, retrievers, other)[1] is None
+
+    # The best match of the partition is found even when another partition holds a closer question
+    closer_id = cache.put(QUESTION, retrievers, {"question": QUESTION}, partition=bm25)
+    assert cache.lookup(QUESTION, retrievers, tfidf)[0] == entry_id
+    assert cache.lookup(QUESTION, retrievers, bm25)[0] == closer_id
+
+def test_partition_resolves_defaults(app_module):
+    partition = app_module.semantic_cache_partition
+    assert partition("tfidf") == partition("tfidf", "rrf", app_module.AUGMENTATION_MODE, app_module.TRANSLATION_MODE)
+    assert partition("multi", "max") != partition("multi", "rrf")
+    assert partition("tfidf", augmentation_mode="fast") != partition("tfidf", augmentation_mode="llm")
+    assert partition("tfidf", translation_mode="local") != partition("tfidf", translation_mode="llm")
+
+def test_sessions_without_partition_are_not_cached(app_module, cache, retrievers, monkeypatch):
+    monkeypatch.setattr(app_module, 'semantic_answer_cache', cache)
+    monkeypatch.setattr(app_module, 'get_retrievers', lambda: retrievers)
+    session = {"question": QUESTION, "semantic_cache_id": None, "semantic_cache_partition": None}
+    app_module.remember_session_answer(session, "French", "Réponse")
+    assert cache.stats()["entries"] == 0
+    partition = app_module.semantic_cache_partition("bm25")
+    app_module.remember_session_answer({**session, "semantic_cache_partition": partition}, "French", "Réponse")
+    entry_id, entry, _ = cache.lookup(QUESTION, retrievers, partition)
+    assert entry["answers"] == {"French": "Réponse"}
+    assert "semantic_cache_partition" not in entry["retrieval"]
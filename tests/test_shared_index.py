@@ -0,0 +1,30 @@
+# Shared index for multi-worker serving: written once, then memory-mapped by every worker
+import numpy as np
+import pytest
+
+from benchmarks.synthetic_corpus import write_corpora
+from test_streaming_index import is_mapped
+
+def test_shared_index_is_mapped_and_matches_the_in_memory_index(app_module, tmp_path, monkeypatch):
+    fiches_metiers_path, jobs_json_path = str(tmp_path / 'fiches-metiers.json'), str(tmp_path / 'jobs.json')
+    write_corpora(fiches_metiers_path, jobs_json_path, 120)
+    index_dir = str(tmp_path / 'shared')
+    shared = app_module.load_shared_retriever("fiches_metiers", fiches_metiers_path, app_module.load_chunks_from_json,
+                                              index_dir=index_dir)
+    built = app_module.TfidfRetriever.build("fiches_metiers", app_module.load_chunks_from_json(fiches_metiers_path))
+    assert is_mapped(shared.chunk_vectors.data) and is_mapped(shared.vectorizer.idf_)
+    assert list(shared.chunk_ids) == built.chunk_ids
+    for question in ("technicien de maintenance", "ingénieur logiciel python"):
+        _, shared_top, shared_similarities = shared.search(question, top_n=10)
+        _, built_top, built_similarities = built.search(question, top_n=10)
+        assert list(shared_top) == list(built_top)
+        assert np.allclose(shared_similarities, built_similarities)
+    chunk_id = built.chunk_ids[3]
+    assert shared.index_of(chunk_id) == 3
+    assert shared.context_for([chunk_id]) == built.context_for([chunk_id])
+
+    # A second worker maps the index written by the first, without building anything
+    monkeypatch.setattr(app_module, "load_retriever", lambda *args, **kwargs: pytest.fail("index was rebuilt"))
+    again = app_module.load_shared_retriever("fiches_metiers", fiches_metiers_path, app_module.load_chunks_from_json,
+                                             index_dir=index_dir)
+    assert again.directory == shared.directory
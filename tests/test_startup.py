@@ -0,0 +1,34 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+from conftest import ROOT
+
+IMPORT_PROBE = """
+import importlib.util, json, sys
+spec = importlib.util.spec_from_file_location('rag_jobs_app', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(json.dumps({name: name in sys.modules for name in ('prometheus_client', 'hnswlib', 'sklearn', 'langchain')}))
+"""
+
+
+def test_module_import_leaves_heavy_dependencies_unloaded(tmp_path):
+    env = dict(os.environ, RAG_INDEX_DIR=str(tmp_path / 'index'), RAG_LLM_CACHE='0', RAG_SEMANTIC_CACHE='0')
+    result = subprocess.run([sys.executable, '-c', IMPORT_PROBE, os.path.join(ROOT, 'app-v3-git.py')],
+                            capture_output=True, text=True, env=env, cwd=str(tmp_path), check=True)
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    assert loaded == {'prometheus_client': False, 'hnswlib': False, 'sklearn': False, 'langchain': False}
+
+
+def test_metrics_export_declared_and_startup_gauges(app_module):
+    app_module.mark_startup("module_loaded")
+    response = app_module.app.test_client().get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    # Metrics are exported whether or not a request has touched them yet
+    assert re.search(r'^rag_drive_downloaded_bytes_total \d', body, re.MULTILINE)
+    assert 'rag_startup_seconds{phase="module_loaded"}' in body
+    assert f'rag_index_version {float(app_module.corpus_watcher.version)}' in body
@@ -0,0 +1,50 @@
+# Streamed (hashed, on-disk) indexes: BM25 postings written while streaming, and derived indexes
+# built without loading the corpus
+import mmap
+import os
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic_corpus import write_corpora
+
+@pytest.fixture
+def corpora(tmp_path):
+    fiches_metiers_path, jobs_json_path = str(tmp_path / 'fiches-metiers.json'), str(tmp_path / 'jobs.json')
+    write_corpora(fiches_metiers_path, jobs_json_path, 200)
+    return fiches_metiers_path, jobs_json_path
+
+@pytest.fixture
+def streamed(app_module, corpora, tmp_path):
+    directory = str(tmp_path / 'streamed' / 'fiches_metiers')
+    # Small batches and columns, so postings of one column are spread over several batches
+    app_module.build_streaming_index("fiches_metiers", app_module.stream_chunks_from_json(corpora[0]), directory,
+                                     batch_size=7, n_features=2 ** 12)
+    return app_module.TfidfRetriever.load_shared(directory)
+
+def is_mapped(array):
+    while array is not None:
+        if isinstance(array, mmap.mmap):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+def test_streamed_bm25_postings_match_an_in_memory_build(app_module, streamed):
+    mapped = app_module.load_bm25_index(streamed)
+    built = app_module.BM25Index.build(streamed)
+    assert is_mapped(mapped.postings.data) and is_mapped(mapped.postings.indices)
+    assert np.array_equal(mapped.postings.indptr, built.postings.indptr)
+    assert np.array_equal(mapped.postings.indices, built.postings.indices)
+    assert np.allclose(mapped.postings.data, built.postings.data, rtol=1e-5)
+    question = "technicien de maintenance industrielle"
+    assert mapped.search(question)[1].tolist() == built.search(question)[1].tolist()
+
+def test_streamed_facets_skip_the_corpus_snapshot(app_module, streamed, corpora, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, 'STREAMING_INDEX', True)
+    monkeypatch.setattr(app_module, 'FICHES_METIERS_PATH', corpora[0])
+    monkeypatch.setattr(app_module, 'SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+    facets = app_module.load_sector_facets(streamed, index_dir=str(tmp_path / 'index'))
+    expected = app_module.SectorFacets.build(streamed, app_module.load_occupation_records(corpora[0]))
+    assert facets.sectors == expected.sectors
+    assert np.array_equal(facets.bitmaps, expected.bitmaps)
+    assert not os.path.exists(tmp_path / 'snapshots')
@@ -0,0 +1,18 @@
+"""WSGI entry point for serving app-v3-git.py with several worker processes, e.g.
+
+    python app-v3-git.py build-index --shared
+    RAG_SHARED_INDEX=1 RAG_SESSION_PATH=~/coding/rag-cache/sessions.sqlite3 gunicorn -w 4 wsgi:app
+
+Workers map the shared index read-only instead of each building their own copy, and keep
+retrieval sessions in SQLite so /answer_question can land on any worker.
+"""
+import importlib.util
+import os
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app-v3-git.py')
+
+spec = importlib.util.spec_from_file_location('rag_jobs_app', APP_PATH)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+
+app = module.create_app()